@@ -1,15 +1,302 @@
 # app/api/v1/api.py
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse, StreamingResponse
-from app.schemas.llm import GenerateRequest
-from app.llm import generate_sync, generate_stream
+import hmac
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from app.batch import run_batch
+from app.core.accounting import estimate_tokens
+from app.core.admission import Ticket, admission
+from app.core.balancer import balancer
+from app.core.cache import response_cache
+from app.core.config import settings
+from app.core.coalesce import coalescing_stats
+from app.core.conversations import ConversationState, conversations
+from app.core.encoding import compress_stream, dumps, json_response, negotiate
+from app.core.lifecycle import CLIENT_DISCONNECT, Supervisor, deadline_s, supervise
+from app.core.profiler import ProfilerBusy, profiler
+from app.core.quota import Reservation, TenantInfo, quota_ledger
+from app.core.ratelimit import rate_limiter
+from app.core.request_log import request_log
+from app.core.resume import parse_event_id, resumable_streams
+from app.core.sse import sse_frame
+from app.core.timing import Timings, span, start_timings
+from app.schemas.llm import BatchGenerateRequest, CreateSessionRequest, GenerateRequest
+from app.llm import generate_async, generate_stream_async, normalize_messages, resolve_backends
 
 model_router = APIRouter(prefix="/v1", tags=["llm"])
 
+
+# 租户鉴权：Authorization: Bearer <key> 或 X-API-Key；未开启 TENANT_AUTH_ENABLED 时不校验
+async def require_tenant(request: Request) -> Optional[TenantInfo]:
+    if not settings.TENANT_AUTH_ENABLED:
+        return None
+    auth = request.headers.get("authorization", "")
+    key = auth[7:].strip() if auth[:7].lower() == "bearer " else request.headers.get("x-api-key", "")
+    tenant = quota_ledger.authenticate(key)
+    if tenant is None:
+        raise HTTPException(status_code=401, detail="无效的 API key", headers={"WWW-Authenticate": "Bearer"})
+    return tenant
+
+
+# 管理接口鉴权：未配置 ADMIN_TOKEN 时接口不可用（404）
+async def require_admin(request: Request) -> None:
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    auth = request.headers.get("authorization", "")
+    token = auth[7:].strip() if auth[:7].lower() == "bearer " else request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="无效的管理令牌", headers={"WWW-Authenticate": "Bearer"})
+
+
+# 调试头：开启本请求的分阶段计时，起点为请求到达时刻（见 app/core/timing.py）
+def _timings(request: Request) -> Optional[Timings]:
+    if not settings.TIMING_HEADER or not request.headers.get(settings.TIMING_HEADER):
+        return None
+    return start_timings(request.scope.get("arrived_at"))
+
+
+def _tenant_id(tenant: Optional[TenantInfo]) -> Optional[str]:
+    return tenant.id if tenant is not None else None
+
+
+def _estimate(req: GenerateRequest, conversation: Optional[ConversationState] = None) -> int:
+    try:
+        prompt = estimate_tokens(normalize_messages(req))
+    except ValueError:
+        prompt = 0  # 输入为空的请求交给生成路径报错
+    if conversation is not None:
+        budget = req.history_tokens if req.history_tokens is not None else settings.SESSION_HISTORY_TOKENS
+        prompt += min(conversation.tokens, budget)
+    # n 个候选按 n 次完整调用预扣（扇出时每次都计 prompt），结束后按实际用量结算
+    return (prompt + settings.RATE_LIMIT_EST_OUTPUT_TOKENS) * req.n
+
+
+# 流结束后按实际用量结算：流式看 done 事件的 usage，批量看末行 summary 的 total_tokens。
+# 没有 done / summary 时（客户端断开、超时、排空）按已下发部分计量（metered_of 逐帧累加，从 base 起算），
+# 且不少于预扣的估算，断开不能白拿输出；只有流自己结束且什么都没产出（如生成前就出错）才按 0 结算
+async def _settle_stream(stream: AsyncIterator[bytes], res: Reservation, done_prefix: bytes,
+                         usage_of: Callable[[bytes], int], metered_of: Callable[[bytes], int],
+                         base: int = 0) -> AsyncIterator[bytes]:
+    used: Optional[int] = None
+    metered = base
+    finished = False
+    try:
+        async for frame in stream:
+            if frame.startswith(done_prefix):
+                used = usage_of(frame) or 0
+            else:
+                metered += metered_of(frame)
+            yield frame
+        finished = True
+    finally:
+        if used is None:
+            used = 0 if finished and metered == base else max(res.tokens, metered)
+        quota_ledger.settle(res, used)
+
+
+def _sse_usage(frame: bytes) -> int:
+    # event: done\ndata: {...}\n\n
+    return orjson.loads(frame.split(b"\ndata: ", 1)[1]).get("usage", {}).get("total_tokens", 0)
+
+
+_DELTA_EVENT = b"event: delta\n"
+_DELTA_FRAMING = len(b'{"index":0,"delta":""}\n\n')
+
+
+def _sse_output(frame: bytes) -> int:
+    # delta 帧按正文字节粗估（约 4 字节 / token，同 estimate_tokens），不解析 JSON
+    if not frame.startswith(_DELTA_EVENT):
+        return 0
+    body = len(frame) - len(_DELTA_EVENT) - len(b"data: ") - _DELTA_FRAMING
+    return max(0, body + 3) // 4
+
+
+def _summary_usage(line: bytes) -> int:
+    return orjson.loads(line)["summary"].get("total_tokens", 0)
+
+
+def _item_usage(line: bytes) -> int:
+    # 已完成的一条：{"index": i, "response": {..., "usage": {...}}}
+    if b'"response":' not in line[:32]:
+        return 0
+    return orjson.loads(line)["response"].get("usage", {}).get("total_tokens") or 0
+
+
+# 流被终止（超时 / 排空）时的收尾帧：告诉客户端本次输出未完成及原因（见 app/core/lifecycle.py）
+def _sse_error(body: Dict[str, Any]) -> bytes:
+    return sse_frame("error", body)
+
+
+def _ndjson_error(body: Dict[str, Any]) -> bytes:
+    return dumps({"error": body}) + b"\n"
+
+
+def _with_compression(request: Request, stream: AsyncIterator[bytes], headers: Optional[Dict[str, str]]):
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if encoding is None:
+        return stream, headers
+    return compress_stream(stream, encoding), {**headers, "Content-Encoding": encoding}
+
+
+# async 路由：上游调用走 ainvoke/astream，不再占用 Starlette 线程池
 @model_router.post("/generate")
-def generate(req: GenerateRequest):
-    if req.stream:
-        return StreamingResponse(generate_stream(req), media_type="text/event-stream")
-    else:
-        out = generate_sync(req)
-        return JSONResponse(out.model_dump())
+async def generate(req: GenerateRequest, request: Request, tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    # 断线重连：回放错过的事件并跟随原来的生成，不占准入名额、不再预扣配额
+    last_event_id = request.headers.get("last-event-id")
+    if req.stream and last_event_id:
+        stream_id, after = parse_event_id(last_event_id)
+        return _resumed(stream_id, after, tenant)
+    timings = _timings(request)
+    # 准入：按优先级类别排队，队列满或预计等待过长时直接 429 / 503（见 app/core/admission.py）
+    with span("admission"):
+        ticket = await admission.acquire(
+            admission.classify(request.headers.get(settings.ADMISSION_HEADER), _tenant_id(tenant)))
+    try:
+        # 会话在发出响应头之前查找：不存在（或属于其他租户）时直接 404
+        conversation = res = None
+        if req.session_id:
+            with span("history"):
+                conversation = await conversations.get(req.session_id, _tenant_id(tenant))
+        if req.stream:
+            # 模型名与输入也在发出响应头（和预扣配额）之前校验：不合法时按 400 返回（见 app/main.py），而不是一条空的 200 流
+            normalize_messages(req)
+            resolve_backends(req.model_name)
+        if tenant is not None:
+            with span("quota"):
+                res = await quota_ledger.reserve(tenant, _estimate(req, conversation))
+        headers = quota_ledger.headers(tenant) if tenant is not None else None
+        if req.stream:
+            return _stream_response(req, request, conversation, res, ticket, tenant, headers)
+        # 截止时间与断开检测：到期或客户端断开时取消本请求（含上游调用）
+        supervisor = Supervisor(request.receive, deadline_s(req.timeout_ms))
+        used = 0
+        try:
+            with supervisor:
+                out = await generate_async(req, conversation)
+            used = out.usage.total_tokens
+        finally:
+            if res is not None:
+                quota_ledger.settle(res, used)
+    finally:
+        # 流式响应的名额由 hold() 在流结束时归还
+        if not ticket.held:
+            ticket.release()
+    with span("encode"):
+        response = json_response(request, out, headers=headers)
+    if timings is not None:
+        # observability 在编码之前生成；含 encode 的完整分解放在 Server-Timing 头里
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+def _resumable(req: GenerateRequest) -> bool:
+    opts = req.stream_options
+    return opts.resumable if opts and opts.resumable is not None else settings.STREAM_RESUME_ENABLED
+
+
+def _stream_response(req: GenerateRequest, request: Request, conversation: Optional[ConversationState],
+                     res: Optional[Reservation], ticket: Ticket, tenant: Optional[TenantInfo],
+                     headers: Optional[Dict[str, str]]) -> StreamingResponse:
+    # 可续传的流由独立任务生成、不随连接结束，因此不监听断开；无人重连超过宽限期时按断开终止
+    resumable = _resumable(req) and resumable_streams.has_room()
+    supervisor = Supervisor(None if resumable else request.receive, deadline_s(req.timeout_ms))
+    stream = supervise(generate_stream_async(req, conversation), supervisor, _sse_error)
+    if res is not None:
+        # 计量从预扣中的 prompt 部分起算，再加上已下发的输出
+        prompt = max(0, res.tokens - settings.RATE_LIMIT_EST_OUTPUT_TOKENS * req.n)
+        stream = _settle_stream(stream, res, b"event: done\n", _sse_usage, _sse_output, prompt)
+    stream = admission.hold(stream, ticket)
+    if resumable:
+        buffered = resumable_streams.start(stream, _tenant_id(tenant), lambda: supervisor.terminate(CLIENT_DISCONNECT))
+        headers = {**(headers or {}), "X-Stream-Id": buffered.id}
+        stream = buffered.subscribe()
+    return StreamingResponse(stream, media_type="text/event-stream", headers=headers)
+
+
+def _resumed(stream_id: str, after: int, tenant: Optional[TenantInfo]) -> StreamingResponse:
+    stream = resumable_streams.resume(stream_id, _tenant_id(tenant))
+    return StreamingResponse(stream.subscribe(after), media_type="text/event-stream",
+                             headers={"X-Stream-Id": stream.id})
+
+# 续传（EventSource 兼容）：GET 带 Last-Event-ID 头（或 last_event_id 参数）从其后继续，都不带时从缓冲开头回放
+@model_router.get("/streams/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, last_event_id: Optional[str] = None,
+                        tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    event_id = request.headers.get("last-event-id") or last_event_id
+    after = -1
+    if event_id:
+        event_stream, after = parse_event_id(event_id)
+        if event_stream != stream_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID 不属于该流")
+    return _resumed(stream_id, after, tenant)
+
+# 批量生成：按完成顺序流式返回 NDJSON，每行带输入下标，末行为整批统计；客户端接受时按行压缩
+@model_router.post("/generate/batch")
+async def generate_batch(req: BatchGenerateRequest, request: Request,
+                         tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    if len(req.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"单批最多 {settings.BATCH_MAX_ITEMS} 条")
+    if any(item.session_id for item in req.items):
+        # 同一会话的多轮互相依赖，不能并发执行
+        raise HTTPException(status_code=400, detail="批量请求不支持 session_id")
+    # 各条按批量类别（可由请求头降低 / 指定）逐条准入，不会挤占交互请求
+    priority = admission.classify(request.headers.get(settings.ADMISSION_HEADER), _tenant_id(tenant),
+                                  settings.ADMISSION_BATCH_CLASS)
+    # 整批只做断开检测与排空；各条的 timeout_ms 在 run_batch 里分别计时
+    stream = supervise(run_batch(req.items, req.concurrency, priority), Supervisor(request.receive), _ndjson_error)
+    headers = None
+    if tenant is not None:
+        # 整批一次预扣：每条计一个请求
+        res = await quota_ledger.reserve(tenant, sum(_estimate(item) for item in req.items), len(req.items))
+        stream = _settle_stream(stream, res, b'{"summary"', _summary_usage, _item_usage)
+        headers = quota_ledger.headers(tenant)
+    stream, headers = _with_compression(request, stream, headers)
+    return StreamingResponse(stream, media_type="application/x-ndjson", headers=headers)
+
+# 服务端会话：创建后每轮 /v1/generate 只需带 session_id 与本轮新消息
+@model_router.post("/sessions", status_code=201)
+async def create_session(req: CreateSessionRequest, tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    conversation = await conversations.create(_tenant_id(tenant), req.system)
+    return {"id": conversation.id, "created": int(conversation.created_at)}
+
+@model_router.get("/sessions/{session_id}")
+async def get_session(session_id: str, tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    return (await conversations.get(session_id, _tenant_id(tenant))).describe()
+
+@model_router.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(session_id: str, tenant: Optional[TenantInfo] = Depends(require_tenant)):
+    await conversations.delete(session_id, _tenant_id(tenant))
+    return Response(status_code=204)
+
+# 采样剖析：采样本 worker 的调用栈 seconds 秒，返回 collapsed stack 文本（flamegraph.pl / speedscope 可直接读取）
+@model_router.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(seconds: float = 10.0, interval_ms: float = 5.0, all_threads: bool = False):
+    if not 0 < seconds <= settings.PROFILE_MAX_S:
+        raise HTTPException(status_code=400, detail=f"seconds 需在 (0, {settings.PROFILE_MAX_S}] 之内")
+    interval_s = max(interval_ms, settings.PROFILE_MIN_INTERVAL_MS) / 1000
+    try:
+        # 路由运行在事件循环线程上：默认只采这个线程
+        text = await profiler.profile(seconds, interval_s, None if all_threads else threading.get_ident())
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return PlainTextResponse(text)
+
+# 网关内部状态：缓存命中、在途合并节省的上游请求数、各 provider 限流器与端点池、请求日志队列、租户配额、会话、准入队列、可续传流
+# detail 为 True 时含各租户剩余额度与端点 base_url，只通过管理接口返回
+def _stats(detail: bool) -> Dict[str, Any]:
+    return {"cache": {**response_cache.stats, "persistent": response_cache.persistent_stats},
+            "coalescing": coalescing_stats(), "rate_limits": rate_limiter.state(), "endpoints": balancer.state(detail), "request_log": request_log.describe(),
+            "quota": quota_ledger.describe(detail), "sessions": conversations.describe(),
+            "admission": admission.describe(), "resumable_streams": resumable_streams.describe()}
+
+# 公开：只有汇总计数
+@model_router.get("/stats")
+async def stats():
+    return _stats(detail=False)
+
+@model_router.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def admin_stats():
+    return _stats(detail=True)
@@ -0,0 +1,113 @@
+# app/batch.py
+# 批量生成：并发扇出到各 provider（各自独立的并发上限），按完成顺序逐行产出 NDJSON。
+# 单条失败只记录在该行，不影响整批；最后一行是整批的吞吐 / 延迟统计。
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.core.admission import Overloaded, admission
+from app.core.config import settings
+from app.core.encoding import dumps
+from app.core.lifecycle import RequestTerminated, Supervisor, deadline_s
+from app.llm import generate_async, resolve_model
+from app.schemas.llm import GenerateRequest
+
+
+def _ndjson(data: Dict[str, Any]) -> bytes:
+    return dumps(data) + b"\n"
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def batch_summary(latencies: List[float], succeeded: int, failed: int, total_tokens: int, wall_s: float) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    count = succeeded + failed
+    return {
+        "items": count,
+        "succeeded": succeeded,
+        "failed": failed,
+        "wall_ms": int(wall_s * 1000),
+        "throughput_rps": round(count / wall_s, 3) if wall_s > 0 else 0.0,
+        "total_tokens": total_tokens,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered), 1) if ordered else 0.0,
+            "p50": round(_percentile(ordered, 0.50), 1),
+            "p95": round(_percentile(ordered, 0.95), 1),
+            "max": round(ordered[-1], 1) if ordered else 0.0,
+        },
+    }
+
+
+class ProviderLimits:
+    # 每个 provider 一个信号量，按需创建；请求里的 overrides 只能调低服务端配置的上限，不能调高
+    def __init__(self, overrides: Optional[Dict[str, int]] = None) -> None:
+        self._overrides = overrides or {}
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+
+    def cap(self, provider: str) -> int:
+        server_cap = settings.BATCH_PROVIDER_CONCURRENCY.get(provider, settings.BATCH_DEFAULT_CONCURRENCY)
+        return max(1, min(server_cap, self._overrides.get(provider, server_cap)))
+
+    def for_provider(self, provider: str) -> asyncio.Semaphore:
+        sem = self._sems.get(provider)
+        if sem is None:
+            sem = self._sems[provider] = asyncio.Semaphore(self.cap(provider))
+        return sem
+
+
+# priority：各条的准入类别（见 app/core/admission.py）；None 时不经准入控制（脚本直接调用）
+async def run_batch(items: List[GenerateRequest], concurrency: Optional[Dict[str, int]] = None,
+                    priority: Optional[str] = None) -> AsyncIterator[bytes]:
+    limits = ProviderLimits(concurrency)
+    done: asyncio.Queue = asyncio.Queue()
+    t_start = time.perf_counter()
+
+    async def one(index: int, item: GenerateRequest) -> None:
+        t0 = time.perf_counter()
+        try:
+            provider, _ = resolve_model(item.model_name)
+            # 每条各自的截止时间，含等待并发名额的时间
+            with Supervisor(timeout_s=deadline_s(item.timeout_ms)):
+                async with limits.for_provider(provider):
+                    # 先占本批的 provider 并发名额再排准入队列：一个大批次在准入队列里最多占这么多位置
+                    ticket = await admission.acquire(priority) if priority is not None else None
+                    try:
+                        out = await generate_async(item.model_copy(update={"stream": False}))
+                    finally:
+                        if ticket is not None:
+                            ticket.release()
+            # 响应直接序列化为字节后拼接，不经 model_dump() 中转
+            line = b'{"index":%d,"response":' % index + dumps(out) + b"}\n"
+            tokens, ok = out.usage.total_tokens, True
+        except (RequestTerminated, Overloaded) as e:
+            line = _ndjson({"index": index, "error": e.body})
+            tokens, ok = 0, False
+        except Exception as e:
+            line = _ndjson({"index": index, "error": {"type": type(e).__name__, "message": str(e)}})
+            tokens, ok = 0, False
+        await done.put((line, ok, (time.perf_counter() - t0) * 1000, tokens))
+
+    tasks = [asyncio.ensure_future(one(i, item)) for i, item in enumerate(items)]
+    latencies: List[float] = []
+    succeeded = failed = total_tokens = 0
+    try:
+        for _ in range(len(tasks)):
+            line, ok, latency, tokens = await done.get()
+            latencies.append(latency)
+            total_tokens += tokens
+            if ok:
+                succeeded += 1
+            else:
+                failed += 1
+            yield line
+        yield _ndjson({"summary": batch_summary(latencies, succeeded, failed, total_tokens, time.perf_counter() - t_start)})
+    finally:
+        # 客户端提前断开：取消尚未完成的条目
+        for task in tasks:
+            if not task.done():
+                task.cancel()
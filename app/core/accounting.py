@@ -0,0 +1,138 @@
+# app/core/accounting.py
+# Token 记账：发请求前统计 prompt token、按模型上下文窗口拒绝或截断、按价格表计算费用。
+# 编码器按模型族缓存（tiktoken 编码表首次加载需要下载，加载失败时退回按字节估算）。
+import asyncio
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import tiktoken
+
+from app.core.config import settings
+
+# OpenAI chat 格式的固定开销：每条消息 3 token（含 role），回复引导 3 token
+_PER_MESSAGE = 3
+_REPLY_PRIMING = 3
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    context_window: int
+    max_output_tokens: int
+    input_usd_per_1m: float
+    output_usd_per_1m: float
+
+
+class ContextWindowExceeded(ValueError):
+    def __init__(self, model: str, prompt_tokens: int, limit: int) -> None:
+        super().__init__(f"prompt 共 {prompt_tokens} token，超过模型 {model} 的可用上下文 {limit}")
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.limit = limit
+
+
+@dataclass
+class Preflight:
+    messages: List[dict]
+    prompt_tokens: int
+    dropped: int = 0
+    exact: bool = True
+
+    def describe(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"prompt_tokens": self.prompt_tokens, "exact": self.exact}
+        if self.dropped:
+            out["truncated_messages"] = self.dropped
+        return out
+
+
+def encoding_name(provider: str, model: str) -> str:
+    if provider == "openai" and model.startswith(("gpt-4o", "gpt-4.1", "o1", "o3", "o4")):
+        return "o200k_base"
+    # Gemini 的分词器不在 tiktoken 里，用 cl100k_base 近似（结果标记为非精确）
+    return "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        return None
+
+
+def warm_encodings() -> None:
+    for name in ("o200k_base", "cl100k_base"):
+        _load_encoding(name)
+
+
+def _estimate(text: str) -> int:
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def estimate_message_tokens(content: str) -> int:
+    return _estimate(content) + _PER_MESSAGE
+
+
+def estimate_tokens(messages: List[dict]) -> int:
+    # 不加载编码表的粗估（约 4 字节 / token），用于配额、会话窗口等只需量级的场合
+    return sum(estimate_message_tokens(m["content"]) for m in messages) + _REPLY_PRIMING
+
+
+def count_message_tokens(messages: List[dict], provider: str, model: str) -> tuple[List[int], bool]:
+    # 返回每条消息的 token 数（含固定开销）与是否精确
+    enc = _load_encoding(encoding_name(provider, model))
+    contents = [m["content"] for m in messages]
+    if enc is None:
+        return [_estimate(c) + _PER_MESSAGE for c in contents], False
+    # encode_ordinary 跳过特殊 token 检查；多条消息时用 batch 版本并行编码
+    if len(contents) > 1:
+        encoded = enc.encode_ordinary_batch(contents)
+        counts = [len(tokens) + _PER_MESSAGE for tokens in encoded]
+    else:
+        counts = [len(enc.encode_ordinary(c)) + _PER_MESSAGE for c in contents]
+    return counts, provider == "openai"
+
+
+def fit_context(messages: List[dict], provider: str, model: str, spec: Optional[ModelSpec],
+                strategy: str) -> Preflight:
+    counts, exact = count_message_tokens(messages, provider, model)
+    total = sum(counts) + _REPLY_PRIMING
+    if spec is None:
+        return Preflight(messages, total, exact=exact)
+    limit = spec.context_window - settings.CONTEXT_RESERVE_TOKENS
+    if total <= limit:
+        return Preflight(messages, total, exact=exact)
+    if strategy != "truncate":
+        raise ContextWindowExceeded(model, total, limit)
+
+    # 截断：从最早的非 system 轮次开始丢弃，始终保留最后一条消息
+    keep = [True] * len(messages)
+    for i, m in enumerate(messages[:-1]):
+        if total <= limit:
+            break
+        if m["role"] == "system":
+            continue
+        keep[i] = False
+        total -= counts[i]
+    if total > limit:
+        raise ContextWindowExceeded(model, total, limit)
+    kept = [m for m, k in zip(messages, keep) if k]
+    return Preflight(kept, total, dropped=len(messages) - len(kept), exact=exact)
+
+
+async def afit_context(messages: List[dict], provider: str, model: str, spec: Optional[ModelSpec],
+                       strategy: str) -> Preflight:
+    # 大 prompt 的编码放到线程里做，避免阻塞事件循环
+    if sum(len(m["content"]) for m in messages) >= settings.TOKENIZE_OFFLOAD_CHARS:
+        return await asyncio.to_thread(fit_context, messages, provider, model, spec, strategy)
+    return fit_context(messages, provider, model, spec, strategy)
+
+
+def cost_usd(spec: Optional[ModelSpec], usage: Dict[str, Any]) -> Optional[float]:
+    if spec is None:
+        return None
+    return round(
+        (usage.get("prompt_tokens", 0) or 0) * spec.input_usd_per_1m / 1_000_000
+        + (usage.get("completion_tokens", 0) or 0) * spec.output_usd_per_1m / 1_000_000,
+        8,
+    )
@@ -0,0 +1,216 @@
+# app/core/admission.py
+# 准入控制：每个 worker 同时执行的生成请求不超过 ADMISSION_MAX_CONCURRENCY（流式持有名额直到流结束），
+# 超出的请求按优先级类别（ADMISSION_CLASSES，按优先级从高到低）分别排队：
+# - 调度：按类别 weight 做 stride 调度，高优先级得到更多份额，低优先级也不会饿死；
+# - 有界：类别队列满时直接 429；
+# - 提前拒绝：按在途请求的平均占用时长估算排队时间，超过该类别的 max_wait_ms 时不入队，直接 503；
+# - 排队时限：入队后超过 max_wait_ms 仍未轮到，同样 503。
+# 拒绝都带 Retry-After（估算的等待时间），客户端据此退避，进程里不会堆积无限的待处理请求。
+# 类别来自请求头（ADMISSION_HEADER）或租户（ADMISSION_TENANT_PRIORITY），请求头不能高于租户的类别。
+import asyncio
+import math
+import time
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from app.core.config import settings
+
+QUEUE_FULL = "queue_full"
+OVERLOADED = "overloaded"
+QUEUE_TIMEOUT = "queue_timeout"
+
+
+class Overloaded(Exception):
+    def __init__(self, priority: str, reason: str, retry_after_s: float) -> None:
+        super().__init__(f"服务繁忙（{priority} 队列{'已满' if reason == QUEUE_FULL else '等待过长'}），请稍后重试")
+        self.priority = priority
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+        # 队列满是对该类别请求方的背压（429）；预计 / 实际等待过长是服务整体过载（503）
+        self.status_code = 429 if reason == QUEUE_FULL else 503
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        return {"type": self.reason, "message": str(self), "priority": self.priority,
+                "retry_after_s": math.ceil(self.retry_after_s)}
+
+
+class _Class:
+    __slots__ = ("name", "rank", "weight", "max_queue", "max_wait_s", "queue", "pass_", "in_flight", "stats")
+
+    def __init__(self, name: str, rank: int, spec: Dict[str, float]) -> None:
+        self.name = name
+        self.rank = rank
+        self.weight = max(float(spec.get("weight", 1)), 1e-3)
+        self.max_queue = int(spec.get("max_queue", 1024))
+        self.max_wait_s = float(spec.get("max_wait_ms", 30_000)) / 1000
+        self.queue: Deque[asyncio.Future] = deque()
+        self.pass_ = 0.0
+        self.in_flight = 0
+        self.stats = {"admitted": 0, "queued": 0, QUEUE_FULL: 0, OVERLOADED: 0, QUEUE_TIMEOUT: 0}
+
+
+class Ticket:
+    __slots__ = ("controller", "cls", "started", "held", "released", "__weakref__")
+
+    def __init__(self, controller: Optional["AdmissionController"], cls: Optional[_Class]) -> None:
+        self.controller = controller
+        self.cls = cls
+        self.started = time.perf_counter()
+        self.held = False
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self.controller is not None:
+            self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        self.reset()
+
+    # 按当前 settings 重建类别（测试与配置变更后调用）
+    def reset(self) -> None:
+        self.enabled = settings.ADMISSION_ENABLED
+        self.max_concurrency = max(1, settings.ADMISSION_MAX_CONCURRENCY)
+        self._classes: Dict[str, _Class] = {
+            name: _Class(name, rank, spec) for rank, (name, spec) in enumerate(settings.ADMISSION_CLASSES.items())
+        }
+        self.in_flight = 0
+        self._queued = 0
+        self._vtime = 0.0
+        self._service_s: Optional[float] = None   # 名额平均占用时长（EWMA），无样本时不做提前拒绝
+
+    # 请求头优先，否则用租户的类别，再否则用 default；请求头不能把请求提到租户类别之上
+    def classify(self, requested: Optional[str], tenant_id: Optional[str] = None,
+                 default: Optional[str] = None) -> str:
+        ceiling = settings.ADMISSION_TENANT_PRIORITY.get(tenant_id) if tenant_id else None
+        if ceiling not in self._classes:
+            ceiling = None
+        name = requested if requested in self._classes else ceiling or default or settings.ADMISSION_DEFAULT_CLASS
+        if name not in self._classes:
+            name = next(iter(self._classes))
+        if ceiling is not None and self._classes[name].rank < self._classes[ceiling].rank:
+            name = ceiling
+        return name
+
+    async def acquire(self, priority: str) -> Ticket:
+        if not self.enabled:
+            return Ticket(None, None)
+        cls = self._classes[priority]
+        # 快路径：有空闲名额且没人排队
+        if self.in_flight < self.max_concurrency and not self._queued:
+            return self._grant(cls)
+        if len(cls.queue) >= cls.max_queue:
+            raise self._shed(cls, QUEUE_FULL, self.estimate_wait_s(cls))
+        estimate = self.estimate_wait_s(cls)
+        if estimate > cls.max_wait_s:
+            raise self._shed(cls, OVERLOADED, estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        if not cls.queue:
+            # 类别从空闲转为排队：从当前虚拟时间起算，不能攒着之前空闲时的份额
+            cls.pass_ = max(cls.pass_, self._vtime)
+        cls.queue.append(future)
+        cls.stats["queued"] += 1
+        self._queued += 1
+        try:
+            # wait_for 超时会取消 future；名额恰好同时分到的情况在下面按 done 判断
+            await asyncio.wait_for(future, cls.max_wait_s)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 已分到名额但调用方同时被取消：名额转给下一个
+                self._free(cls)
+            else:
+                future.cancel()
+                try:
+                    cls.queue.remove(future)
+                    self._queued -= 1
+                except ValueError:
+                    pass  # 已被 _dispatch 取出并跳过
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._shed(cls, QUEUE_TIMEOUT, self.estimate_wait_s(cls)) from None
+            raise
+        return Ticket(self, cls)
+
+    # 流式响应：流结束（或响应对象被回收而流从未开始）时归还名额
+    def hold(self, stream: AsyncIterator[bytes], ticket: Ticket) -> AsyncIterator[bytes]:
+        ticket.held = True
+        wrapped = _release_after(stream, ticket)
+        weakref.finalize(wrapped, ticket.release)
+        return wrapped
+
+    # 排在本类别新请求之前的请求数：本类别队列 + 其他类别在同一时间段内按份额会先被调度的部分
+    def estimate_wait_s(self, cls: _Class) -> float:
+        if self._service_s is None:
+            return 0.0
+        position = len(cls.queue) + 1
+        ahead = len(cls.queue)
+        for other in self._classes.values():
+            if other is not cls and other.queue:
+                ahead += min(len(other.queue), position * other.weight / cls.weight)
+        return (ahead + 1) * self._service_s / self.max_concurrency
+
+    def _grant(self, cls: _Class) -> Ticket:
+        self.in_flight += 1
+        cls.in_flight += 1
+        cls.stats["admitted"] += 1
+        return Ticket(self, cls)
+
+    def _shed(self, cls: _Class, reason: str, retry_after_s: float) -> Overloaded:
+        cls.stats[reason] += 1
+        return Overloaded(cls.name, reason, max(retry_after_s, 1.0))
+
+    def _release(self, ticket: Ticket) -> None:
+        held = time.perf_counter() - ticket.started
+        alpha = settings.ADMISSION_SERVICE_EWMA_ALPHA
+        self._service_s = held if self._service_s is None else (1 - alpha) * self._service_s + alpha * held
+        self._free(ticket.cls)
+
+    def _free(self, cls: _Class) -> None:
+        self.in_flight -= 1
+        cls.in_flight -= 1
+        self._dispatch()
+
+    # 名额空出时：在有人排队的类别中选 pass 最小者（stride 调度），每放行一个 pass 增加 1/weight
+    def _dispatch(self) -> None:
+        while self._queued and self.in_flight < self.max_concurrency:
+            cls = min((c for c in self._classes.values() if c.queue), key=lambda c: (c.pass_, c.rank))
+            future = cls.queue.popleft()
+            self._queued -= 1
+            if future.done():
+                continue
+            self._vtime = cls.pass_
+            cls.pass_ += 1 / cls.weight
+            self.in_flight += 1
+            cls.in_flight += 1
+            cls.stats["admitted"] += 1
+            future.set_result(None)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "service_ms": round(self._service_s * 1000, 1) if self._service_s is not None else None,
+            "classes": {
+                name: {"in_flight": c.in_flight, "queue_depth": len(c.queue),
+                       "estimated_wait_ms": round(self.estimate_wait_s(c) * 1000), **c.stats}
+                for name, c in self._classes.items()
+            },
+        }
+
+
+async def _release_after(stream: AsyncIterator[bytes], ticket: Ticket) -> AsyncIterator[bytes]:
+    try:
+        async for frame in stream:
+            yield frame
+    finally:
+        ticket.release()
+
+
+admission = AdmissionController()
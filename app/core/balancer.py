@@ -0,0 +1,200 @@
+# app/core/balancer.py
+# 多 key / 多 base_url 负载均衡：每个 provider 一个端点池，按「在途请求数 × 近期延迟 EWMA」选最小者；
+# 连续出错的端点被熔断摘除，冷却后半开放行一个探测请求，成功即恢复。
+# 全部端点都被熔断时按 Envoy 的 panic 模式处理：仍选冷却最早结束的端点，而不是直接拒绝。
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# 端点自身的问题：连接失败、超时与服务端错误（SDK 异常类名，避免依赖各 SDK）
+_ENDPOINT_ERRORS = {"APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailable",
+                    "DeadlineExceeded", "ConnectError", "ConnectTimeout", "ReadTimeout",
+                    "RemoteProtocolError"}
+_GRPC_ENDPOINT_CODES = {"UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL"}
+
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    # 只有 5xx、超时与连接错误计入熔断；4xx（参数错误、未知模型、鉴权）与 429（交给限流器）是请求的问题，
+    # 换哪个端点结果都一样，计入的话任何客户端都能用错误参数把所有 key 熔断（沿 __cause__ 链查找被包装的原始异常）
+    seen = 0
+    while exc is not None and seen < 5:
+        status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+        if isinstance(status, int):
+            return status >= 500
+        if callable(status):  # grpc.RpcError.code()
+            try:
+                if getattr(status(), "name", None) in _GRPC_ENDPOINT_CODES:
+                    return True
+            except Exception:
+                pass
+        if isinstance(exc, (TimeoutError, ConnectionError)) or type(exc).__name__ in _ENDPOINT_ERRORS:
+            return True
+        exc = exc.__cause__ or exc.__context__
+        seen += 1
+    return False
+
+
+@dataclass
+class Endpoint:
+    provider: str
+    index: int
+    api_key: str = ""
+    base_url: Optional[str] = None
+    # 运行状态
+    outstanding: int = 0
+    served: int = 0
+    ewma_s: Optional[float] = None
+    failures: int = 0
+    state: str = CLOSED
+    opened_at: float = 0.0
+    probing: bool = False
+
+    @property
+    def id(self) -> str:
+        # 不暴露 key 本身：指标、限流与调试输出都用这个标识
+        digest = hashlib.sha256(self.api_key.encode()).hexdigest()[:8] if self.api_key else "nokey"
+        return f"{self.provider}#{self.index}:{digest}"
+
+    # detail=False 时不含 base_url（公开的 /v1/stats 使用）
+    def describe(self, detail: bool = True) -> Dict[str, Any]:
+        out = {
+            "id": self.id,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "served": self.served,
+            "ewma_ms": round(self.ewma_s * 1000, 1) if self.ewma_s is not None else None,
+            "consecutive_failures": self.failures,
+        }
+        if detail:
+            out["base_url"] = self.base_url
+        return out
+
+
+class Lease:
+    __slots__ = ("pool", "endpoint", "t0", "released")
+
+    def __init__(self, pool: "EndpointPool", endpoint: Endpoint) -> None:
+        self.pool, self.endpoint = pool, endpoint
+        self.t0 = time.perf_counter()
+        self.released = False
+
+    def ok(self) -> None:
+        self.pool._record(self.endpoint, time.perf_counter() - self.t0, failed=False)
+
+    # 给出异常时只有端点自身的问题才计为失败（见 is_endpoint_failure）
+    def fail(self, exc: Optional[BaseException] = None) -> None:
+        if exc is None or is_endpoint_failure(exc):
+            self.pool._record(self.endpoint, None, failed=True)
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.pool._release(self.endpoint)
+
+
+class EndpointPool:
+    def __init__(self, provider: str, endpoints: List[Endpoint]) -> None:
+        self.provider = provider
+        self.endpoints = endpoints
+        self._lock = threading.Lock()  # 同步路径在线程池里调用，选择与计数需要互斥
+
+    def _available(self, ep: Endpoint, now: float) -> bool:
+        if ep.state == CLOSED:
+            return True
+        if ep.state == OPEN and now - ep.opened_at >= settings.LB_BREAKER_COOLDOWN_S:
+            ep.state = HALF_OPEN
+        # 半开：同一时刻只放行一个探测请求
+        return ep.state == HALF_OPEN and not ep.probing
+
+    def checkout(self) -> Lease:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [ep for ep in self.endpoints if self._available(ep, now)]
+            if not candidates:
+                candidates = [min(self.endpoints, key=lambda ep: ep.opened_at)]
+            known = [ep.ewma_s for ep in self.endpoints if ep.ewma_s is not None]
+            default = sum(known) / len(known) if known else 1.0
+            ep = min(candidates, key=lambda e: ((e.outstanding + 1) * (e.ewma_s if e.ewma_s is not None else default),
+                                                e.served))
+            if ep.state == HALF_OPEN:
+                ep.probing = True
+            ep.outstanding += 1
+            ep.served += 1
+            return Lease(self, ep)
+
+    def _record(self, ep: Endpoint, latency_s: Optional[float], failed: bool) -> None:
+        with self._lock:
+            if failed:
+                ep.failures += 1
+                if ep.state == HALF_OPEN or ep.failures >= settings.LB_EJECT_AFTER_FAILURES:
+                    ep.state = OPEN
+                    ep.opened_at = time.monotonic()
+            else:
+                alpha = settings.LB_EWMA_ALPHA
+                ep.ewma_s = latency_s if ep.ewma_s is None else alpha * latency_s + (1 - alpha) * ep.ewma_s
+                ep.failures = 0
+                ep.state = CLOSED
+            ep.probing = False
+
+    def _release(self, ep: Endpoint) -> None:
+        with self._lock:
+            ep.outstanding -= 1
+            ep.probing = False
+
+    # 一次性调用：正常返回记成功，端点自身的错误记失败；被取消（对冲败者、客户端断开）只归还在途计数
+    @contextmanager
+    def lease(self) -> Iterator[Lease]:
+        lease = self.checkout()
+        try:
+            yield lease
+        except Exception as e:
+            lease.fail(e)
+            raise
+        else:
+            lease.ok()
+        finally:
+            lease.release()
+
+
+def _configured_endpoints(provider: str) -> List[Endpoint]:
+    entries = settings.LLM_ENDPOINTS.get(provider)
+    if not entries:
+        single = {
+            "openai": {"api_key": settings.OPENAI_API_KEY, "base_url": settings.OPENAI_BASE_URL},
+            "google": {"api_key": settings.GOOGLE_API_KEY, "base_url": settings.GOOGLE_BASE_URL},
+        }
+        entries = [single.get(provider, {})]
+    return [Endpoint(provider, i, api_key=e.get("api_key") or "", base_url=e.get("base_url"))
+            for i, e in enumerate(entries)]
+
+
+class Balancer:
+    def __init__(self) -> None:
+        self._pools: Dict[str, EndpointPool] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, provider: str) -> EndpointPool:
+        pool = self._pools.get(provider)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(provider)
+                if pool is None:
+                    pool = self._pools[provider] = EndpointPool(provider, _configured_endpoints(provider))
+        return pool
+
+    def state(self, detail: bool = True) -> Dict[str, Any]:
+        return {p: [ep.describe(detail) for ep in pool.endpoints] for p, pool in self._pools.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pools.clear()
+
+
+balancer = Balancer()
@@ -0,0 +1,180 @@
+# app/core/cache.py
+# 确定性响应缓存：temperature=0 的相同请求直接复用上次结果。
+# 进程内 LRU（条数 + TTL 上限）在前；多 worker 部署时中间有一层跨进程共享层（app/core/shared.py），
+# 最后是可选的持久层（async SQLAlchemy）：读写出错只记日志（读按未命中），缓存故障不影响生成请求；
+# 写入时每 256 次顺带按 TTL 与 RESPONSE_CACHE_PERSIST_MAX_ENTRIES 清理一次表（启动后的第一次写入也会清理）。
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.core.shared import shared_state
+from app.repositories import response_cache as repo
+from app.schemas.llm import GenerateRequest
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheHit:
+    result: Dict[str, Any]
+    tier: str          # "memory" | "shared" | "persistent"
+    created_at: float
+
+    def describe(self) -> Dict[str, Any]:
+        return {"hit": True, "tier": self.tier, "age_ms": int((time.time() - self.created_at) * 1000)}
+
+
+def cache_key(provider: str, model: str, messages: List[dict], params: Dict[str, Any]) -> str:
+    # 规范化 JSON（排序 key、紧凑分隔符）后取 sha256，保证同一请求在各进程得到同一个 key
+    canonical = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "params": params},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl_s: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+        self._pending: set[asyncio.Task] = set()
+        self._shared_puts = 0
+        self._persisted = 0
+        self.stats = {"hits_memory": 0, "hits_shared": 0, "hits_persistent": 0, "misses": 0}
+        self.persistent_stats = {"errors": 0, "pruned": 0}
+
+    def configure(self, session_factory: Optional[async_sessionmaker[AsyncSession]]) -> None:
+        self._session_factory = session_factory
+
+    @staticmethod
+    def cacheable(req: GenerateRequest) -> bool:
+        # 只缓存确定性生成；include_raw 需要供应商原始载荷，不走缓存
+        return req.cache and req.temperature == 0.0 and not req.include_raw
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_s > 0 and time.time() - created_at > self.ttl_s
+
+    # —— 内存层 ——
+    def get_memory(self, key: str) -> Optional[CacheHit]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        created_at, result = item
+        if self._expired(created_at):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return CacheHit(result=result, tier="memory", created_at=created_at)
+
+    def _put_memory(self, key: str, result: Dict[str, Any], created_at: float) -> None:
+        self._entries[key] = (created_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # —— 共享层：所有 worker 可见 ——
+    def _get_shared(self, key: str) -> Optional[CacheHit]:
+        raw = shared_state.get("cache:" + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if self._expired(entry["created_at"]):
+            return None
+        self._put_memory(key, entry["result"], entry["created_at"])
+        return CacheHit(result=entry["result"], tier="shared", created_at=entry["created_at"])
+
+    def _put_shared(self, key: str, result: Dict[str, Any], created_at: float) -> None:
+        entry = json.dumps({"created_at": created_at, "result": result}, ensure_ascii=False).encode("utf-8")
+        shared_state.set("cache:" + key, entry, self.ttl_s)
+        self._shared_puts += 1
+        if self._shared_puts % 256 == 0:
+            shared_state.prune(self.max_entries)
+
+    # —— 对外：先查内存，再查共享层与持久层（命中则回填内存）——
+    async def get(self, key: str) -> Optional[CacheHit]:
+        hit = self.get_memory(key)
+        if hit is None and shared_state.enabled:
+            hit = self._get_shared(key)
+        if hit is None and self._session_factory is not None:
+            hit = await self._get_persistent(key)
+        if hit is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats[f"hits_{hit.tier}"] += 1
+        return hit
+
+    # —— 持久层 ——
+    async def _get_persistent(self, key: str) -> Optional[CacheHit]:
+        try:
+            async with self._session_factory() as session:
+                entry = await repo.get_entry(session, key)
+        except Exception:
+            self.persistent_stats["errors"] += 1
+            logger.warning("response cache: persistent read failed, treating as a miss", exc_info=True)
+            return None
+        if entry is None or self._expired(entry.created_at):
+            return None
+        result = json.loads(entry.payload)
+        self._put_memory(key, result, entry.created_at)
+        return CacheHit(result=result, tier="persistent", created_at=entry.created_at)
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        result = {k: v for k, v in result.items() if k != "raw"}
+        created_at = time.time()
+        self._put_memory(key, result, created_at)
+        if shared_state.enabled:
+            self._put_shared(key, result, created_at)
+        if self._session_factory is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 同步脚本路径：只写内存层
+        # 持久层写入放到后台，响应路径不等待数据库
+        task = loop.create_task(self._persist(key, result, created_at))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _persist(self, key: str, result: Dict[str, Any], created_at: float) -> None:
+        # 后台任务没人等它的结果：异常在这里接住并记日志
+        try:
+            async with self._session_factory() as session:
+                await repo.upsert_entry(session, key, json.dumps(result, ensure_ascii=False), created_at)
+                self._persisted += 1
+                if self._persisted % 256 == 1:
+                    expired_before = created_at - self.ttl_s if self.ttl_s > 0 else None
+                    self.persistent_stats["pruned"] += await repo.prune(
+                        session, expired_before, settings.RESPONSE_CACHE_PERSIST_MAX_ENTRIES)
+        except Exception:
+            self.persistent_stats["errors"] += 1
+            logger.warning("response cache: persistent write failed", exc_info=True)
+
+    async def drain(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._persisted = 0
+        for stats in (self.stats, self.persistent_stats):
+            for k in stats:
+                stats[k] = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_s=settings.RESPONSE_CACHE_TTL_S,
+)
@@ -0,0 +1,159 @@
+# app/core/clients.py
+# 进程级供应商客户端注册表：按 (provider, model, 参数) 复用 ChatModel 实例，
+# OpenAI 侧共享带 keep-alive 连接池的 httpx 客户端，避免每个请求重复建连/TLS 握手。
+# 键里有客户端给的模型名与温度，缓存按 LRU 封顶（LLM_CLIENT_CACHE_MAX）；被淘汰的实例可能还有请求在用，
+# 等 LLM_CLIENT_CLOSE_GRACE_S 之后再关闭其连接。
+import asyncio
+import importlib.util
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Set
+
+import httpx
+
+from app.core.config import settings
+
+
+def _http2_enabled() -> bool:
+    # httpx 的 HTTP/2 依赖可选包 h2，未安装时退回 HTTP/1.1 keep-alive
+    return settings.LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+class ClientRegistry:
+    def __init__(self) -> None:
+        self._models: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._retired: List[Any] = []             # 已淘汰、等待关闭的实例
+        self._closing: Set[asyncio.Task] = set()
+        self.evicted = 0
+        self._http: httpx.Client | None = None
+        self._ahttp: httpx.AsyncClient | None = None
+
+    # —— 共享 HTTP 连接池（同步 / 异步各一个）——
+    def http_client(self) -> httpx.Client:
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = httpx.Client(limits=_pool_limits(), http2=_http2_enabled())
+        return self._http
+
+    def async_http_client(self) -> httpx.AsyncClient:
+        if self._ahttp is None:
+            with self._lock:
+                if self._ahttp is None:
+                    self._ahttp = httpx.AsyncClient(limits=_pool_limits(), http2=_http2_enabled())
+        return self._ahttp
+
+    # —— ChatModel 实例缓存：命中直接返回，未命中用 factory 构造一次 ——
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        client = self._models.get(key)
+        if client is not None:
+            try:
+                self._models.move_to_end(key)
+            except KeyError:
+                pass  # 刚被其他线程淘汰，本次仍可使用
+            return client
+        with self._lock:
+            client = self._models.get(key)
+            if client is None:
+                client = factory()
+                self._models[key] = client
+                while len(self._models) > max(1, settings.LLM_CLIENT_CACHE_MAX):
+                    self._retire(self._models.popitem(last=False)[1])
+        return client
+
+    # 宽限期后关闭被淘汰实例的连接；不在事件循环里时（线程池 / 脚本）只丢弃引用，channel 随实例回收关闭
+    def _retire(self, model: Any) -> None:
+        self.evicted += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._retired.append(model)
+        loop.call_later(settings.LLM_CLIENT_CLOSE_GRACE_S, self._close_retired, model)
+
+    def _close_retired(self, model: Any) -> None:
+        with self._lock:
+            try:
+                self._retired.remove(model)
+            except ValueError:
+                return  # 已由 aclose 关闭
+        task = asyncio.ensure_future(_close_model_transports(model))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._retired.clear()
+            self.evicted = 0
+
+    async def aclose(self) -> None:
+        with self._lock:
+            models, self._models = list(self._models.values()) + self._retired, OrderedDict()
+            self._retired = []
+            http, self._http = self._http, None
+            ahttp, self._ahttp = self._ahttp, None
+        for model in models:
+            await _close_model_transports(model)
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        if ahttp is not None:
+            await ahttp.aclose()
+        if http is not None:
+            http.close()
+
+
+# Gemini 端点地址：https://host[:port] 走 TLS（如区域代理），http://host:port 为明文 gRPC（本地桩服务 / 内网网关）。
+# langchain 只接受 api_endpoint 且总是建 TLS channel，明文时由这里直接构造 GAPIC 客户端替换进去
+def gemini_endpoint(base_url: str) -> tuple[str, bool]:
+    scheme, _, host = base_url.partition("://")
+    if not host:
+        return base_url.rstrip("/"), True
+    return host.rstrip("/"), scheme != "http"
+
+
+def gemini_plaintext_client(target: str, asynchronous: bool) -> Any:
+    import grpc
+    from google.ai.generativelanguage_v1beta.services.generative_service import (
+        GenerativeServiceAsyncClient,
+        GenerativeServiceClient,
+    )
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcAsyncIOTransport,
+        GenerativeServiceGrpcTransport,
+    )
+    if asynchronous:
+        # grpc.aio 的 channel 绑定创建时的事件循环，只能在循环内调用
+        return GenerativeServiceAsyncClient(
+            transport=GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(target)))
+    return GenerativeServiceClient(transport=GenerativeServiceGrpcTransport(channel=grpc.insecure_channel(target)))
+
+
+async def _close_model_transports(model: Any) -> None:
+    # Gemini 客户端各自持有 gRPC channel；OpenAI 的连接池由上面的 httpx 客户端统一关闭
+    for attr in ("client", "async_client_running"):
+        transport = getattr(getattr(model, attr, None), "transport", None)
+        close = getattr(transport, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
+
+
+registry = ClientRegistry()
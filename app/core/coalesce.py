@@ -0,0 +1,140 @@
+# app/core/coalesce.py
+# 单飞（single-flight）合并：相同的在途请求只向上游发一次。
+# 非流式：跟随者等待领头者的结果；流式：上游由独立任务驱动并广播，
+# 晚到的订阅者先回放已产出的 delta，再从当前位置继续接收。
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        # 返回 (结果, 是否复用了别人的调用)
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        call.waiters += 1
+        try:
+            # shield：某个等待者被取消（客户端断开）不影响其他等待者
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def clear(self) -> None:
+        self._calls.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+class StreamFlight:
+    def __init__(self, source: AsyncIterator[Any]) -> None:
+        self.items: List[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                if i < len(self.items):
+                    yield self.items[i]
+                    i += 1
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # 最后一个订阅者离开且上游未结束：取消上游，避免白白消耗 token
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class StreamFlights:
+    def __init__(self) -> None:
+        self._flights: Dict[str, StreamFlight] = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def join(self, key: str, source_factory: Callable[[], AsyncIterator[Any]]) -> Tuple[StreamFlight, bool]:
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done:
+            self.stats["coalesced"] += 1
+            return flight, True
+        flight = StreamFlight(source_factory())
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _t, k=key, f=flight: self._forget(k, f))
+        self.stats["leaders"] += 1
+        return flight, False
+
+    def _forget(self, key: str, flight: StreamFlight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def clear(self) -> None:
+        self._flights.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+singleflight = SingleFlight()
+stream_flights = StreamFlights()
+
+
+def coalescing_stats() -> Dict[str, Any]:
+    return {
+        "unary": {**singleflight.stats, "in_flight": singleflight.in_flight()},
+        "stream": {**stream_flights.stats, "in_flight": stream_flights.in_flight()},
+    }
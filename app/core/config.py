@@ -1,4 +1,6 @@
 # app/core/config.py
+from typing import Any, Dict, List
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -11,5 +13,142 @@ class Settings(BaseSettings):
     DATABASE_URL: str | None = None
     OPENAI_API_KEY: str = ""
     GOOGLE_API_KEY: str = ""
+    OPENAI_BASE_URL: str | None = None
+    GOOGLE_BASE_URL: str | None = None  # https://host 为 TLS 代理，http://host:port 为明文 gRPC（如本地桩服务）
+
+    # 供应商客户端连接池（见 app/core/clients.py）
+    LLM_POOL_MAX_CONNECTIONS: int = 100
+    LLM_POOL_MAX_KEEPALIVE: int = 20
+    LLM_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_HTTP2: bool = True
+    LLM_WARM_CLIENTS: bool = True
+    LLM_CLIENT_CACHE_MAX: int = 256           # 缓存的 ChatModel 实例上限（LRU）
+    LLM_CLIENT_CLOSE_GRACE_S: float = 600.0   # 被淘汰的实例等多久再关闭连接（让仍在用它的请求结束）
+
+    # 确定性响应缓存（见 app/core/cache.py）
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024
+    RESPONSE_CACHE_TTL_S: float = 3600.0
+    RESPONSE_CACHE_PERSIST: bool = False
+    RESPONSE_CACHE_PERSIST_MAX_ENTRIES: int = 100_000  # 持久层行数上限，写入时顺带清掉过期行与超出上限的最旧行
+
+    # 响应编码与压缩（见 app/core/encoding.py）：按 Accept-Encoding 协商 zstd / gzip
+    RESPONSE_COMPRESSION: bool = True
+    COMPRESS_MIN_BYTES: int = 4096            # 小于该字节数的 JSON 响应不压缩（流式 NDJSON 总是压缩）
+    COMPRESS_ZSTD_LEVEL: int = 3
+    COMPRESS_GZIP_LEVEL: int = 5
+
+    # 相同在途请求合并（见 app/core/coalesce.py）
+    COALESCE_ENABLED: bool = True
+
+    # 供应商插件（见 app/providers/__init__.py）：{"name": "pkg.module"} 或 {"name": "pkg.module:attr"}，首次使用时导入
+    LLM_PROVIDERS: Dict[str, str] = {}
+
+    # 多 key / base_url 端点池（见 app/core/balancer.py）：{"openai": [{"api_key": "...", "base_url": "..."}, ...]}
+    # 未配置的 provider 使用上面的单个 key
+    LLM_ENDPOINTS: Dict[str, List[Dict[str, str]]] = {}
+    LB_EWMA_ALPHA: float = 0.3                # 延迟 EWMA 的平滑系数
+    LB_EJECT_AFTER_FAILURES: int = 5          # 连续失败多少次熔断摘除
+    LB_BREAKER_COOLDOWN_S: float = 30.0       # 熔断后多久半开放行一个探测请求
+
+    # 别名多后端路由（见 app/core/routing.py）：别名 → 按优先级排列的后端（别名或 "provider/model"）
+    MODEL_ROUTES: Dict[str, List[str]] = {}
+    ROUTE_ATTEMPT_TIMEOUT_S: float = 60.0     # 单个后端的超时（流式为首 token），超时即回退
+    HEDGE_ENABLED: bool = True
+    HEDGE_QUANTILE: float = 0.95              # 对冲延迟取当前后端近期延迟的该分位数
+    HEDGE_MIN_SAMPLES: int = 20               # 样本不足时用默认延迟
+    HEDGE_DEFAULT_DELAY_MS: int = 2000
+    HEDGE_MIN_DELAY_MS: int = 50
+
+    # 客户端限流（见 app/core/ratelimit.py）：{"openai": {"rpm": 500, "tpm": 200000}}，未配置的 provider 不排队
+    RATE_LIMITS: Dict[str, Dict[str, int]] = {}
+    RATE_LIMIT_MAX_RETRIES: int = 3           # 429 之后的重试次数
+    RATE_LIMIT_BACKOFF_S: float = 0.5         # 抖动指数退避的基数
+    RATE_LIMIT_MAX_BACKOFF_S: float = 30.0
+    RATE_LIMIT_DEFAULT_RETRY_S: float = 1.0   # 429 未带 retry-after 时的暂停时长
+    RATE_LIMIT_EST_OUTPUT_TOKENS: int = 256   # 派发前按 prompt + 该值预扣 token，完成后按实际用量修正
+
+    # 请求日志（见 app/core/request_log.py）：内存队列 + 后台批量写库
+    REQUEST_LOG_ENABLED: bool = False
+    REQUEST_LOG_MAX_QUEUE: int = 10_000       # 队列上限，超出按 REQUEST_LOG_OVERFLOW 处理
+    REQUEST_LOG_BATCH_SIZE: int = 500
+    REQUEST_LOG_FLUSH_S: float = 1.0          # 不满一批时最长等待
+    REQUEST_LOG_OVERFLOW: str = "drop"        # drop | spill（追加到 REQUEST_LOG_SPILL_PATH 的 NDJSON）
+    REQUEST_LOG_SPILL_PATH: str = "request_log.spill.ndjson"
+    REQUEST_LOG_PROMPT_HASH: bool = True
+
+    # 租户鉴权与配额（见 app/core/quota.py）：{"acme": {"api_key": "...", "token_quota": 1000000, "request_quota": 5000}}
+    # 配额按 QUOTA_WINDOW_S 窗口计，缺省的一项不限；各 worker 每次从数据库领取一块额度
+    TENANT_AUTH_ENABLED: bool = False
+    TENANTS: Dict[str, Dict[str, Any]] = {}
+    QUOTA_WINDOW_S: float = 86400.0
+    QUOTA_CLAIM_TOKENS: int = 20_000          # 每次领取的 token 块，越小各 worker 间越均衡、写库越频繁
+    QUOTA_CLAIM_REQUESTS: int = 50
+    QUOTA_SYNC_S: float = 5.0                 # 实际用量写回数据库的间隔
+
+    # 服务端会话（见 app/core/conversations.py）：内存 LRU + 可选持久层
+    SESSION_MAX_IN_MEMORY: int = 10_000       # 内存中最多保留的会话数，超出按 LRU 淘汰（持久化时可从库里重新加载）
+    SESSION_MAX_TOKENS: int = 32_000          # 每个会话在内存中保留的历史上限（估算 token）
+    SESSION_HISTORY_TOKENS: int = 8_000       # 每轮随请求发送的历史预算，请求可用 history_tokens 覆盖
+    SESSION_PERSIST: bool = False
+
+    # 批量生成（见 app/batch.py）：单批条数上限与各 provider 并发上限
+    BATCH_MAX_ITEMS: int = 1000
+    BATCH_PROVIDER_CONCURRENCY: Dict[str, int] = {"openai": 8, "google": 8}
+    BATCH_DEFAULT_CONCURRENCY: int = 4
+
+    # SSE delta 合并与背压（见 app/core/sse.py）
+    STREAM_FLUSH_MS: int = 10
+    STREAM_FLUSH_BYTES: int = 1024
+    STREAM_QUEUE_MAX_CHUNKS: int = 64
+
+    # 可续传的 SSE 流（见 app/core/resume.py）：带 Last-Event-ID 重连时回放错过的事件并继续，不重新调用上游
+    # 可续传的流断开后不立即取消上游，因此默认关闭，由请求用 stream_options.resumable 开启
+    STREAM_RESUME_ENABLED: bool = False       # 请求未给 stream_options.resumable 时的默认值
+    STREAM_RESUME_BUFFER_BYTES: int = 262_144  # 每个流的环形缓冲上限，超出丢弃最旧的事件
+    STREAM_RESUME_MAX_STREAMS: int = 1000     # 同时登记的流数上限（含结束后仍在保留期的）
+    STREAM_RESUME_TTL_S: float = 60.0         # 流结束后缓冲的保留时长
+    STREAM_RESUME_GRACE_S: float = 30.0       # 无客户端连接时生成最多继续多久，之后按断开终止
+
+    # 发请求前的 token 记账（见 app/core/accounting.py）
+    CONTEXT_OVERFLOW: str = "reject"        # reject | truncate
+    CONTEXT_RESERVE_TOKENS: int = 1024      # 给回复预留的 token
+    TOKENIZE_OFFLOAD_CHARS: int = 65536     # 超过该字符数时在线程中编码
+
+    # 多进程部署（见 app/server.py）：共享状态文件（SQLite WAL）与停机排空时长
+    SERVER_WORKERS: int = 0                   # 0 表示按 CPU 核数
+    SHARED_STATE_PATH: str | None = None      # 由启动器创建并设置；自行用多 worker 启动时可手动指定同一个文件
+    SHARED_STATE_BUSY_TIMEOUT_MS: int = 20    # 等共享文件写锁的上限：超时的读写放弃、取令牌稍后重试，不阻塞事件循环
+    SHUTDOWN_DRAIN_S: float = 30.0            # 收到 SIGTERM 后等待在途流结束的最长时间
+
+    # 请求截止时间与断开检测（见 app/core/lifecycle.py）
+    REQUEST_TIMEOUT_MS: int = 600_000         # 请求未给 timeout_ms 时的默认时限；0 表示不限
+    CANCEL_ON_DISCONNECT: bool = True         # 客户端断开时立即取消上游调用
+
+    # 准入控制（见 app/core/admission.py）：按优先级类别排队，过载时提前以 429 / 503 拒绝
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_CONCURRENCY: int = 256      # 每个 worker 同时执行的生成请求数（流式持有名额直到流结束）
+    # 类别按优先级从高到低；weight 为排队时的调度份额，max_wait_ms 为预计 / 实际排队时间上限
+    ADMISSION_CLASSES: Dict[str, Dict[str, float]] = {
+        "interactive": {"weight": 8, "max_queue": 256, "max_wait_ms": 5_000},
+        "default": {"weight": 4, "max_queue": 512, "max_wait_ms": 15_000},
+        "batch": {"weight": 1, "max_queue": 1024, "max_wait_ms": 60_000},
+    }
+    ADMISSION_DEFAULT_CLASS: str = "default"
+    ADMISSION_BATCH_CLASS: str = "batch"      # /v1/generate/batch 的各条默认类别
+    ADMISSION_HEADER: str = "X-Priority"
+    ADMISSION_TENANT_PRIORITY: Dict[str, str] = {}  # 租户 → 类别；请求头不能高于该类别
+    ADMISSION_SERVICE_EWMA_ALPHA: float = 0.2  # 名额占用时长 EWMA 的平滑系数（用于估算排队时间）
+
+    # 分阶段计时与采样剖析（见 app/core/timing.py、app/core/profiler.py）
+    TIMING_HEADER: str = "X-Debug-Timing"     # 请求带该头时返回各阶段耗时；空字符串表示不接受
+    ADMIN_TOKEN: str = ""                     # /v1/admin/* 的令牌（Bearer 或 X-Admin-Token）；为空时管理接口不可用
+    PROFILE_MAX_S: float = 60.0               # 单次剖析最长时长
+    PROFILE_MIN_INTERVAL_MS: float = 1.0      # 采样间隔下限，间隔越小剖析期间开销越大
+
+    # 指标与就绪探针（见 app/core/metrics.py）
+    METRICS_MULTIPROC_DIR: str | None = None  # 多 worker 时各进程快照的共享目录，启动前需清空
+    METRICS_FLUSH_S: float = 1.0
+    READINESS_MIN_SAMPLES: int = 20           # 最近窗口内请求数不足时不按错误率判定
+    READINESS_MAX_ERROR_RATE: float = 0.5
 
 settings = Settings()
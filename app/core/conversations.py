@@ -0,0 +1,193 @@
+# app/core/conversations.py
+# 服务端会话：网关保存对话历史，客户端每轮只发会话 id 与新消息，助手回复（含流式）自动追加。
+# 进程内 LRU（按会话数淘汰）在前，可选的持久层（async SQLAlchemy，只追加）在后；淘汰的会话下次访问时从库里加载。
+# 每个会话在内存里只保留 SESSION_MAX_TOKENS 以内的最近轮次（库里保留全部），发给上游的历史再按
+# token 预算开窗：system 消息总是保留，其余从最新一轮往前取到预算用完为止。
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.accounting import estimate_message_tokens
+from app.core.config import settings
+from app.repositories import conversations as repo
+
+
+class SessionNotFound(LookupError):
+    def __init__(self, session_id: str) -> None:
+        super().__init__(f"会话不存在：{session_id}")
+        self.session_id = session_id
+
+
+class ConversationState:
+    __slots__ = ("id", "tenant_id", "created_at", "turns", "tokens", "next_seq")
+
+    def __init__(self, session_id: str, tenant_id: Optional[str], created_at: float) -> None:
+        self.id = session_id
+        self.tenant_id = tenant_id
+        self.created_at = created_at
+        self.turns: List[Tuple[str, str, int]] = []  # (role, content, 估算 token)
+        self.tokens = 0                              # turns 的 token 合计
+        self.next_seq = 0                            # 下一轮的序号（含已移出内存的轮次）
+
+    def add(self, role: str, content: str) -> int:
+        tokens = estimate_message_tokens(content)
+        self.turns.append((role, content, tokens))
+        self.tokens += tokens
+        self.next_seq += 1
+        return self.next_seq - 1
+
+    def trim(self, max_tokens: int) -> None:
+        # 超出上限时丢弃最早的非 system 轮次（库里仍保留）
+        if self.tokens <= max_tokens:
+            return
+        kept: List[Tuple[str, str, int]] = []
+        excess = self.tokens - max_tokens
+        for turn in self.turns:
+            if excess > 0 and turn[0] != "system":
+                excess -= turn[2]
+                self.tokens -= turn[2]
+                continue
+            kept.append(turn)
+        self.turns = kept
+
+    def window(self, new: List[dict], budget: int) -> Tuple[List[dict], Dict[str, Any]]:
+        # 新消息总是发送；system 轮次总是保留；其余从最新往前取，直到 token 预算用完
+        remaining = budget - sum(estimate_message_tokens(m["content"]) for m in new)
+        remaining -= sum(t[2] for t in self.turns if t[0] == "system")
+        keep = [t[0] == "system" for t in self.turns]
+        for i in range(len(self.turns) - 1, -1, -1):
+            role, _, tokens = self.turns[i]
+            if role == "system":
+                continue
+            if tokens > remaining:
+                break
+            keep[i] = True
+            remaining -= tokens
+        history = [{"role": role, "content": content} for (role, content, _), k in zip(self.turns, keep) if k]
+        info = {"id": self.id, "history_messages": len(history),
+                "history_tokens": sum(t[2] for t, k in zip(self.turns, keep) if k),
+                "dropped_messages": len(self.turns) - len(history)}
+        return history + new, info
+
+    def describe(self) -> Dict[str, Any]:
+        return {"id": self.id, "created": int(self.created_at), "turns": self.next_seq,
+                "retained_tokens": self.tokens,
+                "messages": [{"role": role, "content": content} for role, content, _ in self.turns]}
+
+
+class ConversationStore:
+    def __init__(self, max_sessions: int, max_tokens: int) -> None:
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self._entries: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+        self._pending: set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def configure(self, session_factory: Optional[async_sessionmaker[AsyncSession]]) -> None:
+        self._session_factory = session_factory
+
+    def _put(self, conv: ConversationState) -> None:
+        self._entries[conv.id] = conv
+        self._entries.move_to_end(conv.id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def create(self, tenant_id: Optional[str], system: Optional[str] = None) -> ConversationState:
+        conv = ConversationState("sess_" + uuid.uuid4().hex[:16], tenant_id, time.time())
+        if system:
+            conv.add("system", system)
+        if self._session_factory is not None:
+            # 建会话等待落库：之后各轮的追加都依赖这一行
+            async with self._session_factory() as session:
+                await repo.create(session, conv.id, tenant_id, conv.created_at,
+                                  _rows(conv.id, 0, [{"role": r, "content": c} for r, c, _ in conv.turns]))
+        self._put(conv)
+        return conv
+
+    async def get(self, session_id: str, tenant_id: Optional[str] = None) -> ConversationState:
+        conv = self._entries.get(session_id)
+        if conv is not None:
+            self._entries.move_to_end(session_id)
+            self.stats["hits"] += 1
+        elif self._session_factory is not None:
+            conv = await self._load(session_id)
+        # 其他租户的会话按不存在处理
+        if conv is None or conv.tenant_id != tenant_id:
+            raise SessionNotFound(session_id)
+        return conv
+
+    async def _load(self, session_id: str) -> Optional[ConversationState]:
+        await self.drain()  # 先等在途的追加写完，避免加载到缺轮次的历史
+        async with self._session_factory() as session:
+            row = await repo.get(session, session_id)
+            if row is None:
+                return None
+            turns = await repo.load_turns(session, session_id)
+        conv = self._entries.get(session_id)
+        if conv is not None:
+            return conv  # 等待期间已被并发请求加载
+        conv = ConversationState(row.id, row.tenant_id, row.created_at)
+        for turn in turns:
+            conv.add(turn.role, turn.content)
+        conv.next_seq = turns[-1].seq + 1 if turns else 0
+        conv.trim(self.max_tokens)
+        self._put(conv)
+        self.stats["loads"] += 1
+        return conv
+
+    # 追加本轮的新消息与助手回复；内存立即生效，落库放到后台，响应路径不等待数据库
+    def append(self, conv: ConversationState, messages: List[dict]) -> None:
+        start = conv.next_seq
+        for m in messages:
+            conv.add(m["role"], m["content"])
+        conv.trim(self.max_tokens)
+        if conv.id not in self._entries:
+            self._put(conv)  # 处理期间被淘汰：放回，保证下一轮能看到本轮
+        if self._session_factory is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._persist(conv.id, _rows(conv.id, start, messages)))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _persist(self, session_id: str, rows: List[Dict[str, Any]]) -> None:
+        async with self._session_factory() as session:
+            await repo.append_turns(session, session_id, rows, time.time())
+
+    async def delete(self, session_id: str, tenant_id: Optional[str] = None) -> None:
+        await self.get(session_id, tenant_id)
+        self._entries.pop(session_id, None)
+        if self._session_factory is not None:
+            await self.drain()
+            async with self._session_factory() as session:
+                await repo.remove(session, session_id)
+
+    async def drain(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"sessions": len(self._entries), "persistent": self._session_factory is not None,
+                "pending_writes": len(self._pending), **self.stats}
+
+    def clear(self) -> None:
+        self._entries.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+def _rows(session_id: str, start: int, messages: List[dict]) -> List[Dict[str, Any]]:
+    now = time.time()
+    return [{"conversation_id": session_id, "seq": start + i, "role": m["role"], "content": m["content"],
+             "created_at": now} for i, m in enumerate(messages)]
+
+
+conversations = ConversationStore(
+    max_sessions=settings.SESSION_MAX_IN_MEMORY,
+    max_tokens=settings.SESSION_MAX_TOKENS,
+)
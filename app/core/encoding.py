@@ -0,0 +1,89 @@
+# app/core/encoding.py
+# 响应编码：直接产出 JSON 字节（orjson），替代 JSONResponse 的标准库 json.dumps + encode；
+# 实测大文本下 orjson(model_dump()) 比 pydantic-core 的 model_dump_json 还快数倍（见 benchmarks/bench_encoding.py）。
+# 较大的响应体（batch、include_raw）按 Accept-Encoding 协商 zstd / gzip 压缩。
+# 流式 NDJSON 逐行压缩并 flush，客户端仍能逐行收到结果。
+import threading
+import zlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+import orjson
+import zstandard
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+_PREFERENCE = ("zstd", "gzip")
+_local = threading.local()
+
+
+def dumps(obj: Any) -> bytes:
+    # 供应商原始载荷里可能有无法 JSON 化的对象，按 str 兜底，不让整个响应失败
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump()
+    return orjson.dumps(obj, default=str)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    # 解析 Accept-Encoding（含 q 值），按 zstd > gzip 的偏好选择；q=0 表示明确拒绝
+    if not settings.RESPONSE_COMPRESSION or not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    candidates = [e for e in _PREFERENCE if accepted.get(e, accepted.get("*", 0.0)) > 0]
+    return max(candidates, key=lambda e: accepted.get(e, accepted.get("*", 0.0)), default=None)
+
+
+def _zstd() -> zstandard.ZstdCompressor:
+    # ZstdCompressor 不是线程安全的：每个线程复用一个，避免每次重新分配压缩上下文
+    compressor = getattr(_local, "zstd", None)
+    if compressor is None:
+        compressor = _local.zstd = zstandard.ZstdCompressor(level=settings.COMPRESS_ZSTD_LEVEL)
+    return compressor
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd().compress(body)
+    if encoding == "gzip":
+        return zlib.compress(body, settings.COMPRESS_GZIP_LEVEL, wbits=31)
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+
+def json_response(request: Request, obj: Any, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    body = dumps(obj)
+    headers = dict(headers or {})
+    if len(body) >= settings.COMPRESS_MIN_BYTES:
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        if encoding is not None:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+async def compress_stream(stream: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    # 每个分片压缩后立即 flush（zstd 块 / deflate 同步点），保证客户端能增量解码
+    if encoding == "zstd":
+        cobj = zstandard.ZstdCompressor(level=settings.COMPRESS_ZSTD_LEVEL).compressobj()
+        block, final = zstandard.COMPRESSOBJ_FLUSH_BLOCK, zstandard.COMPRESSOBJ_FLUSH_FINISH
+    else:
+        cobj = zlib.compressobj(settings.COMPRESS_GZIP_LEVEL, wbits=31)
+        block, final = zlib.Z_SYNC_FLUSH, zlib.Z_FINISH
+    async for chunk in stream:
+        out = cobj.compress(chunk) + cobj.flush(block)
+        if out:
+            yield out
+    yield cobj.flush(final)
@@ -0,0 +1,210 @@
+# app/core/lifecycle.py
+# 请求生命周期：每个请求一个 Supervisor，以下三种情况提前终止请求——
+# - 截止时间：请求的 timeout_ms（未给出时 REQUEST_TIMEOUT_MS）到期；
+# - 客户端断开：监听 ASGI receive 的 http.disconnect，立即终止，不再为没人接收的输出消耗上游 token；
+# - 排空：worker 收到 SIGTERM（滚动重启或停机）后不再接新连接，在途请求最多再跑 SHUTDOWN_DRAIN_S（见 app/server.py）。
+# 终止一律通过取消请求所在的任务完成：取消沿调用链传到上游调用，ainvoke / astream 随之关闭连接；
+# 转发路径上每帧没有额外开销。终止原因记在 Supervisor 上，指标与请求日志按原因计数（见 termination_reason）。
+# 流式请求补发一条收尾帧（SSE 为 error 事件）后正常结束，客户端可据此重试；非流式请求以 RequestTerminated 返回对应状态码。
+import asyncio
+import contextvars
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from app.core.config import settings
+
+CLIENT_DISCONNECT = "client_disconnect"
+DEADLINE_EXCEEDED = "deadline_exceeded"
+SERVER_SHUTDOWN = "server_shutdown"
+
+_MESSAGES = {
+    CLIENT_DISCONNECT: "客户端已断开",
+    DEADLINE_EXCEEDED: "请求超过时限，本次输出未完成",
+    SERVER_SHUTDOWN: "服务正在重启，本次输出未完成，请重试",
+}
+# 非流式请求被终止时的状态码；499 沿用 nginx 的「客户端已关闭请求」
+_STATUS = {CLIENT_DISCONNECT: 499, DEADLINE_EXCEEDED: 504, SERVER_SHUTDOWN: 503}
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+_current: contextvars.ContextVar[Optional["Supervisor"]] = contextvars.ContextVar("request_supervisor", default=None)
+
+
+# Task.cancelling() / uncancel() 是 3.11 才有的；3.10 的任务没有取消计数，取消是否由自己发起只看 Supervisor 的标记
+def _cancel_pending(task: asyncio.Task) -> bool:
+    cancelling = getattr(task, "cancelling", None)
+    return cancelling is not None and cancelling() > 0
+
+
+class RequestTerminated(Exception):
+    def __init__(self, reason: str, body: Dict[str, Any]) -> None:
+        super().__init__(body["message"])
+        self.reason = reason
+        self.body = body
+        self.status_code = _STATUS.get(reason, 500)
+
+
+def deadline_s(timeout_ms: Optional[int]) -> Optional[float]:
+    ms = timeout_ms if timeout_ms is not None else settings.REQUEST_TIMEOUT_MS
+    return ms / 1000 if ms and ms > 0 else None
+
+
+class Supervisor:
+    __slots__ = ("receive", "timeout_s", "reason", "disconnected", "task", "_cancelled", "_timer", "_watcher", "_token")
+
+    def __init__(self, receive: Optional[Receive] = None, timeout_s: Optional[float] = None) -> None:
+        self.receive = receive if settings.CANCEL_ON_DISCONNECT else None
+        self.timeout_s = timeout_s
+        self.reason: Optional[str] = None
+        self.disconnected = False
+        self.task: Optional[asyncio.Task] = None
+        self._cancelled = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._token: Optional[contextvars.Token] = None
+
+    # 在承载请求的任务里调用（流式为响应体迭代所在的任务）
+    def start(self) -> None:
+        self.task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        if self.timeout_s:
+            self._timer = loop.call_later(self.timeout_s, self.terminate, DEADLINE_EXCEEDED)
+        if self.receive is not None:
+            self._watcher = loop.create_task(self._watch())
+        self._token = _current.set(self)
+        drain.add(self)
+
+    def stop(self) -> None:
+        drain.discard(self)
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                pass  # 在别的上下文里收尾（例如生成器被回收）
+            self._token = None
+
+    async def _watch(self) -> None:
+        # 请求体已由路由读完，之后 receive 只会在客户端断开（或响应结束）时返回
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected = True
+                self.terminate(CLIENT_DISCONNECT)
+                return
+
+    def terminate(self, reason: str) -> None:
+        if self.reason is not None or self.task is None or self.task.done():
+            return
+        self.reason = reason
+        # 已被别处取消（例如 Starlette 自己检测到断开）时只记原因，不重复取消
+        if not _cancel_pending(self.task):
+            self._cancelled = True
+            self.task.cancel(reason)
+
+    # 只接住自己发起的取消，返回终止原因；其他取消照常向上传播
+    def absorb(self) -> Optional[str]:
+        if not self._cancelled:
+            return None
+        self._cancelled = False
+        uncancel = getattr(self.task, "uncancel", None)
+        if uncancel is not None:
+            uncancel()   # 3.11+：撤销计数，之后任务里的 asyncio.timeout / TaskGroup 不会误以为仍在被取消
+        return self.reason
+
+    def error_body(self) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"type": self.reason, "message": _MESSAGES.get(self.reason, "请求已终止")}
+        if self.reason == DEADLINE_EXCEEDED:
+            body["timeout_ms"] = int(self.timeout_s * 1000)
+        return body
+
+    # 非流式：with 块内被终止时改为抛出 RequestTerminated
+    def __enter__(self) -> "Supervisor":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+        if exc_type is asyncio.CancelledError and self.absorb() is not None:
+            raise RequestTerminated(self.reason, self.error_body()) from None
+
+
+# 流式：被终止时按 final(error_body) 补发收尾帧后正常结束；客户端已断开时不再发送
+async def supervise(stream: AsyncIterator[bytes], supervisor: Supervisor,
+                    final: Callable[[Dict[str, Any]], bytes]) -> AsyncIterator[bytes]:
+    supervisor.start()
+    try:
+        async for frame in stream:
+            yield frame
+    except asyncio.CancelledError:
+        reason = supervisor.absorb()
+        if reason is None:
+            raise
+        if reason != CLIENT_DISCONNECT:
+            yield final(supervisor.error_body())
+    finally:
+        supervisor.stop()
+        await stream.aclose()
+
+
+# 当前请求被取消的原因（在取消沿调用链传播时读取）；不是由 Supervisor 发起的取消记为 cancelled
+def termination_reason() -> str:
+    supervisor = _current.get()
+    if supervisor is not None:
+        if supervisor.reason is not None:
+            return supervisor.reason
+        if supervisor.disconnected:
+            return CLIENT_DISCONNECT
+    return "cancelled"
+
+
+class Drain:
+    def __init__(self) -> None:
+        self.deadline: Optional[float] = None
+        self.expired = False
+        self._active: Set[Supervisor] = set()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def draining(self) -> bool:
+        return self.deadline is not None
+
+    # 可在信号处理函数里调用：定时器通过 call_soon_threadsafe 交给事件循环安排
+    def begin(self, timeout_s: float) -> None:
+        if self.deadline is not None:
+            return
+        self.deadline = time.monotonic() + timeout_s
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_soon_threadsafe(self._arm, loop, timeout_s)
+
+    def _arm(self, loop: asyncio.AbstractEventLoop, timeout_s: float) -> None:
+        self._timer = loop.call_later(timeout_s, self._expire)
+
+    def _expire(self) -> None:
+        self.expired = True
+        for supervisor in list(self._active):
+            supervisor.terminate(SERVER_SHUTDOWN)
+
+    def add(self, supervisor: Supervisor) -> None:
+        self._active.add(supervisor)
+        if self.expired:
+            supervisor.terminate(SERVER_SHUTDOWN)
+
+    def discard(self, supervisor: Supervisor) -> None:
+        self._active.discard(supervisor)
+
+    def reset(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self.deadline = None
+        self.expired = False
+        self._timer = None
+        self._active.clear()
+
+
+drain = Drain()
@@ -0,0 +1,336 @@
+# app/core/metrics.py
+# 进程内指标：计数器 / 仪表 / 直方图，按 Prometheus 文本格式导出。
+# 热路径只做 dict 查找与加法；多 worker 部署时各进程定期把快照写到 METRICS_MULTIPROC_DIR，
+# /metrics 汇总所有快照（计数器与直方图累加，仪表只统计仍存活的进程）。
+import asyncio
+import bisect
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.lifecycle import termination_reason
+
+Labels = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str]) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def set(self, labels: Labels, value: float) -> None:
+        self.values[labels] = value
+
+    def snapshot(self) -> List[Any]:
+        return [[list(k), v] for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Labels, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float]) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # 每个 label 组合：[各桶计数（非累计，末位为 +Inf）, sum, count]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def snapshot(self) -> List[Any]:
+        return [[list(k), list(v[0]), v[1], v[2]] for k, v in self.values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Any] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    # 采集前回调：把其他组件自带的计数（缓存、合并）同步进来
+    def register_collector(self, fn: Callable[[], None]) -> None:
+        self.collectors.append(fn)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str]) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str]) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str], buckets: Sequence[float]) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, Any]:
+        for fn in self.collectors:
+            fn()
+        return {"pid": os.getpid(), "metrics": {name: m.snapshot() for name, m in self.metrics.items()}}
+
+    def reset(self) -> None:
+        for m in self.metrics.values():
+            m.values.clear()
+
+    # —— 多进程：写快照 / 汇总快照 ——
+    def write_snapshot(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self, directory: Optional[str] = None) -> Dict[str, Dict[Labels, Any]]:
+        snapshots = [self.snapshot()]
+        if directory:
+            self.write_snapshot(directory)
+            snapshots = _read_snapshots(directory)
+        return self.merge(snapshots)
+
+    def merge(self, snapshots: List[Dict[str, Any]]) -> Dict[str, Dict[Labels, Any]]:
+        merged: Dict[str, Dict[Labels, Any]] = {name: {} for name in self.metrics}
+        for snap in snapshots:
+            alive = _pid_alive(snap.get("pid", 0))
+            for name, series in snap.get("metrics", {}).items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                out = merged[name]
+                for entry in series:
+                    key = tuple(entry[0])
+                    if metric.kind == "histogram":
+                        cur = out.setdefault(key, [[0] * (len(metric.buckets) + 1), 0.0, 0])
+                        cur[0] = [a + b for a, b in zip(cur[0], entry[1])]
+                        cur[1] += entry[2]
+                        cur[2] += entry[3]
+                    else:
+                        out[key] = out.get(key, 0.0) + entry[1]
+        return merged
+
+    def render(self, merged: Dict[str, Dict[Labels, Any]]) -> str:
+        lines: List[str] = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                labels = _fmt_labels(metric.labelnames, key)
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{{{labels}}} {_fmt_num(value)}" if labels else f"{name} {_fmt_num(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric.buckets) + ["+Inf"], value[0]):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else _fmt_num(bound)
+                    sep = "," if labels else ""
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {_fmt_num(value[1])}")
+                lines.append(f"{name}_count{{{labels}}} {value[2]}")
+        return "\n".join(lines) + "\n"
+
+
+def _fmt_labels(names: Sequence[str], values: Labels) -> str:
+    return ",".join(
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"'
+        for n, v in zip(names, values)
+    )
+
+
+def _fmt_num(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, ValueError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshots(directory: str) -> List[Dict[str, Any]]:
+    out = []
+    for fname in os.listdir(directory):
+        if not fname.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, fname)) as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+# —— 最近窗口内的成功 / 失败计数（就绪探针用）——
+class RecentWindow:
+    def __init__(self, window_s: int = 60) -> None:
+        self.window_s = window_s
+        self._buckets: Dict[str, deque] = {}
+
+    def record(self, key: str, error: bool, now: Optional[float] = None) -> None:
+        sec = int(now if now is not None else time.time())
+        buckets = self._buckets.setdefault(key, deque())
+        if buckets and buckets[-1][0] == sec:
+            bucket = buckets[-1]
+        else:
+            bucket = [sec, 0, 0]
+            buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += int(error)
+        self._trim(buckets, sec)
+
+    def _trim(self, buckets: deque, now_sec: int) -> None:
+        while buckets and buckets[0][0] <= now_sec - self.window_s:
+            buckets.popleft()
+
+    def totals(self, key: str, now: Optional[float] = None) -> Tuple[int, int]:
+        buckets = self._buckets.get(key)
+        if not buckets:
+            return 0, 0
+        self._trim(buckets, int(now if now is not None else time.time()))
+        return sum(b[1] for b in buckets), sum(b[2] for b in buckets)
+
+    def keys(self) -> List[str]:
+        return list(self._buckets)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+metrics = MetricsRegistry()
+REQUESTS = metrics.counter("llm_requests_total", "Generation requests by outcome", ["provider", "model", "mode", "status"])
+ERRORS = metrics.counter("llm_errors_total", "Generation errors by exception type", ["provider", "model", "type"])
+IN_FLIGHT = metrics.gauge("llm_in_flight_requests", "Generation requests currently in flight", ["provider", "model"])
+LATENCY = metrics.histogram("llm_request_latency_seconds", "End-to-end generation latency", ["provider", "model", "mode"], LATENCY_BUCKETS)
+TTFT = metrics.histogram("llm_time_to_first_token_seconds", "Time to first streamed token", ["provider", "model"], TTFT_BUCKETS)
+TOKENS = metrics.histogram("llm_tokens", "Tokens per request", ["provider", "model", "kind"], TOKEN_BUCKETS)
+CACHE_LOOKUPS = metrics.counter("llm_cache_lookups_total", "Response cache lookups by result", ["result"])
+REQUEST_LOG_ROWS = metrics.counter("llm_request_log_rows_total", "Request log rows by outcome", ["result"])
+TERMINATED = metrics.counter("llm_terminated_requests_total", "Requests cancelled before completion by reason", ["provider", "model", "mode", "reason"])
+TERMINATED_CHUNKS = metrics.counter("llm_terminated_stream_chunks_total", "Upstream chunks already received when a stream was cancelled", ["provider", "model"])
+ADMISSION_QUEUE = metrics.gauge("llm_admission_queue_depth", "Requests waiting for admission by priority class", ["priority"])
+ADMISSION_IN_FLIGHT = metrics.gauge("llm_admission_in_flight", "Admitted requests currently holding a slot by priority class", ["priority"])
+ADMISSION_SHED = metrics.counter("llm_admission_shed_total", "Requests rejected by admission control", ["priority", "reason"])
+COALESCED = metrics.counter("llm_coalesced_requests_total", "In-flight coalescing leaders and followers", ["mode", "role"])
+recent = RecentWindow()
+
+
+# 客户端给的 provider / 模型名不在已知范围内时统一记为这个标签值，避免任意名字撑大标签序列
+OTHER_LABEL = "other"
+
+
+class RequestTracker:
+    __slots__ = ("provider", "model", "mode", "labels", "t0", "failed", "chunks")
+
+    # provider / model 为原始名字（请求日志用），labels 为指标标签 (provider, model)，默认同原始名字
+    def __init__(self, provider: str, model: str, mode: str, labels: Optional[Tuple[str, str]] = None) -> None:
+        self.provider, self.model, self.mode = provider, model, mode
+        self.labels = labels or (provider, model)
+        self.t0 = time.perf_counter()
+        self.failed: Optional[str] = None
+        self.chunks = 0  # 流式已收到的上游 chunk 数；请求被取消时计入 TERMINATED_CHUNKS
+
+    # 流式请求的错误以 error 事件返回而不是抛出，用这个记下错误类型
+    def fail(self, error_type: str) -> None:
+        self.failed = error_type
+
+    def ttft(self, seconds: Optional[float]) -> None:
+        if seconds is not None:
+            TTFT.observe(self.labels, seconds)
+
+    def usage(self, usage: Dict[str, Any]) -> None:
+        TOKENS.observe((*self.labels, "prompt"), usage.get("prompt_tokens", 0) or 0)
+        TOKENS.observe((*self.labels, "completion"), usage.get("completion_tokens", 0) or 0)
+
+
+@contextmanager
+def track_request(provider: str, model: str, mode: str,
+                  labels: Optional[Tuple[str, str]] = None) -> Iterator[RequestTracker]:
+    tracker = RequestTracker(provider, model, mode, labels)
+    key = provider, model = tracker.labels
+    IN_FLIGHT.inc(key)
+    status = "ok"
+    try:
+        yield tracker
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"
+        TERMINATED.inc((provider, model, mode, termination_reason()))
+        if tracker.chunks:
+            TERMINATED_CHUNKS.inc((provider, model), tracker.chunks)
+        raise
+    except Exception as e:
+        status = "error"
+        ERRORS.inc((provider, model, type(e).__name__))
+        raise
+    finally:
+        if status == "ok" and tracker.failed:
+            status = "error"
+            ERRORS.inc((provider, model, tracker.failed))
+        IN_FLIGHT.dec(key)
+        REQUESTS.inc((provider, model, mode, status))
+        LATENCY.observe((provider, model, mode), time.perf_counter() - tracker.t0)
+        if status != "cancelled":
+            recent.record(provider, status == "error")
+
+
+# —— 就绪：各 provider 最近错误率与饱和度 ——
+def readiness() -> Dict[str, Any]:
+    in_flight: Dict[str, float] = {}
+    for (provider, _model), value in IN_FLIGHT.values.items():
+        in_flight[provider] = in_flight.get(provider, 0.0) + value
+    capacity = max(1, settings.LLM_POOL_MAX_CONNECTIONS)
+    providers: Dict[str, Any] = {}
+    ready = True
+    for provider in sorted(set(in_flight) | set(recent.keys())):
+        total, errors = recent.totals(provider)
+        error_rate = errors / total if total else 0.0
+        saturation = in_flight.get(provider, 0.0) / capacity
+        degraded = (total >= settings.READINESS_MIN_SAMPLES and error_rate > settings.READINESS_MAX_ERROR_RATE) \
+            or saturation >= 1.0
+        ready = ready and not degraded
+        providers[provider] = {
+            "requests": total,
+            "error_rate": round(error_rate, 4),
+            "in_flight": int(in_flight.get(provider, 0)),
+            "saturation": round(saturation, 4),
+            "status": "degraded" if degraded else "ok",
+        }
+    return {"ready": ready, "window_s": recent.window_s, "providers": providers}
+
+
+async def flush_forever(directory: str, interval_s: float) -> None:
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            metrics.write_snapshot(directory)
+        except OSError:
+            pass
@@ -0,0 +1,97 @@
+# app/core/profiler.py
+# 采样剖析：在独立线程里按固定间隔读取 sys._current_frames()，把调用栈累计为 collapsed stack 文本
+# （每行 "线程;外层函数;...;内层函数 次数"，可直接交给 flamegraph.pl / speedscope / inferno）。
+# 不依赖外部工具、不改解释器设置，只在剖析期间有开销；同一进程同时只跑一个剖析。
+# 默认只采事件循环线程（网关自身的工作都在这里）；all_threads 时也采线程池（大 prompt 编码、同步调用等）。
+import asyncio
+import os
+import sys
+import threading
+import time
+from types import CodeType
+from typing import Dict, List, Optional
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    # 在后台线程采样 seconds 秒；调用方被取消（客户端断开）时提前停止
+    async def profile(self, seconds: float, interval_s: float, thread_id: Optional[int] = None) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("已有剖析在进行")
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        stop = threading.Event()
+
+        def deliver(result: str, error: Optional[BaseException]) -> None:
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run() -> None:
+            result, error = "", None
+            try:
+                result = self._sample(seconds, interval_s, thread_id, stop)
+            except Exception as e:
+                error = e
+            finally:
+                self._lock.release()
+            try:
+                loop.call_soon_threadsafe(deliver, result, error)
+            except RuntimeError:
+                pass  # 事件循环已关闭（进程退出中）
+
+        threading.Thread(target=run, name="sampling-profiler", daemon=True).start()
+        try:
+            return await future
+        finally:
+            stop.set()
+
+    def _sample(self, seconds: float, interval_s: float, thread_id: Optional[int], stop: threading.Event) -> str:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        labels: Dict[CodeType, str] = {}
+        counts: Dict[str, int] = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not stop.is_set():
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (thread_id is not None and ident != thread_id):
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident) or f"thread-{ident}")
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            stop.wait(interval_s)
+        return "".join(f"{key} {n}\n" for key, n in sorted(counts.items()))
+
+
+# 项目内文件显示为相对路径，第三方库从 site-packages 之后截取，火焰图里更易读
+def _short_path(path: str) -> str:
+    marker = "site-packages" + os.sep
+    i = path.rfind(marker)
+    if i >= 0:
+        return path[i + len(marker):]
+    cwd = os.getcwd() + os.sep
+    return path[len(cwd):] if path.startswith(cwd) else path
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,284 @@
+# app/core/quota.py
+# 租户配额：按 API key 识别租户，每个配额窗口限定 token 数与请求数。
+# 热路径只动内存：派发前从本进程的「已领取额度」里预扣估算值，完成后按 Usage.total_tokens 多退少补。
+# 本进程额度不够时才去数据库领取一块（条件 UPDATE，多 worker 并发领取也不会超过配额），
+# 因此 N 个 uvicorn worker 合计领取的额度不超过配额，租户不能靠 worker 数放大配额；
+# 实际用量由后台任务定期写回数据库，关闭时归还未用完的额度。
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.repositories import tenants as repo
+
+
+def key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class TenantInfo:
+    id: str
+    token_quota: Optional[int] = None    # 每个窗口；None 为不限
+    request_quota: Optional[int] = None
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, tenant: TenantInfo, kind: str, retry_after_s: float, headers: Dict[str, str]) -> None:
+        super().__init__(f"租户 {tenant.id} 的 {kind} 配额已用完，{int(retry_after_s) + 1} 秒后窗口重置")
+        self.tenant = tenant
+        self.kind = kind
+        self.retry_after_s = retry_after_s
+        self.headers = headers
+
+
+@dataclass
+class Reservation:
+    tenant: TenantInfo
+    window: int
+    tokens: int
+    requests: int
+    settled: bool = False
+
+
+@dataclass
+class _Account:
+    tenant: TenantInfo
+    window: int
+    allow_tokens: int = 0       # 本进程已领取、尚未预扣的额度（按实际用量修正后可能为负）
+    allow_requests: int = 0
+    claimed_tokens: int = 0     # 最近一次同步时全部 worker 已领取的总额
+    claimed_requests: int = 0
+    # 窗口 → [tokens, requests]：尚未写回数据库的实际用量（窗口切换后旧窗口的用量仍写回旧行）
+    pending: Dict[int, List[int]] = field(default_factory=dict)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class QuotaLedger:
+    def __init__(self, window_s: float, claim_tokens: int, claim_requests: int) -> None:
+        self.window_s = window_s
+        self.claim_tokens = claim_tokens
+        self.claim_requests = claim_requests
+        self._session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+        self._tenants: Dict[str, TenantInfo] = {}      # key 哈希 → 租户
+        self._configured: Dict[str, Tuple[TenantInfo, str]] = {}  # 租户 id → (租户, key 哈希)，来自配置
+        self._accounts: Dict[str, _Account] = {}
+        self.stats = {"reserved": 0, "rejected": 0, "claims": 0, "syncs": 0, "failed_syncs": 0}
+
+    # —— 租户 ——
+    def configure(self, session_factory: Optional[async_sessionmaker[AsyncSession]]) -> None:
+        self._session_factory = session_factory
+
+    # 登记（或更新）一个租户；换 key 时旧 key 立即失效
+    def add_tenant(self, tenant: TenantInfo, api_key_hash: str) -> None:
+        self._configured[tenant.id] = (tenant, api_key_hash)
+        self._install(self._configured.values())
+
+    async def load_tenants(self, seed: Dict[str, Dict[str, Any]]) -> int:
+        # seed 来自 settings.TENANTS（明文 key 只在这里出现一次），只有其中的租户有效；有数据库时先写入再以数据库为准
+        self._configured = {
+            tenant_id: (TenantInfo(tenant_id, spec.get("token_quota"), spec.get("request_quota")),
+                        key_hash(spec["api_key"]))
+            for tenant_id, spec in seed.items()
+        }
+        if self._session_factory is not None:
+            async with self._session_factory() as session:
+                for tenant, api_key_hash in self._configured.values():
+                    await repo.upsert_tenant(session, tenant.id, api_key_hash, tenant.token_quota,
+                                             tenant.request_quota)
+        return await self.reload_tenants()
+
+    # 按数据库刷新已配置租户的 key 与配额（其他 worker 可能带着更新的配置启动）；
+    # 每次重建 key → 租户映射：轮换前的 key 失效，已从配置中删除的租户即使库里还有行也不再放行
+    async def reload_tenants(self) -> int:
+        entries = dict(self._configured)
+        if self._session_factory is not None:
+            async with self._session_factory() as session:
+                for row in await repo.list_tenants(session):
+                    if row.id in entries:
+                        entries[row.id] = (TenantInfo(row.id, row.token_quota, row.request_quota), row.api_key_hash)
+        self._install(entries.values())
+        return len(self._tenants)
+
+    def _install(self, entries: Iterable[Tuple[TenantInfo, str]]) -> None:
+        tenants: Dict[str, TenantInfo] = {}
+        for tenant, api_key_hash in entries:
+            tenants[api_key_hash] = tenant
+            acct = self._accounts.get(tenant.id)
+            if acct is not None:
+                acct.tenant = tenant
+        self._tenants = tenants
+
+    def authenticate(self, api_key: str) -> Optional[TenantInfo]:
+        return self._tenants.get(key_hash(api_key)) if api_key else None
+
+    # —— 窗口 ——
+    def _window(self, now: float) -> int:
+        return int(now // self.window_s * self.window_s)
+
+    def reset_in(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        return self._window(now) + self.window_s - now
+
+    def _account(self, tenant: TenantInfo) -> _Account:
+        window = self._window(time.time())
+        acct = self._accounts.get(tenant.id)
+        if acct is None:
+            acct = self._accounts[tenant.id] = _Account(tenant, window)
+        elif acct.window != window:
+            # 新窗口：上个窗口领取的额度作废，未写回的用量保留在 pending 里
+            acct.window = window
+            acct.allow_tokens = acct.allow_requests = 0
+            acct.claimed_tokens = acct.claimed_requests = 0
+        return acct
+
+    # —— 预扣与结算 ——
+    def _covers(self, acct: _Account, tokens: int, requests: int) -> bool:
+        t = acct.tenant
+        return ((t.token_quota is None or acct.allow_tokens >= tokens)
+                and (t.request_quota is None or acct.allow_requests >= requests))
+
+    async def reserve(self, tenant: TenantInfo, tokens: int, requests: int = 1) -> Reservation:
+        acct = self._account(tenant)
+        if not self._covers(acct, tokens, requests):
+            async with acct.lock:
+                if not self._covers(acct, tokens, requests):
+                    await self._claim(acct, tokens, requests)
+                if not self._covers(acct, tokens, requests):
+                    self.stats["rejected"] += 1
+                    kind = "token" if tenant.token_quota is not None and acct.allow_tokens < tokens else "request"
+                    raise QuotaExceeded(tenant, kind, self.reset_in(), self.headers(tenant))
+        acct.allow_tokens -= tokens
+        acct.allow_requests -= requests
+        self.stats["reserved"] += 1
+        return Reservation(tenant, acct.window, tokens, requests)
+
+    async def _claim(self, acct: _Account, tokens: int, requests: int) -> None:
+        # 一次领取一块（至少够这次请求），减少往返；领取量受全局剩余额度限制
+        t = acct.tenant
+        want_t = max(tokens - acct.allow_tokens, self.claim_tokens) if t.token_quota is not None else 0
+        want_r = max(requests - acct.allow_requests, self.claim_requests) if t.request_quota is not None else 0
+        self.stats["claims"] += 1
+        if self._session_factory is None:
+            # 单进程（未配置数据库）：本地即全局
+            grant_t = want_t if t.token_quota is None else max(0, min(want_t, t.token_quota - acct.claimed_tokens))
+            grant_r = (want_r if t.request_quota is None
+                       else max(0, min(want_r, t.request_quota - acct.claimed_requests)))
+            claimed = (acct.claimed_tokens + grant_t, acct.claimed_requests + grant_r)
+        else:
+            async with self._session_factory() as session:
+                grant_t, grant_r, row = await repo.claim(session, t.id, acct.window, want_t, want_r,
+                                                         t.token_quota, t.request_quota)
+            claimed = (row.tokens_claimed, row.requests_claimed)
+        acct.allow_tokens += grant_t
+        acct.allow_requests += grant_r
+        acct.claimed_tokens, acct.claimed_requests = claimed
+
+    def settle(self, res: Reservation, actual_tokens: int) -> None:
+        # 多退少补：实际用量超过估算时本地额度变负，下一次预扣会先补领
+        if res.settled:
+            return
+        res.settled = True
+        acct = self._accounts.get(res.tenant.id)
+        if acct is None:
+            return
+        if acct.window == res.window:
+            acct.allow_tokens += res.tokens - actual_tokens
+        used = acct.pending.setdefault(res.window, [0, 0])
+        used[0] += actual_tokens
+        used[1] += res.requests
+
+    # —— 剩余额度（响应头）——
+    def remaining(self, tenant: TenantInfo) -> Tuple[Optional[int], Optional[int]]:
+        acct = self._account(tenant)
+        tokens = (None if tenant.token_quota is None
+                  else max(0, tenant.token_quota - acct.claimed_tokens + acct.allow_tokens))
+        requests = (None if tenant.request_quota is None
+                    else max(0, tenant.request_quota - acct.claimed_requests + acct.allow_requests))
+        return tokens, requests
+
+    def headers(self, tenant: TenantInfo) -> Dict[str, str]:
+        tokens, requests = self.remaining(tenant)
+        out = {"X-Quota-Reset": str(int(self.reset_in()) + 1)}
+        if tokens is not None:
+            out["X-Quota-Remaining-Tokens"] = str(tokens)
+        if requests is not None:
+            out["X-Quota-Remaining-Requests"] = str(requests)
+        return out
+
+    # —— 与数据库对账 ——
+    async def sync(self, release: bool = False) -> None:
+        # 写回实际用量并刷新各租户的全局领取总额；release=True 时同时归还本进程未用完的额度
+        if self._session_factory is None:
+            return
+        try:
+            async with self._session_factory() as session:
+                for acct in list(self._accounts.values()):
+                    for window, (tokens, requests) in list(acct.pending.items()):
+                        if window != acct.window:
+                            await repo.add_usage(session, acct.tenant.id, window, tokens, requests)
+                            del acct.pending[window]
+                    tokens, requests = acct.pending.get(acct.window, (0, 0))
+                    give_t = max(0, acct.allow_tokens) if release else 0
+                    give_r = max(0, acct.allow_requests) if release else 0
+                    row = await repo.add_usage(session, acct.tenant.id, acct.window, tokens, requests, give_t, give_r)
+                    used = acct.pending.get(acct.window)
+                    if used is not None:
+                        # 写库期间可能又有请求结算，只扣掉已写回的部分
+                        used[0] -= tokens
+                        used[1] -= requests
+                        if used == [0, 0]:
+                            del acct.pending[acct.window]
+                    acct.allow_tokens -= give_t
+                    acct.allow_requests -= give_r
+                    acct.claimed_tokens, acct.claimed_requests = row.tokens_claimed, row.requests_claimed
+        except Exception:
+            # 对账失败不影响请求：用量留在内存，下一轮再写
+            self.stats["failed_syncs"] += 1
+            return
+        self.stats["syncs"] += 1
+
+    async def sync_forever(self, interval_s: float) -> None:
+        while True:
+            await asyncio.sleep(interval_s)
+            await self.sync()
+            try:
+                await self.reload_tenants()
+            except Exception:
+                # 读库失败时沿用当前的租户表，下一轮再试；同步任务不能因一次失败而退出
+                self.stats["failed_syncs"] += 1
+
+    async def aclose(self) -> None:
+        await self.sync(release=True)
+        self._session_factory = None
+
+    # detail=False 时只给汇总计数，不列出各租户的剩余额度（公开的 /v1/stats 使用）
+    def describe(self, detail: bool = True) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"tenants": len(self._tenants), **self.stats}
+        if not detail:
+            return out
+        out["accounts"] = {}
+        for tenant_id, acct in self._accounts.items():
+            tokens, requests = self.remaining(acct.tenant)
+            out["accounts"][tenant_id] = {"window": acct.window, "remaining_tokens": tokens,
+                                          "remaining_requests": requests, "local_tokens": acct.allow_tokens,
+                                          "local_requests": acct.allow_requests}
+        return out
+
+    def clear(self) -> None:
+        self._tenants.clear()
+        self._configured.clear()
+        self._accounts.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+quota_ledger = QuotaLedger(
+    window_s=settings.QUOTA_WINDOW_S,
+    claim_tokens=settings.QUOTA_CLAIM_TOKENS,
+    claim_requests=settings.QUOTA_CLAIM_REQUESTS,
+)
@@ -0,0 +1,224 @@
+# app/core/ratelimit.py
+# 客户端限流：每个 provider（可选再按 API key）一对令牌桶——请求数/分钟与 token 数/分钟，请求在派发前排队取令牌。
+# 上游返回 429 / 配额错误时按 AIMD 自适应：速率减半并在 retry-after 之前暂停派发，之后每次成功逐步恢复；
+# 重试交给 tenacity（指数退避 + 随机抖动），供应商 SDK 自带的重试关闭，避免 429 被吞掉。
+# 多 worker 部署配置了共享状态（app/core/shared.py）时，令牌桶与 429 暂停放在共享文件里，所有 worker 合计不超过限额。
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from app.core.config import settings
+from app.core.shared import shared_state
+
+T = TypeVar("T")
+
+_MIN_SCALE = 0.1
+_RECOVER_STEP = 0.05
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    # 识别限流错误并取出建议等待秒数；不是限流错误返回 None（沿 __cause__ 链查找被包装的原始异常）
+    seen = 0
+    while exc is not None and seen < 5:
+        status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+        if status == 429 or type(exc).__name__ in ("RateLimitError", "ResourceExhausted"):
+            return _retry_after_header(exc)
+        exc = exc.__cause__ or exc.__context__
+        seen += 1
+    return None
+
+
+def _retry_after_header(exc: BaseException) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return settings.RATE_LIMIT_DEFAULT_RETRY_S
+
+
+def retry_policy() -> Dict[str, Any]:
+    # tenacity 参数：只重试限流错误，抖动退避；同步 / 异步路径共用
+    return {
+        "retry": retry_if_exception(lambda e: retry_after(e) is not None),
+        "stop": stop_after_attempt(settings.RATE_LIMIT_MAX_RETRIES + 1),
+        "wait": wait_random_exponential(multiplier=settings.RATE_LIMIT_BACKOFF_S,
+                                        max=settings.RATE_LIMIT_MAX_BACKOFF_S),
+        "reraise": True,
+    }
+
+
+class TokenBucket:
+    __slots__ = ("per_min", "level", "updated")
+
+    def __init__(self, per_min: int) -> None:
+        self.per_min = per_min
+        self.level = float(per_min)  # 容量为一分钟的额度
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float, scale: float) -> None:
+        capacity = self.per_min * scale
+        self.level = min(capacity, self.level + (now - self.updated) * capacity / 60)
+        self.updated = now
+
+    # 还需等待多少秒才能取到 amount（超过容量的请求只要求桶满，之后桶变为负值）
+    def delay(self, amount: float, now: float, scale: float) -> float:
+        self._refill(now, scale)
+        need = min(amount, self.per_min * scale) - self.level
+        return need * 60 / (self.per_min * scale) if need > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+
+class ProviderLimiter:
+    def __init__(self, rpm: Optional[int], tpm: Optional[int], name: str = "") -> None:
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.scale = 1.0
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.throttled = 0
+        self._lock = asyncio.Lock()  # asyncio.Lock 先到先得，排队按到达顺序
+
+    async def acquire(self, tokens: int) -> float:
+        t0 = time.monotonic()
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    wait = self._take_shared(tokens) if shared_state.enabled else self._take(tokens)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+        return time.monotonic() - t0
+
+    # 取到令牌返回 0，否则返回还需等待的秒数
+    def _take(self, tokens: int) -> float:
+        now = time.monotonic()
+        wait = self.blocked_until - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.delay(1, now, self.scale))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.delay(tokens, now, self.scale))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        return 0.0
+
+    def _take_shared(self, tokens: int) -> float:
+        # 本进程的 429 暂停先判断，再到共享桶里原子地取令牌（AIMD 缩放按本进程观察到的 429 计算）
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        buckets = []
+        if self.requests is not None:
+            buckets.append((f"{self.name}:rpm", 1, self.requests.per_min * self.scale))
+        if self.tokens is not None:
+            buckets.append((f"{self.name}:tpm", tokens, self.tokens.per_min * self.scale))
+        wait = shared_state.take(buckets, pause_key=self.name)
+        if wait is None:
+            # 共享文件被其他 worker 占着：稍等再到共享桶里取（不能改用进程内的桶——共享模式下它从不扣减，
+            # 每个 worker 都会放出整整一分钟的额度）
+            return settings.SHARED_STATE_BUSY_TIMEOUT_MS / 1000
+        return wait
+
+    # 429：速率减半，retry-after 之前不再派发（共享状态下所有 worker 一起暂停）
+    def throttle(self, retry_after_s: float) -> None:
+        self.scale = max(_MIN_SCALE, self.scale / 2)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after_s)
+        self.throttled += 1
+        if shared_state.enabled:
+            shared_state.pause(self.name, time.time() + retry_after_s)
+
+    def relax(self) -> None:
+        if self.scale < 1.0:
+            self.scale = min(1.0, self.scale + _RECOVER_STEP)
+
+    # 等待上游结果并据此调整速率：限流错误时暂停派发并减速，成功时逐步恢复
+    async def observe(self, call: Awaitable[T]) -> T:
+        try:
+            result = await call
+        except Exception as e:
+            delay = retry_after(e)
+            if delay is not None:
+                self.throttle(delay)
+            raise
+        self.relax()
+        return result
+
+    # 按实际用量修正预扣的 token（多退少补）
+    def settle(self, estimated: int, actual: int) -> None:
+        if self.tokens is not None and actual != estimated:
+            if shared_state.enabled:
+                shared_state.adjust(f"{self.name}:tpm", actual - estimated)
+            else:
+                self.tokens.take(actual - estimated)
+
+    def state(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        out: Dict[str, Any] = {
+            "scale": round(self.scale, 3),
+            "waiting": self.waiting,
+            "throttled": self.throttled,
+            "blocked_for_s": round(max(0.0, self.blocked_until - now), 3),
+        }
+        for name, bucket in (("rpm", self.requests), ("tpm", self.tokens)):
+            if bucket is not None:
+                bucket._refill(now, self.scale)
+                out[name] = {"limit": bucket.per_min, "effective": int(bucket.per_min * self.scale),
+                             "available": int(bucket.level)}
+        return out
+
+
+class RateLimiter:
+    def __init__(self) -> None:
+        self._limiters: Dict[Tuple[str, Optional[str]], ProviderLimiter] = {}
+
+    # 未在 RATE_LIMITS 中配置的 provider 不排队，但仍会对 429 做退避
+    def limiter(self, provider: str, key: Optional[str] = None) -> ProviderLimiter:
+        limiter = self._limiters.get((provider, key))
+        if limiter is None:
+            limits = settings.RATE_LIMITS.get(provider, {})
+            name = provider if key is None else f"{provider}:{key}"
+            limiter = self._limiters[(provider, key)] = ProviderLimiter(limits.get("rpm"), limits.get("tpm"), name)
+        return limiter
+
+    async def call(self, provider: str, tokens: int, fn: Callable[[], Awaitable[T]],
+                   key: Optional[str] = None) -> Tuple[T, float]:
+        # 返回 (结果, 排队等待秒数)；等待包含 retry-after 暂停，不含 tenacity 的抖动退避
+        limiter = self.limiter(provider, key)
+        waited = 0.0
+        async for attempt in AsyncRetrying(**retry_policy()):
+            with attempt:
+                waited += await limiter.acquire(tokens)
+                result = await limiter.observe(fn())
+        return result, waited
+
+    def settle(self, provider: str, estimated: int, actual: int, key: Optional[str] = None) -> None:
+        self.limiter(provider, key).settle(estimated, actual)
+
+    def state(self) -> Dict[str, Any]:
+        return {(p if k is None else f"{p}:{k}"): lim.state() for (p, k), lim in self._limiters.items()}
+
+    def clear(self) -> None:
+        self._limiters.clear()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,149 @@
+# app/core/request_log.py
+# 请求日志（write-behind）：响应路径只把一行记录追加到内存队列，后台任务按批量 INSERT 写入数据库。
+# 队列有上限：数据库变慢时按策略丢弃或溢写到本地 NDJSON 文件，并计数；关闭时把队列写完。
+import asyncio
+import hashlib
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.repositories import request_log as repo
+
+
+def prompt_hash(messages: List[dict]) -> str:
+    return hashlib.sha256(orjson.dumps(messages)).hexdigest()
+
+
+class RequestLogWriter:
+    def __init__(self, max_queue: int, batch_size: int, flush_s: float) -> None:
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._session_factory: Optional[async_sessionmaker[AsyncSession]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spill = None
+        self._closing = False
+        self.stats = {"written": 0, "dropped": 0, "spilled": 0, "batches": 0, "failed_batches": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self._session_factory is not None
+
+    def start(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        self._session_factory = session_factory
+        self._closing = False
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    # 热路径：O(1) 追加，不做任何 I/O（溢写策略下队列满时除外）
+    def record(self, row: Dict[str, Any]) -> None:
+        if self._session_factory is None:
+            return
+        if len(self._queue) >= self.max_queue:
+            self._overflow([row])
+            return
+        self._queue.append(row)
+        if len(self._queue) >= self.batch_size and self._loop is not None and not self._wakeup.is_set():
+            # 同步路径可能在线程池里调用，用 call_soon_threadsafe 唤醒写入任务
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _overflow(self, rows: List[Dict[str, Any]]) -> None:
+        if settings.REQUEST_LOG_OVERFLOW == "spill":
+            try:
+                if self._spill is None:
+                    self._spill = open(settings.REQUEST_LOG_SPILL_PATH, "ab")
+                self._spill.write(b"".join(orjson.dumps(r) + b"\n" for r in rows))
+                self.stats["spilled"] += len(rows)
+                return
+            except OSError:
+                pass
+        self.stats["dropped"] += len(rows)
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        n = min(self.batch_size, len(self._queue))
+        return [self._queue.popleft() for _ in range(n)]
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        try:
+            async with self._session_factory() as session:
+                await repo.insert_many(session, rows)
+        except Exception:
+            # 写库失败不重试（避免队列在故障期间无限堆积），按溢出策略处理这一批
+            self.stats["failed_batches"] += 1
+            self._overflow(rows)
+            return
+        self.stats["written"] += len(rows)
+        self.stats["batches"] += 1
+
+    # 攒够一批立即写，否则最多等 flush_s 把零头写掉
+    async def _run(self) -> None:
+        while True:
+            if len(self._queue) < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_s)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            while self._queue:
+                await self._write(self._take_batch())
+            if self._closing:
+                return
+
+    # 关闭：通知后台任务把剩余记录按批写完后退出（不取消，避免丢掉写到一半的批次）
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._session_factory = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "queued": len(self._queue), **self.stats}
+
+    def clear(self) -> None:
+        self._queue.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+request_log = RequestLogWriter(
+    max_queue=settings.REQUEST_LOG_MAX_QUEUE,
+    batch_size=settings.REQUEST_LOG_BATCH_SIZE,
+    flush_s=settings.REQUEST_LOG_FLUSH_S,
+)
+
+
+def log_row(req_id: str, alias: str, provider: str, model: str, mode: str, status: str,
+            error_type: Optional[str], usage: Optional[Dict[str, Any]], latency_ms: int,
+            messages: Optional[List[dict]]) -> Dict[str, Any]:
+    usage = usage or {}
+    return {
+        "id": req_id,
+        "created_at": time.time(),
+        "alias": alias,
+        "provider": provider,
+        "model": model,
+        "mode": mode,
+        "status": status,
+        "error_type": error_type,
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "total_tokens": usage.get("total_tokens", 0) or 0,
+        "latency_ms": latency_ms,
+        "prompt_hash": prompt_hash(messages) if messages is not None and settings.REQUEST_LOG_PROMPT_HASH else None,
+    }
@@ -0,0 +1,190 @@
+# app/core/resume.py
+# 可续传的 SSE 流：生成由独立任务驱动，不随客户端连接结束；产出的帧带序号 id（"<流 id>:<序号>"），
+# 写入每个流一个、按字节封顶（STREAM_RESUME_BUFFER_BYTES）的环形缓冲，超出时丢弃最旧的帧。
+# 客户端网络中断后带 Last-Event-ID 重连：先回放缓冲里错过的帧，再跟随实时输出，不会再向上游发一次请求。
+# - 没有客户端连接的流最多继续 STREAM_RESUME_GRACE_S，之后按客户端断开终止（不再为没人接收的输出消耗 token）；
+# - 流结束后缓冲再保留 STREAM_RESUME_TTL_S 供重连取尾部；
+# - 同时登记的流不超过 STREAM_RESUME_MAX_STREAMS（先淘汰已结束的），登记不下的流按普通流处理。
+# 缓冲在进程内：多 worker 部署时重连需落在同一个 worker 上（见 README）。
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.sse import sse_frame
+
+
+class StreamNotFound(LookupError):
+    def __init__(self, event_id: str) -> None:
+        super().__init__(f"流不存在或已过期：{event_id}")
+        self.event_id = event_id
+
+
+# Last-Event-ID → (流 id, 最后收到的序号)
+def parse_event_id(event_id: str) -> Tuple[str, int]:
+    stream_id, sep, seq = event_id.rpartition(":")
+    if not sep or not stream_id or not seq.isdigit():
+        raise StreamNotFound(event_id)
+    return stream_id, int(seq)
+
+
+class ResumableStream:
+    def __init__(self, stream_id: str, tenant_id: Optional[str], on_abandon: Callable[[], None]) -> None:
+        self.id = stream_id
+        self.tenant_id = tenant_id
+        self.frames: Deque[bytes] = deque()
+        self.first_seq = 0          # frames[0] 的序号
+        self.next_seq = 0
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._on_abandon = on_abandon
+        self._grace: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+        self._prefix = b"id: " + stream_id.encode() + b":"
+
+    def start(self, source: AsyncIterator[bytes]) -> None:
+        self.task = asyncio.ensure_future(self._pump(source))
+        # 客户端在响应开始前就断开时也不会一直生成下去
+        self._grace = asyncio.get_running_loop().call_later(settings.STREAM_RESUME_GRACE_S, self._abandon)
+
+    async def _pump(self, source: AsyncIterator[bytes]) -> None:
+        try:
+            async for frame in source:
+                self._append(frame)
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.finished_at = time.monotonic()
+            if self._grace is not None:
+                self._grace.cancel()
+            self._notify()
+
+    def _append(self, frame: bytes) -> None:
+        framed = self._prefix + str(self.next_seq).encode() + b"\n" + frame
+        self.frames.append(framed)
+        self.next_seq += 1
+        self.size += len(framed)
+        # 环形缓冲：按字节封顶，至少保留最新一帧
+        while self.size > settings.STREAM_RESUME_BUFFER_BYTES and len(self.frames) > 1:
+            self.size -= len(self.frames.popleft())
+            self.first_seq += 1
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    # 从序号 after 之后开始读：先回放缓冲，再跟随实时输出；要的帧已被挤出缓冲时以 error 事件告知
+    async def subscribe(self, after: int = -1) -> AsyncIterator[bytes]:
+        self.subscribers += 1
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+        seq = after + 1
+        try:
+            while True:
+                if seq < self.first_seq:
+                    yield sse_frame("error", {"type": "resume_unavailable",
+                                              "message": "请求的事件已不在缓冲中，请重新发起请求",
+                                              "first_available": f"{self.id}:{self.first_seq}"})
+                    return
+                if seq < self.next_seq:
+                    frame = self.frames[seq - self.first_seq]
+                    seq += 1
+                    yield frame
+                    continue
+                if self.done:
+                    if self.error is not None and not isinstance(self.error, asyncio.CancelledError):
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                # 没人在读：宽限期内无人重连则终止生成
+                self._grace = asyncio.get_running_loop().call_later(settings.STREAM_RESUME_GRACE_S, self._abandon)
+
+    def _abandon(self) -> None:
+        self._grace = None
+        if self.subscribers == 0 and not self.done:
+            self._on_abandon()
+
+
+class ResumableStreams:
+    def __init__(self) -> None:
+        self._streams: Dict[str, ResumableStream] = {}
+        self.stats = {"started": 0, "resumed": 0, "expired": 0, "not_found": 0, "rejected": 0}
+
+    # 还能否登记新流（必要时淘汰最早结束的）；不能时调用方按普通流处理
+    def has_room(self) -> bool:
+        self._expire()
+        if len(self._streams) < settings.STREAM_RESUME_MAX_STREAMS or self._evict_finished():
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    # 登记一个新流并启动生成；on_abandon 在无人连接超过宽限期时调用，负责终止生成
+    def start(self, source: AsyncIterator[bytes], tenant_id: Optional[str],
+              on_abandon: Callable[[], None]) -> ResumableStream:
+        stream = ResumableStream("rs_" + uuid.uuid4().hex[:16], tenant_id, on_abandon)
+        self._streams[stream.id] = stream
+        stream.start(source)
+        self.stats["started"] += 1
+        return stream
+
+    # 按流 id 找回流；其他租户的流同样按不存在处理
+    def resume(self, stream_id: str, tenant_id: Optional[str]) -> ResumableStream:
+        self._expire()
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.tenant_id != tenant_id:
+            self.stats["not_found"] += 1
+            raise StreamNotFound(stream_id)
+        self.stats["resumed"] += 1
+        return stream
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - settings.STREAM_RESUME_TTL_S
+        for stream_id, stream in list(self._streams.items()):
+            if stream.finished_at is not None and stream.finished_at < cutoff:
+                del self._streams[stream_id]
+                self.stats["expired"] += 1
+
+    def _evict_finished(self) -> bool:
+        finished = [s for s in self._streams.values() if s.finished_at is not None]
+        if not finished:
+            return False
+        oldest = min(finished, key=lambda s: s.finished_at)
+        del self._streams[oldest.id]
+        self.stats["expired"] += 1
+        return True
+
+    def describe(self) -> Dict[str, int]:
+        running = sum(not s.done for s in self._streams.values())
+        return {**self.stats, "running": running, "buffered": len(self._streams),
+                "buffer_bytes": sum(s.size for s in self._streams.values())}
+
+    # 关闭时取消仍在生成的流
+    async def aclose(self) -> None:
+        tasks = [s.task for s in self._streams.values() if s.task is not None and not s.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams.clear()
+
+    def clear(self) -> None:
+        self._streams.clear()
+        for k in self.stats:
+            self.stats[k] = 0
+
+
+resumable_streams = ResumableStreams()
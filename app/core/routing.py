@@ -0,0 +1,116 @@
+# app/core/routing.py
+# 别名多后端路由：按顺序回退（出错 / 超时换下一个后端），以及延迟对冲——
+# 当前后端超过其近期延迟分位数仍未返回（流式为首 token）时，向下一个后端再发一份，先到者胜，败者取消。
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+
+Backend = Tuple[str, str]
+T = TypeVar("T")
+
+
+def backend_name(backend: Backend) -> str:
+    return f"{backend[0]}/{backend[1]}"
+
+
+# 每个 (后端, 类型) 保留最近的成功样本；对冲延迟取其分位数，样本不足时用默认值
+class LatencyStats:
+    def __init__(self, window: int = 256) -> None:
+        self.window = window
+        self._samples: Dict[Tuple[Backend, str], Deque[float]] = {}
+
+    def record(self, backend: Backend, kind: str, seconds: float) -> None:
+        samples = self._samples.get((backend, kind))
+        if samples is None:
+            samples = self._samples[(backend, kind)] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def hedge_delay(self, backend: Backend, kind: str) -> float:
+        samples = self._samples.get((backend, kind))
+        if not samples or len(samples) < settings.HEDGE_MIN_SAMPLES:
+            return settings.HEDGE_DEFAULT_DELAY_MS / 1000
+        ordered = sorted(samples)
+        q = ordered[min(len(ordered) - 1, int(settings.HEDGE_QUANTILE * len(ordered)))]
+        return max(q, settings.HEDGE_MIN_DELAY_MS / 1000)
+
+    def clear(self) -> None:
+        self._samples.clear()
+
+
+latency_stats = LatencyStats()
+
+
+@dataclass
+class Route:
+    backend: Backend
+    hedged: bool = False
+    attempts: int = 1
+    errors: List[str] = field(default_factory=list)
+    queue_ms: float = 0.0  # 限流排队等待，单独报告在 observability.queue_ms
+    limit_key: Optional[str] = None  # 取令牌所用的限流器（多端点时为端点 id），结束后按它修正预扣
+
+    def describe(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"backend": backend_name(self.backend), "hedged": self.hedged, "attempts": self.attempts}
+        if self.errors:
+            out["errors"] = self.errors
+        return out
+
+
+async def route_call(backends: List[Backend], attempt: Callable[[Backend], Awaitable[T]], kind: str,
+                     discard: Optional[Callable[[T], Awaitable[None]]] = None) -> Tuple[T, Route]:
+    # 单后端：直接调用，不引入任务与计时开销
+    if len(backends) == 1:
+        return await attempt(backends[0]), Route(backends[0])
+
+    remaining = list(backends)
+    pending: Dict[asyncio.Future, Tuple[Backend, float]] = {}
+    route = Route(backends[0], attempts=0)
+
+    def launch() -> None:
+        backend = remaining.pop(0)
+        task = asyncio.ensure_future(asyncio.wait_for(attempt(backend), settings.ROUTE_ATTEMPT_TIMEOUT_S))
+        pending[task] = (backend, time.perf_counter())
+        route.attempts += 1
+
+    launch()
+    last_error: Optional[BaseException] = None
+    try:
+        while pending:
+            timeout = None
+            if settings.HEDGE_ENABLED and not route.hedged and remaining:
+                timeout = latency_stats.hedge_delay(next(iter(pending.values()))[0], kind)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 对冲只发一次：之后只等先到者或失败回退
+                route.hedged = True
+                launch()
+                continue
+            winner = None
+            for task in done:
+                backend, started = pending.pop(task)
+                error = task.exception()
+                if error is not None:
+                    last_error = error
+                    route.errors.append(f"{backend_name(backend)}: {type(error).__name__}")
+                elif winner is None:
+                    winner = task.result()
+                    route.backend = backend
+                    latency_stats.record(backend, kind, time.perf_counter() - started)
+                elif discard is not None:
+                    await discard(task.result())
+            if winner is not None:
+                return winner, route
+            if not pending and remaining:
+                launch()
+        raise last_error
+    finally:
+        for task in pending:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                if discard is not None:
+                    await discard(task.result())
+            else:
+                task.cancel()
@@ -0,0 +1,128 @@
+# app/core/shared.py
+# 跨 worker 共享状态：本机一个 SQLite 文件（WAL 模式），由多进程启动器（app/server.py）创建并通过 SHARED_STATE_PATH 传给各 worker。
+# 只放必须全局一致的少量状态：响应缓存的共享层（键值 + 过期时间）与限流令牌桶。
+# 每次操作是一条短事务（本地文件，亚毫秒级），直接在事件循环里同步执行；未配置时各组件退回进程内状态。
+# 等锁最多 SHARED_STATE_BUSY_TIMEOUT_MS：worker 争用写锁时不能让整个事件循环停住，
+# 拿不到锁的这次操作放弃（读按未命中、写跳过），取令牌则由限流器稍等后重试（见 app/core/ratelimit.py）。
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS pauses (key TEXT PRIMARY KEY, until REAL NOT NULL);
+"""
+
+
+class SharedState:
+    def __init__(self) -> None:
+        self.path: Optional[str] = None
+        self._local = threading.local()
+        self.busy = 0   # 因等锁超时而放弃的操作数
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def configure(self, path: Optional[str]) -> None:
+        self.path = path
+        self._local = threading.local()
+        if path is not None:
+            self._conn().executescript(_SCHEMA)
+
+    # 每个线程各自一个连接；sqlite3 连接不能跨线程 / 跨 fork 复用，fork 之后按 pid 重新连接
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=settings.SHARED_STATE_BUSY_TIMEOUT_MS / 1000,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # 共享状态可丢，不为它等磁盘刷写
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # —— 键值（带过期时间）——
+    # 执行一条语句；等锁超时（或文件出错）时记一次 busy 并返回 None，共享状态可丢
+    def _execute(self, sql: str, params: Tuple = ()) -> Optional[sqlite3.Cursor]:
+        try:
+            return self._conn().execute(sql, params)
+        except sqlite3.OperationalError:
+            self.busy += 1
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        cur = self._execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,))
+        row = cur.fetchone() if cur is not None else None
+        if row is None or (row[1] and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key: str, value: bytes, ttl_s: float = 0.0) -> None:
+        expires_at = time.time() + ttl_s if ttl_s > 0 else 0.0
+        self._execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+
+    def prune(self, max_entries: int) -> None:
+        # 过期项与超出条数上限的最早过期项一起删掉
+        if self._execute("DELETE FROM kv WHERE expires_at > 0 AND expires_at < ?", (time.time(),)) is not None:
+            self._execute("DELETE FROM kv WHERE key IN (SELECT key FROM kv ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                          (max_entries,))
+
+    # —— 令牌桶：一次事务内对多个桶「全部取到或全部不取」——
+    # buckets 为 (key, amount, per_min)；返回 0 表示已扣除，否则为还需等待的秒数。暂停（pause）期间一律等待。
+    # 等不到写锁时返回 None，由调用方退回进程内状态
+    def take(self, buckets: List[Tuple[str, float, float]], pause_key: Optional[str] = None) -> Optional[float]:
+        conn = self._conn()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            self.busy += 1
+            return None
+        try:
+            wait = 0.0
+            if pause_key is not None:
+                row = conn.execute("SELECT until FROM pauses WHERE key = ?", (pause_key,)).fetchone()
+                if row is not None:
+                    wait = max(0.0, row[0] - now)
+            levels = []
+            for key, amount, per_min in buckets:
+                row = conn.execute("SELECT level, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                level = per_min if row is None else min(per_min, row[0] + (now - row[1]) * per_min / 60)
+                need = min(amount, per_min) - level
+                if need > 0:
+                    wait = max(wait, need * 60 / per_min)
+                levels.append((key, level - amount))
+            if wait <= 0:
+                conn.executemany("INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                                 [(key, level, now) for key, level in levels])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def adjust(self, key: str, amount: float) -> None:
+        # 预扣修正：多退少补（桶可以变为负值）
+        self._execute("UPDATE buckets SET level = level - ? WHERE key = ?", (amount, key))
+
+    def pause(self, key: str, until: float) -> None:
+        self._execute("INSERT INTO pauses (key, until) VALUES (?, ?) "
+                      "ON CONFLICT(key) DO UPDATE SET until = MAX(until, excluded.until)", (key, until))
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local = threading.local()
+
+    def clear(self) -> None:
+        if self.enabled:
+            self._conn().executescript("DELETE FROM kv; DELETE FROM buckets; DELETE FROM pauses;")
+
+
+shared_state = SharedState()
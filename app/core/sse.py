@@ -0,0 +1,135 @@
+# app/core/sse.py
+# SSE 帧编码与 delta 合并。
+# - 帧直接编码为 bytes（orjson），delta 帧的固定前后缀预先编码好，逐帧只序列化文本本身；
+# - 首个 delta 立即下发（低延迟），之后按时间窗 / 字节预算合并成一帧，减少小包写入；
+# - 上游读取与下游发送之间用有界队列衔接：客户端读得慢时队列写满，上游读取随之暂停；
+# - n>1 时各候选的 delta 流汇入同一个有界队列，按到达顺序带 index 下发。
+import asyncio
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import orjson
+
+_DELTA_SUFFIX = b"}\n\n"
+_delta_prefixes: dict[int, bytes] = {}
+
+
+def sse_frame(event: str, data: Any) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+def delta_frame(text: str, index: int = 0) -> bytes:
+    prefix = _delta_prefixes.get(index)
+    if prefix is None:
+        prefix = _delta_prefixes[index] = b'event: delta\ndata: {"index":%d,"delta":' % index
+    return prefix + orjson.dumps(text) + _DELTA_SUFFIX
+
+
+_END = object()
+
+
+class _Failed:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+
+async def coalesce_deltas(texts: AsyncIterator[str], flush_ms: int, flush_bytes: int,
+                          queue_size: int) -> AsyncIterator[str]:
+    # flush_ms 与 flush_bytes 都为 0：逐 delta 下发，纯拉取模式，天然背压
+    if flush_ms <= 0 and flush_bytes <= 0:
+        async for text in texts:
+            yield text
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+    async def pump() -> None:
+        try:
+            async for text in texts:
+                await queue.put(text)  # 队列满时在此等待 → 背压传回上游
+        except Exception as e:
+            await queue.put(_Failed(e))
+            return
+        finally:
+            aclose = getattr(texts, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        await queue.put(_END)
+
+    producer = asyncio.ensure_future(pump())
+    window = flush_ms / 1000 if flush_ms > 0 else None
+    getter: Optional[asyncio.Future] = None
+    buf: list[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(queue.get())
+            timeout = max(0.0, deadline - loop.time()) if (buf and window is not None) else None
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+            if not done:
+                # 时间窗到期：即使没有新 chunk 也把已缓冲的内容发出去
+                yield "".join(buf)
+                buf, size = [], 0
+                continue
+            item, getter = getter.result(), None
+            if item is _END:
+                break
+            if isinstance(item, _Failed):
+                if buf:
+                    yield "".join(buf)
+                raise item.error
+            if first:
+                first = False
+                yield item
+                continue
+            if not buf:
+                deadline = loop.time() + (window or 0.0)
+            buf.append(item)
+            size += len(item)
+            if flush_bytes > 0 and size >= flush_bytes:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        if getter is not None:
+            getter.cancel()
+        producer.cancel()
+
+
+# 多路 delta 合流：每路一个搬运任务，共享一个有界队列（同样带背压）；任一路出错即整体出错，其余各路随之取消
+async def merge_deltas(streams: List[AsyncIterator[str]], queue_size: int) -> AsyncIterator[Tuple[int, str]]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+    async def pump(index: int, stream: AsyncIterator[str]) -> None:
+        try:
+            async for text in stream:
+                await queue.put((index, text))
+        except Exception as e:
+            await queue.put(_Failed(e))
+            return
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        await queue.put(_END)
+
+    producers = [asyncio.ensure_future(pump(i, stream)) for i, stream in enumerate(streams)]
+    remaining = len(producers)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _END:
+                remaining -= 1
+                continue
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        for producer in producers:
+            producer.cancel()
@@ -0,0 +1,104 @@
+# app/core/stream_meter.py
+# 流式请求计量：累计供应商 usage、首 token 时间（TTFT）、总延迟与 token 间隔分布。
+# 间隔存进 array('d')（连续 double 缓冲区），逐 chunk 不保留额外 Python 对象。
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+
+
+def _pct(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class StreamMeter:
+    __slots__ = ("t0", "first_at", "last_at", "gaps", "chunks",
+                 "prompt_tokens", "completion_tokens", "total_tokens", "reasoning_tokens", "finish_reason")
+
+    def __init__(self, t0: Optional[float] = None) -> None:
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.gaps = array("d")
+        self.chunks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.reasoning_tokens = 0
+        self.finish_reason = "stop"
+
+    # 每个上游 chunk 调一次：有文本时记时间点，有 usage 时累加（OpenAI 在末尾 chunk 给出，Gemini 逐 chunk 给增量）
+    def observe(self, chunk: Any, has_text: bool) -> None:
+        if has_text:
+            now = time.perf_counter()
+            if self.chunks:
+                self.gaps.append(now - self.last_at)
+            else:
+                self.first_at = now
+            self.last_at = now
+            self.chunks += 1
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.add_usage(usage)
+        meta = getattr(chunk, "response_metadata", None)
+        if meta:
+            reason = meta.get("finish_reason")
+            if isinstance(reason, str) and reason:
+                self.finish_reason = reason.lower()
+
+    def add_usage(self, usage: Dict[str, Any]) -> None:
+        self.prompt_tokens += usage.get("input_tokens", 0) or 0
+        self.completion_tokens += usage.get("output_tokens", 0) or 0
+        self.total_tokens += usage.get("total_tokens", 0) or 0
+        details = usage.get("output_token_details") or {}
+        self.reasoning_tokens += details.get("reasoning", 0) or 0
+
+    # n>1 时每个候选各自计量，结束后合并：usage 相加，首 token 取最早，token 间隔一起统计
+    @classmethod
+    def combine(cls, meters: List["StreamMeter"]) -> "StreamMeter":
+        out = cls(min(m.t0 for m in meters))
+        started = [m for m in meters if m.chunks]
+        if started:
+            out.first_at = min(m.first_at for m in started)
+            out.last_at = max(m.last_at for m in started)
+        for m in meters:
+            out.gaps.extend(m.gaps)
+            out.chunks += m.chunks
+            out.prompt_tokens += m.prompt_tokens
+            out.completion_tokens += m.completion_tokens
+            out.total_tokens += m.total_tokens
+            out.reasoning_tokens += m.reasoning_tokens
+        return out
+
+    def usage(self) -> Dict[str, Any]:
+        total = self.total_tokens or (self.prompt_tokens + self.completion_tokens)
+        out: Dict[str, Any] = {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": total,
+        }
+        if self.reasoning_tokens:
+            out["reasoning_tokens"] = self.reasoning_tokens
+        return out
+
+    def latency_ms(self) -> int:
+        return int((time.perf_counter() - self.t0) * 1000)
+
+    # 与 UnifiedResponse.observability 同形的计量结果
+    def observability(self) -> Dict[str, Any]:
+        gaps = sorted(self.gaps)
+        return {
+            "latency_ms": self.latency_ms(),
+            "ttft_ms": round((self.first_at - self.t0) * 1000, 1) if self.chunks else None,
+            "inter_token_ms": {
+                "p50": round(_pct(gaps, 0.50) * 1000, 1),
+                "p95": round(_pct(gaps, 0.95) * 1000, 1),
+                "max": round(gaps[-1] * 1000, 1) if gaps else 0.0,
+            },
+            "chunks": self.chunks,
+        }
+
+    def done_event(self) -> Dict[str, Any]:
+        obs = self.observability()
+        return {"usage": self.usage(), "latency_ms": obs["latency_ms"], "observability": obs}
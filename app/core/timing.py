@@ -0,0 +1,94 @@
+# app/core/timing.py
+# 分阶段计时：请求带调试头（settings.TIMING_HEADER）时，把网关自身各阶段的耗时记下来返回给调用方，
+# 用来区分 p99 里哪部分是网关、哪部分是上游。计时对象放在 contextvar 里，沿调用链（含 ensure_future 派生的任务）可见；
+# 未开启时 span() 只多一次 contextvar 读取，返回共享的空上下文。
+# 同名阶段累加（扇出 / 对冲的多次上游调用合计），阶段名与含义见 README 的 Stage Timing 一节。
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+_current: contextvars.ContextVar[Optional["Timings"]] = contextvars.ContextVar("request_timings", default=None)
+_NULL = nullcontext()
+
+
+class Timings:
+    __slots__ = ("t0", "spans")
+
+    def __init__(self, t0: Optional[float] = None) -> None:
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    # 各阶段毫秒数，另带从请求到达至今的 total
+    def describe(self) -> Dict[str, float]:
+        out = {name: round(s * 1000, 3) for name, s in self.spans.items()}
+        out["total"] = round((time.perf_counter() - self.t0) * 1000, 3)
+        return out
+
+    # W3C Server-Timing 头：浏览器开发者工具与多数 APM 可直接展示
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.describe().items())
+
+
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: Timings, name: str) -> None:
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+
+def span(name: str) -> ContextManager[None]:
+    timings = _current.get()
+    return _Span(timings, name) if timings is not None else _NULL
+
+
+# 已知耗时（如限流排队）直接记入当前请求
+def record(name: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+
+# 路由里开启计时：arrived 为请求到达时刻（见 ArrivalStamp），到达到进入路由之间记为 parse
+def start_timings(arrived: Optional[float] = None) -> Timings:
+    timings = Timings(arrived)
+    if arrived is not None:
+        timings.add("parse", time.perf_counter() - arrived)
+    _current.set(timings)
+    return timings
+
+
+# 脚本里给 generate_sync 等调用计时：with collect_timings() as t: ...; t.describe()
+@contextmanager
+def collect_timings() -> Iterator[Timings]:
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+# ASGI 中间件：记下请求到达时刻，路由据此算出读请求体、解析 JSON、校验与依赖注入（parse）的耗时
+class ArrivalStamp:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] == "http":
+            scope["arrived_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
@@ -1,14 +1,37 @@
 # app/llm.py
-import time, uuid, json
-from typing import List, Dict, Any, Iterable, Tuple
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple
+
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from tenacity import AsyncRetrying, Retrying
 
-from app.schemas.llm import (
-    GenerateRequest, UnifiedResponse, Choice, Usage, Message
+from app.core.accounting import (
+    ContextWindowExceeded,
+    ModelSpec,
+    Preflight,
+    afit_context,
+    cost_usd,
+    fit_context,
 )
+from app.core.balancer import Endpoint, EndpointPool, Lease, balancer
+from app.core.cache import cache_key, response_cache
+from app.core.coalesce import singleflight, stream_flights
+from app.core.config import settings
+from app.core.conversations import ConversationState, conversations
+from app.core.lifecycle import termination_reason
+from app.core.metrics import OTHER_LABEL, RequestTracker, track_request
+from app.core.ratelimit import rate_limiter, retry_policy
+from app.core.request_log import log_row, request_log
+from app.core.routing import Backend, Route, route_call
+from app.core.sse import coalesce_deltas, delta_frame, merge_deltas, sse_frame
+from app.core.stream_meter import StreamMeter
+from app.core.timing import current_timings, record, span
+from app.providers import providers, to_lc_messages  # noqa: F401  保留 app.llm.to_lc_messages 这个旧导入路径
+from app.schemas.llm import Choice, GenerateRequest, UnifiedResponse, Usage
 
 load_dotenv()
 
@@ -20,11 +43,38 @@ ALIASES: Dict[str, Tuple[str, str]] = {
     "gemini-flash": ("google", "gemini-1.5-flash"),
     "gemini-pro":   ("google", "gemini-1.5-pro"),
 }
-def resolve_model(name: str) -> tuple[str, str]:
+# 模型规格与价格（美元 / 百万 token），按 ALIASES 解析出的真实模型名索引
+MODEL_SPECS: Dict[str, ModelSpec] = {
+    "gpt-4o-mini":      ModelSpec(context_window=128_000, max_output_tokens=16_384, input_usd_per_1m=0.15, output_usd_per_1m=0.60),
+    "gpt-4o":           ModelSpec(context_window=128_000, max_output_tokens=16_384, input_usd_per_1m=2.50, output_usd_per_1m=10.00),
+    "gemini-1.5-flash": ModelSpec(context_window=1_048_576, max_output_tokens=8_192, input_usd_per_1m=0.075, output_usd_per_1m=0.30),
+    "gemini-1.5-pro":   ModelSpec(context_window=2_097_152, max_output_tokens=8_192, input_usd_per_1m=1.25, output_usd_per_1m=5.00),
+}
+
+def _resolve_one(name: str) -> tuple[str, str]:
     if name in ALIASES: return ALIASES[name]
     if "/" in name: return tuple(name.split("/", 1))  # 支持 "openai/gpt-4o-mini"
     raise ValueError(f"未知模型名：{name}")
 
+# 别名可在 settings.MODEL_ROUTES 中配置为多个后端（按优先级），主后端为第一个
+def resolve_backends(name: str) -> List[Backend]:
+    route = settings.MODEL_ROUTES.get(name)
+    if route:
+        return [_resolve_one(b) for b in route]
+    return [_resolve_one(name)]
+
+def resolve_model(name: str) -> tuple[str, str]:
+    return resolve_backends(name)[0]
+
+# 指标标签只用已知取值（已注册的 provider；ALIASES、MODEL_SPECS 与 MODEL_ROUTES 里的模型），
+# 客户端随意给的 "provider/model" 都记为 other，标签序列数有界；请求日志仍记原始名字
+def _metric_labels(provider: str, real: str) -> tuple[str, str]:
+    if provider not in providers.modules():
+        return OTHER_LABEL, OTHER_LABEL
+    known = real in MODEL_SPECS or any(real == m for _, m in ALIASES.values()) or any(
+        b.split("/", 1)[-1] == real for route in settings.MODEL_ROUTES.values() for b in route)
+    return provider, real if known else OTHER_LABEL
+
 # —— 2) 输入归一（messages 或 input → messages[dict]）——
 def normalize_messages(req: GenerateRequest) -> List[dict]:
     if req.messages and len(req.messages) > 0:
@@ -33,130 +83,567 @@ def normalize_messages(req: GenerateRequest) -> List[dict]:
         return [{"role": "user", "content": req.input}]
     raise ValueError("messages 或 input 至少提供一个")
 
-def to_lc_messages(messages: List[dict]):
-    out = []
-    for m in messages:
-        if m["role"] == "system":
-            out.append(SystemMessage(content=m["content"]))
-        else:
-            out.append(HumanMessage(content=m["content"]))
-    return out
+# —— 2.1) 供应商：插件式注册表，首次使用时才导入对应 SDK（见 app/providers/）——
+# 启动时为已配置的供应商预建别名对应的客户端，返回预热数量；未配置的供应商不会被导入
+def warm_clients() -> int:
+    configured = set(providers.configured())
+    warmed = 0
+    for provider, real in set(ALIASES.values()):
+        if provider not in configured:
+            continue
+        for endpoint in balancer.pool(provider).endpoints:
+            try:
+                providers.get(provider).client(real, 0.0, endpoint)
+                warmed += 1
+            except Exception:
+                continue
+    return warmed
 
-# —— 3) OpenAI 同步调用，返回统一字段 —— 
-def _run_openai_sync(real_model: str, messages: List[dict], temperature: float, include_raw: bool) -> Dict[str, Any]:
-    llm = ChatOpenAI(model=real_model, temperature=temperature)
-    resp = llm.invoke(to_lc_messages(messages))
-    raw = dict(resp)
-    usage = getattr(resp, "usage_metadata", {}) or {}
-    return {
-        "provider": "openai",
-        "model": real_model,
-        "text": getattr(resp, "content", ""),
-        "finish_reason": getattr(resp, "finish_reason", "stop"),
-        "usage": {
-            "prompt_tokens": usage.get("input_tokens", 0),
-            "completion_tokens": usage.get("output_tokens", 0),
-            "total_tokens": usage.get("total_tokens", 0),
-        },
-        "raw": raw
-    }
 
-# —— NEW 3) Gemini 同步调用，返回统一字段 ——
-def _run_gemini_sync(real_model: str, messages: List[dict], temperature: float, include_raw: bool) -> Dict[str, Any]:
-    print(real_model)
-    llm = ChatGoogleGenerativeAI(
-        model=real_model,
-        temperature=temperature,
-        # 如需更严格安全：safety_settings={...}
+# 费用：按价格表与实际 usage 计算；未知模型或供应商未返回 usage 时标记为估算
+def _cost_fields(model: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+    cost = cost_usd(MODEL_SPECS.get(model), usage)
+    return {"cost_usd": cost or 0.0, "estimated": cost is None or not usage.get("total_tokens")}
+
+def _overflow_strategy(req: GenerateRequest) -> str:
+    return req.context_overflow or settings.CONTEXT_OVERFLOW
+
+def _build_response(req: GenerateRequest, result: Dict[str, Any], req_id: str, created: int, latency: int,
+                    preflight: Preflight | None = None) -> UnifiedResponse:
+    usage = Usage(**result["usage"])
+    observability = {"latency_ms": latency, **_cost_fields(result["model"], result["usage"])}
+    if preflight is not None:
+        observability["preflight"] = preflight.describe()
+    if "route" in result:
+        observability["route"] = result["route"]
+    if "queue_ms" in result:
+        observability["queue_ms"] = result["queue_ms"]
+    if "samples" in result:
+        observability["samples"] = result["samples"]
+    return UnifiedResponse(
+        id=req_id,
+        created=created,
+        provider=result["provider"],
+        model=result["model"],
+        choices=[Choice(index=i, content=c["text"], finish_reason=c["finish_reason"])
+                 for i, c in enumerate(result.get("choices") or [result])],
+        usage=usage,
+        observability=observability,
+        raw=(result.get("raw") if req.include_raw else None),
     )
-    resp = llm.invoke(to_lc_messages(messages))
-    
-    usage = getattr(resp, "usage_metadata", {}) or {}
-    # Gemini 的 usage 字段名与 OpenAI 略有不同，这里做兼容兜底：
-    pt = usage.get("prompt_token_count") or usage.get("input_tokens") or 0
-    ct = usage.get("candidates_token_count") or usage.get("output_tokens") or 0
-    tt = usage.get("total_token_count") or usage.get("total_tokens") or (pt + ct)
-    rt = usage.get("thoughts_token_count") or usage.get("reasoning_tokens")
-    raw = dict(resp)
-    return {
-        "provider": "google",
-        "model": real_model,
-        "text": getattr(resp, "content", ""),
-        "finish_reason": getattr(resp, "finish_reason", "stop"),
-        "usage": {
-            "prompt_tokens": pt,
-            "completion_tokens": ct,
-            "total_tokens": tt,
-            "reasoning_tokens": rt,
-        },
-        "raw": raw
-    }
 
 
-# —— 4) 对外：同步统一响应 —— 
+# 多端点时限流按端点（key）区分，单端点沿用 provider 级限流器
+def _limit_key(pool: EndpointPool, endpoint: Endpoint) -> str | None:
+    return endpoint.id if len(pool.endpoints) > 1 else None
+
+
+# 请求指纹：缓存与在途合并共用（解析后的模型 + 归一化消息 + 生成参数）
+# n>1 的调用方要的是多个不同候选，不缓存也不合并
+def _request_key(req: GenerateRequest, provider: str, real: str, messages: List[dict]) -> str | None:
+    if req.n > 1 or not (response_cache.cacheable(req) or _coalescible(req)):
+        return None
+    return cache_key(provider, real, messages, {"temperature": req.temperature})
+
+# 只合并确定性请求：temperature>0 的调用方本就期望各自独立采样；include_raw 的原始载荷只为请求方生成，不共享
+def _coalescible(req: GenerateRequest) -> bool:
+    return settings.COALESCE_ENABLED and req.temperature == 0.0 and not req.include_raw
+
+
+# —— 4) 对外：同步统一响应（脚本/非事件循环场景使用；缓存只用内存层）—— 
 def generate_sync(req: GenerateRequest) -> UnifiedResponse:
-    messages = normalize_messages(req)
-    provider, real = resolve_model(req.model_name)
+    _reject_async_only(req)
+    with span("normalize"):
+        messages = normalize_messages(req)
+    with span("resolve"):
+        provider, real = resolve_model(req.model_name)
+    with track_request(provider, real, "unary", _metric_labels(provider, real)) as tracker:
+        try:
+            out = _generate_sync(req, messages, provider, real)
+        except BaseException as e:
+            _log_request(req, messages, "unary", tracker, {}, e)
+            raise
+        _track_usage(tracker, out)
+        _log_request(req, messages, "unary", tracker, _outcome(out))
+        _attach_timings(out.observability)
+        return out
+
+
+def _outcome(out: UnifiedResponse) -> Dict[str, Any]:
+    return {"id": out.id, "provider": out.provider, "model": out.model, "usage": out.usage.model_dump()}
+
+
+# 调用方开启了分阶段计时（调试头 / collect_timings）时，把各阶段耗时放进 observability（见 app/core/timing.py）
+def _attach_timings(observability: Dict[str, Any]) -> None:
+    timings = current_timings()
+    if timings is not None:
+        observability["timings"] = timings.describe()
+
+
+def _reject_async_only(req: GenerateRequest) -> None:
+    if req.session_id:
+        raise ValueError("服务端会话仅支持异步接口")
+    if req.n > 1:
+        raise ValueError("n>1 仅支持异步接口")
+
+
+# 服务端会话：历史按 token 预算开窗后拼在本轮新消息之前
+async def _with_history(req: GenerateRequest, conversation: ConversationState | None,
+                        messages: List[dict]) -> Tuple[ConversationState | None, List[dict], Dict[str, Any] | None]:
+    if not req.session_id:
+        return None, messages, None
+    with span("history"):
+        if conversation is None:
+            conversation = await conversations.get(req.session_id)
+        budget = req.history_tokens if req.history_tokens is not None else settings.SESSION_HISTORY_TOKENS
+        prompt, window = conversation.window(messages, budget)
+    return conversation, prompt, window
+
+
+# 请求日志：只往内存队列追加一行，写库由后台任务批量完成（见 app/core/request_log.py）
+def _log_request(req: GenerateRequest, messages: List[dict], mode: str, tracker: RequestTracker,
+                 outcome: Dict[str, Any], error: BaseException | None = None) -> None:
+    if not request_log.enabled:
+        return
+    status, error_type = "ok", None
+    if error is not None:
+        # 被取消的请求记下原因：客户端断开 / 超时 / 排空（见 app/core/lifecycle.py）
+        cancelled = isinstance(error, (GeneratorExit, asyncio.CancelledError))
+        status, error_type = ("cancelled", termination_reason()) if cancelled else ("error", type(error).__name__)
+    elif tracker.failed:
+        status, error_type = "error", tracker.failed
+    request_log.record(log_row(
+        outcome.get("id") or "req_" + uuid.uuid4().hex[:16], req.model_name,
+        outcome.get("provider", tracker.provider), outcome.get("model", tracker.model), mode, status, error_type,
+        outcome.get("usage"), int((time.perf_counter() - tracker.t0) * 1000), messages,
+    ))
+
+
+def _track_usage(tracker, out: UnifiedResponse) -> None:
+    # 缓存命中没有消耗上游 token，不计入 token 直方图
+    if not (out.observability.get("cache") or {}).get("hit"):
+        tracker.usage(out.usage.model_dump())
+
+
+def _generate_sync(req: GenerateRequest, messages: List[dict], provider: str, real: str) -> UnifiedResponse:
+    with span("preflight"):
+        preflight = fit_context(messages, provider, real, MODEL_SPECS.get(real), _overflow_strategy(req))
+    messages = preflight.messages
+
+    req_id = "req_" + uuid.uuid4().hex[:16]
+    created = int(time.time())
+    t0 = time.perf_counter()
+
+    with span("cache"):
+        key = _request_key(req, provider, real, messages)
+        hit = response_cache.get_memory(key) if key and response_cache.cacheable(req) else None
+    if hit is not None:
+        out = _build_response(req, hit.result, req_id, created, int((time.perf_counter() - t0) * 1000), preflight)
+        out.observability.update(cost_usd=0.0, cache=hit.describe())
+        return out
+
+    runner = providers.get(provider).invoke
+    pool = balancer.pool(provider)
+
+    # 每次（重）试都重新选端点：被限流或熔断的 key 不会被反复命中
+    def call() -> Dict[str, Any]:
+        with pool.lease() as lease:
+            return runner(real, messages, req.temperature, req.include_raw, lease.endpoint)
+
+    result = Retrying(**retry_policy())(call)
+
+    latency = int((time.perf_counter() - t0) * 1000)
+    with span("build"):
+        out = _build_response(req, result, req_id, created, latency, preflight)
+    if key and response_cache.cacheable(req):
+        response_cache.put(key, result)
+        out.observability["cache"] = {"hit": False}
+    return out
+
+
+# —— 4.1) 对外：异步统一响应（路由使用）——
+# conversation 由路由按租户校验后传入；只带 session_id 时按无租户查找
+async def generate_async(req: GenerateRequest, conversation: ConversationState | None = None) -> UnifiedResponse:
+    with span("normalize"):
+        turn = normalize_messages(req)
+    conversation, messages, window = await _with_history(req, conversation, turn)
+    with span("resolve"):
+        backends = resolve_backends(req.model_name)
+    provider, real = backends[0]
+    with track_request(provider, real, "unary", _metric_labels(provider, real)) as tracker:
+        try:
+            out = await _generate_async(req, messages, backends)
+        except BaseException as e:
+            _log_request(req, messages, "unary", tracker, {}, e)
+            raise
+        _track_usage(tracker, out)
+        _log_request(req, messages, "unary", tracker, _outcome(out))
+        if conversation is not None:
+            conversations.append(conversation, turn + [{"role": "assistant", "content": out.choices[0].content}])
+            out.observability["session"] = window
+        _attach_timings(out.observability)
+        return out
+
+
+async def _generate_async(req: GenerateRequest, messages: List[dict], backends: List[Backend]) -> UnifiedResponse:
+    provider, real = backends[0]
+    # 发请求前先数 token：超出上下文窗口直接拒绝或截断，省掉一次注定失败的往返
+    with span("preflight"):
+        preflight = await afit_context(messages, provider, real, MODEL_SPECS.get(real), _overflow_strategy(req))
+    messages = preflight.messages
 
     req_id = "req_" + uuid.uuid4().hex[:16]
     created = int(time.time())
     t0 = time.perf_counter()
 
-    if provider == "openai":  # CHANGE
-        result = _run_openai_sync(real, messages, req.temperature, req.include_raw)
-    elif provider == "google":  # NEW
-        result = _run_gemini_sync(real, messages, req.temperature, req.include_raw)
+    with span("cache"):
+        key = _request_key(req, provider, real, messages)
+        cacheable = key is not None and response_cache.cacheable(req)
+        hit = await response_cache.get(key) if cacheable else None
+    if hit is not None:
+        out = _build_response(req, hit.result, req_id, created, int((time.perf_counter() - t0) * 1000), preflight)
+        out.observability.update(cost_usd=0.0, cache=hit.describe())
+        return out
+
+    # 派发前按 prompt + 预估输出排队取限流令牌，完成后按实际用量修正
+    estimate = preflight.prompt_tokens + settings.RATE_LIMIT_EST_OUTPUT_TOKENS
+
+    async def dispatch(backend: Backend, call: Callable[[Endpoint], Awaitable[Dict[str, Any]]],
+                       amount: int) -> Dict[str, Any]:
+        pool = balancer.pool(backend[0])
+        waited = 0.0
+        # 先选端点再按该端点（key）排队限流；排队时间也计入该端点的在途与延迟
+        # 每次（重）试都重新选端点：429 之后的重试可以换到另一个 key
+        async for retry in AsyncRetrying(**retry_policy()):
+            with retry:
+                with pool.lease() as lease:
+                    limit_key = _limit_key(pool, lease.endpoint)
+                    limiter = rate_limiter.limiter(backend[0], limit_key)
+                    waited += await limiter.acquire(amount)
+                    result = await limiter.observe(call(lease.endpoint))
+        record("queue", waited)
+        rate_limiter.settle(backend[0], amount, result["usage"].get("total_tokens") or amount, limit_key)
+        return {**result, "queue_ms": round(waited * 1000, 1)}
+
+    async def attempt(backend: Backend) -> Dict[str, Any]:
+        provider = providers.get(backend[0])
+
+        def single(endpoint: Endpoint) -> Awaitable[Dict[str, Any]]:
+            return provider.ainvoke(backend[1], messages, req.temperature, req.include_raw, endpoint)
+
+        if req.n == 1:
+            return await dispatch(backend, single, estimate)
+        if provider.native_n:
+            # 一次调用取回 n 个候选：prompt 只算一次，输出按 n 份预估
+            amount = preflight.prompt_tokens + req.n * settings.RATE_LIMIT_EST_OUTPUT_TOKENS
+            result = await dispatch(backend, lambda endpoint: provider.asample(
+                backend[1], messages, req.temperature, req.n, req.include_raw, endpoint), amount)
+            return {**result, "samples": {"n": req.n, "mode": "native"}}
+        # 并发扇出 n 次单候选调用，各自选端点、取令牌；任一失败则取消其余，整体按该后端失败处理
+        tasks = [asyncio.ensure_future(dispatch(backend, single, estimate)) for _ in range(req.n)]
+        try:
+            samples = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return {**_merge_samples(samples, req.include_raw), "samples": {"n": req.n, "mode": "fanout"}}
+
+    # 多后端别名：出错 / 超时按顺序回退，主后端过慢时对冲到下一个后端
+    async def call_upstream() -> Dict[str, Any]:
+        result, route = await route_call(backends, attempt, "unary")
+        queue_ms = result.pop("queue_ms")
+        if cacheable:
+            response_cache.put(key, result)
+        return {**result, "route": route.describe(), "queue_ms": queue_ms}
+
+    # 相同的在途请求只向上游发一次，其余请求等待领头者的结果
+    coalesce = key is not None and _coalescible(req)
+    if coalesce:
+        result, shared = await singleflight.do(key, call_upstream)
     else:
-        raise ValueError(f"暂不支持的 provider: {provider}")
+        result, shared = await call_upstream(), False
 
     latency = int((time.perf_counter() - t0) * 1000)
+    with span("build"):
+        out = _build_response(req, result, req_id, created, latency, preflight)
+    if cacheable:
+        out.observability["cache"] = {"hit": False}
+    if coalesce:
+        out.observability["coalesced"] = shared
+    return out
 
-    usage = Usage(**result["usage"])
-    return UnifiedResponse(
-        id=req_id,
-        created=created,
-        provider=result["provider"],
-        model=result["model"],
-        choices=[Choice(index=0, content=result["text"], finish_reason=result["finish_reason"])],
-        usage=usage,
-        observability={"latency_ms": latency, "cost_usd": 0.0, "estimated": True},
-        raw=(result["raw"] if req.include_raw else None),
-    )
+
+# 扇出的 n 个单候选结果合并为一个结果：usage 相加（每次调用都计一次 prompt），排队时间取最长
+def _merge_samples(samples: List[Dict[str, Any]], include_raw: bool) -> Dict[str, Any]:
+    usage: Dict[str, Any] = {k: sum(r["usage"].get(k) or 0 for r in samples)
+                             for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    if any(r["usage"].get("reasoning_tokens") for r in samples):
+        usage["reasoning_tokens"] = sum(r["usage"].get("reasoning_tokens") or 0 for r in samples)
+    return {
+        **samples[0],
+        "usage": usage,
+        "choices": [{"text": r["text"], "finish_reason": r["finish_reason"]} for r in samples],
+        "queue_ms": max(r["queue_ms"] for r in samples),
+        "raw": {"choices": [r.get("raw") for r in samples]} if include_raw else None,
+    }
 
 
 # —— 5) 流式（SSE）：产出统一事件 —— 
 def sse_event(event: str, data: dict) -> str:
     return f"event: {event}\n" + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
 
+def _chunk_text(chunk) -> str:
+    part = getattr(chunk, "content", None)
+    return "".join(str(p) for p in part) if isinstance(part, list) else (part if isinstance(part, str) else "")
+
 def generate_stream(req: GenerateRequest) -> Iterable[str]:
+    _reject_async_only(req)
     messages = normalize_messages(req)
     provider, real = resolve_model(req.model_name)
 
-    if provider == "openai":
-        llm = ChatOpenAI(model=real, temperature=req.temperature)
-        meta = {"id":"req_"+uuid.uuid4().hex[:16], "created":int(time.time()), "provider":"openai", "model":real}
+    if providers.supports(provider):
+        messages = fit_context(messages, provider, real, MODEL_SPECS.get(real), _overflow_strategy(req)).messages
+        meta = {"id":"req_"+uuid.uuid4().hex[:16], "created":int(time.time()), "provider":provider, "model":real}
+        meter = StreamMeter()
         yield sse_event("meta", meta)
-        for chunk in llm.stream(to_lc_messages(messages)):
-            part = getattr(chunk, "content", None)
-            text = "".join(str(p) for p in part) if isinstance(part, list) else (part if isinstance(part, str) else "")
-            if text:
-                yield sse_event("delta", {"index": 0, "delta": text})
-        yield sse_event("done", {"usage":{"prompt_tokens":0,"completion_tokens":0,"total_tokens":0}, "latency_ms":0})
-        return
-
-    if provider == "google":  # NEW
-        llm = ChatGoogleGenerativeAI(model=real, temperature=req.temperature)
-        meta = {"id":"req_"+uuid.uuid4().hex[:16], "created":int(time.time()), "provider":"google", "model":real}
-        yield sse_event("meta", meta)
-        for chunk in llm.stream(to_lc_messages(messages)):
-            part = getattr(chunk, "content", None)
-            text = "".join(str(p) for p in part) if isinstance(part, list) else (part if isinstance(part, str) else "")
-            if text:
-                yield sse_event("delta", {"index": 0, "delta": text})
-        yield sse_event("done", {"usage":{"prompt_tokens":0,"completion_tokens":0,"total_tokens":0}, "latency_ms":0})
+        with balancer.pool(provider).lease() as lease:
+            for chunk in providers.get(provider).stream(real, messages, req.temperature, lease.endpoint):
+                text = _chunk_text(chunk)
+                meter.observe(chunk, bool(text))
+                if text:
+                    yield sse_event("delta", {"index": 0, "delta": text})
+        done = meter.done_event()
+        done["observability"].update(_cost_fields(real, done["usage"]))
+        yield sse_event("done", done)
         return
 
     # 其他 provider（暂不支持）
     yield sse_event("meta", {"id":"req_stub","created":int(time.time()),"provider":provider,"model":real})
     yield sse_event("delta", {"index":0, "delta":"该 provider 的流式将在后续接入"})
     yield sse_event("done", {"usage":{"prompt_tokens":0,"completion_tokens":0,"total_tokens":0}, "latency_ms":0})
+
+
+# —— 5.1) 异步流式：astream 驱动，单个事件循环承载所有打开的 SSE 连接 ——
+# 帧以 bytes 产出（见 app/core/sse.py）；delta 按请求的 stream_options 合并
+_REPLAY_CHUNK_CHARS = 64
+
+def _stream_flush_policy(req: GenerateRequest) -> Tuple[int, int]:
+    opts = req.stream_options
+    flush_ms = opts.flush_ms if opts and opts.flush_ms is not None else settings.STREAM_FLUSH_MS
+    flush_bytes = opts.flush_bytes if opts and opts.flush_bytes is not None else settings.STREAM_FLUSH_BYTES
+    return flush_ms, flush_bytes
+
+async def generate_stream_async(req: GenerateRequest,
+                                conversation: ConversationState | None = None) -> AsyncIterator[bytes]:
+    with span("normalize"):
+        turn = normalize_messages(req)
+    conversation, messages, window = await _with_history(req, conversation, turn)
+    with span("resolve"):
+        backends = resolve_backends(req.model_name)
+    provider, real = backends[0]
+    # outcome 由 _stream_frames 填写（id、实际后端、usage、完整回复），流结束后写请求日志
+    outcome: Dict[str, Any] = {}
+    with track_request(provider, real, "stream", _metric_labels(provider, real)) as tracker:
+        try:
+            async with aclosing(_stream_frames(req, messages, backends, tracker, outcome, window)) as frames:
+                async for frame in frames:
+                    yield frame
+        except BaseException as e:
+            _log_request(req, messages, "stream", tracker, outcome, e)
+            raise
+        _log_request(req, messages, "stream", tracker, outcome)
+        # 只有完整结束的流才写入会话；中途断开或出错的这一轮不计入历史
+        if conversation is not None and "text" in outcome:
+            conversations.append(conversation, turn + [{"role": "assistant", "content": outcome["text"]}])
+
+
+async def _stream_frames(req: GenerateRequest, messages: List[dict], backends: List[Backend],
+                         tracker: RequestTracker, outcome: Dict[str, Any],
+                         session: Dict[str, Any] | None = None) -> AsyncIterator[bytes]:
+    provider, real = backends[0]
+    if not providers.supports(provider):
+        # 其他 provider（暂不支持）
+        yield sse_frame("meta", {"id":"req_stub","created":int(time.time()),"provider":provider,"model":real})
+        yield delta_frame("该 provider 的流式将在后续接入")
+        yield sse_frame("done", {"usage":{"prompt_tokens":0,"completion_tokens":0,"total_tokens":0}, "latency_ms":0})
+        return
+
+    meta = {"id":"req_"+uuid.uuid4().hex[:16], "created":int(time.time()), "provider":provider, "model":real}
+    if session is not None:
+        meta["session"] = session
+    outcome["id"] = meta["id"]
+    t0 = time.perf_counter()
+    try:
+        with span("preflight"):
+            preflight = await afit_context(messages, provider, real, MODEL_SPECS.get(real), _overflow_strategy(req))
+    except ContextWindowExceeded as e:
+        # 响应头已发出，无法再改状态码：以 error 事件告知客户端
+        tracker.fail(type(e).__name__)
+        yield sse_frame("meta", meta)
+        yield sse_frame("error", {"type": "context_window_exceeded", "message": str(e),
+                                  "prompt_tokens": e.prompt_tokens, "limit": e.limit})
+        return
+    messages = preflight.messages
+    with span("cache"):
+        key = _request_key(req, provider, real, messages)
+        cacheable = key is not None and response_cache.cacheable(req)
+        hit = await response_cache.get(key) if cacheable else None
+    if hit is not None:
+        # 缓存命中：把缓存的完整回答切片回放为 delta 事件
+        yield sse_frame("meta", meta)
+        text = hit.result["text"]
+        for i in range(0, len(text), _REPLAY_CHUNK_CHARS):
+            yield delta_frame(text[i:i + _REPLAY_CHUNK_CHARS])
+        outcome.update(usage=hit.result["usage"], text=text)
+        yield sse_frame("done", {"usage": hit.result["usage"], "latency_ms": int((time.perf_counter() - t0) * 1000),
+                                 "cache": hit.describe()})
+        return
+
+    # 相同的在途流共享一个上游：晚到者先回放已产出的 delta，再跟随实时输出
+    coalesce = key is not None and _coalescible(req)
+    estimate = preflight.prompt_tokens + settings.RATE_LIMIT_EST_OUTPUT_TOKENS
+    if coalesce:
+        flight, shared = stream_flights.join(key, lambda: _routed_chunks(backends, messages, req.temperature, estimate))
+        sources = [flight.subscribe()]
+    else:
+        # n>1：每个候选一路独立的上游流（流式没有原生 n，各路分别路由、限流）
+        sources = [_routed_chunks(backends, messages, req.temperature, estimate) for _ in range(req.n)]
+        shared = False
+    # 首项是选中的后端；meta 报告（首个候选）实际服务的 provider / model
+    routes: List[Route] = [await sources[0].__anext__()] if len(sources) == 1 else await _open_all(sources)
+    route = routes[0]
+    outcome.update(provider=route.backend[0], model=route.backend[1])
+    meta.update(provider=route.backend[0], model=route.backend[1])
+    if req.n > 1:
+        meta["n"] = req.n
+
+    meters = [StreamMeter(t0) for _ in sources]
+    parts: List[List[str]] = [[] for _ in sources]
+
+    async def texts(index: int) -> AsyncIterator[str]:
+        meter, out = meters[index], parts[index]
+        async for chunk in sources[index]:
+            text = _chunk_text(chunk)
+            meter.observe(chunk, bool(text))
+            if text:
+                tracker.chunks += 1
+                out.append(text)
+                yield text
+
+    yield sse_frame("meta", meta)
+    flush_ms, flush_bytes = _stream_flush_policy(req)
+    if len(sources) == 1:
+        async for text in coalesce_deltas(texts(0), flush_ms, flush_bytes, settings.STREAM_QUEUE_MAX_CHUNKS):
+            yield delta_frame(text)
+    else:
+        # 各候选分别合并 delta，再按到达顺序复用到同一条流上，以 index 区分
+        streams = [coalesce_deltas(texts(i), flush_ms, flush_bytes, settings.STREAM_QUEUE_MAX_CHUNKS)
+                   for i in range(len(sources))]
+        async for index, text in merge_deltas(streams, settings.STREAM_QUEUE_MAX_CHUNKS):
+            yield delta_frame(text, index)
+    meter = meters[0] if len(meters) == 1 else StreamMeter.combine(meters)
+    done = meter.done_event()
+    done["observability"].update(_cost_fields(route.backend[1], done["usage"]), preflight=preflight.describe(),
+                                 route=route.describe(), queue_ms=max(r.queue_ms for r in routes))
+    if req.n > 1:
+        done["choices"] = [{"index": i, "finish_reason": m.finish_reason} for i, m in enumerate(meters)]
+    if not shared:
+        for r, m in zip(routes, meters):
+            rate_limiter.settle(r.backend[0], estimate, m.usage()["total_tokens"] or estimate, r.limit_key)
+    tracker.ttft(meter.first_at - t0 if meter.chunks else None)
+    tracker.usage(done["usage"])
+    outcome.update(usage=done["usage"], text="".join(parts[0]))
+    if cacheable:
+        if not shared:
+            response_cache.put(key, {"provider": route.backend[0], "model": route.backend[1], "text": outcome["text"],
+                                     "finish_reason": meter.finish_reason, "usage": done["usage"]})
+        done["cache"] = {"hit": False}
+    if coalesce:
+        done["coalesced"] = shared
+    _attach_timings(done["observability"])
+    yield sse_frame("done", done)
+
+
+# n 路流同时打开（各自路由、排队）；任一路打开失败则关闭全部
+async def _open_all(sources: List[AsyncIterator[Any]]) -> List[Route]:
+    tasks = [asyncio.ensure_future(source.__anext__()) for source in sources]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for source in sources:
+            await source.aclose()
+        raise
+
+
+async def _upstream_chunks(chunks: AsyncIterator[Any], lease: Lease | None = None) -> AsyncIterator[Any]:
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # 流结束（或被关闭）才归还端点的在途计数
+        if lease is not None:
+            lease.release()
+
+
+# 先产出选中的 Route，再产出该后端的 chunk；多后端时以首 token 为准回退 / 对冲
+async def _routed_chunks(backends: List[Backend], messages: List[dict], temperature: float,
+                         estimate: int) -> AsyncIterator[Any]:
+    # 打开流并取到首个 chunk 才算派发成功：429 在这一步抛出，由限流器退避重试
+    async def open_stream(backend: Backend, lease: Lease):
+        chunks = providers.get(backend[0]).astream(backend[1], messages, temperature, lease.endpoint)
+        stream = _upstream_chunks(chunks, lease)
+        try:
+            with span("first_token"):
+                first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.aclose()
+            raise
+        return first, stream
+
+    # 端点延迟按首 token 计；流式期间端点一直计为在途；每次（重）试都重新选端点
+    async def attempt(backend: Backend):
+        pool = balancer.pool(backend[0])
+        waited = 0.0
+        async for retry in AsyncRetrying(**retry_policy()):
+            with retry:
+                lease = pool.checkout()
+                try:
+                    limit_key = _limit_key(pool, lease.endpoint)
+                    limiter = rate_limiter.limiter(backend[0], limit_key)
+                    waited += await limiter.acquire(estimate)
+                    opened = await limiter.observe(open_stream(backend, lease))
+                except Exception as e:
+                    lease.fail(e)
+                    lease.release()
+                    raise
+                except BaseException:
+                    lease.release()
+                    raise
+        record("queue", waited)
+        lease.ok()
+        return opened, waited, limit_key
+
+    async def discard(opened) -> None:
+        await opened[0][1].aclose()
+
+    if len(backends) == 1:
+        # 单后端：先报告后端让 meta 立即发出，排队等待记到同一个 Route 上
+        route = Route(backends[0])
+        yield route
+        (first, stream), waited, route.limit_key = await attempt(backends[0])
+    else:
+        ((first, stream), waited, limit_key), route = await route_call(backends, attempt, "ttft", discard)
+        route.limit_key = limit_key
+        yield route
+    route.queue_ms = round(waited * 1000, 1)
+    async with aclosing(stream):
+        if first is not None:
+            yield first
+        async for chunk in stream:
+            yield chunk
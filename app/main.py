@@ -2,25 +2,158 @@ import json
 import time
 from typing import List
 import uuid
+import asyncio
+from contextlib import asynccontextmanager
 from app.api.v1.api import  model_router
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from app.core.accounting import ContextWindowExceeded, warm_encodings
+from app.core.admission import QUEUE_FULL, OVERLOADED, QUEUE_TIMEOUT, Overloaded, admission
+from app.core.cache import response_cache
+from app.core.clients import registry
+from app.core.coalesce import singleflight, stream_flights
+from app.core.lifecycle import RequestTerminated, drain
+from app.core.conversations import SessionNotFound, conversations
 from app.core.config import settings
+from app.core.metrics import (ADMISSION_IN_FLIGHT, ADMISSION_QUEUE, ADMISSION_SHED, CACHE_LOOKUPS, COALESCED,
+                              REQUEST_LOG_ROWS, flush_forever, metrics, readiness)
+from app.core.quota import QuotaExceeded, quota_ledger
+from app.core.request_log import request_log
+from app.core.resume import StreamNotFound, resumable_streams
+from app.core.shared import shared_state
+from app.core.timing import ArrivalStamp
+from app.db.base import Base
+from app.db.session import AsyncSessionLocal, engine
+from app.llm import warm_clients
 from app.schemas.llm import GenerateRequest
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动：预热供应商客户端、挂载缓存与会话持久层、请求日志与租户配额；关闭：结束仍在生成的可续传流、归还配额、写完请求日志、缓存与会话、释放连接池
+    if settings.LLM_WARM_CLIENTS:
+        warm_clients()
+    # 多 worker：缓存共享层与限流令牌桶放在启动器创建的 SQLite 文件里（fork 之后各 worker 自己连接）
+    if settings.SHARED_STATE_PATH:
+        shared_state.configure(settings.SHARED_STATE_PATH)
+    # tiktoken 编码表首次加载可能要下载，放到后台线程，不阻塞启动
+    asyncio.get_running_loop().run_in_executor(None, warm_encodings)
+    if (settings.RESPONSE_CACHE_PERSIST or settings.REQUEST_LOG_ENABLED or settings.TENANT_AUTH_ENABLED
+            or settings.SESSION_PERSIST):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    if settings.RESPONSE_CACHE_PERSIST:
+        response_cache.configure(AsyncSessionLocal)
+    if settings.REQUEST_LOG_ENABLED:
+        request_log.start(AsyncSessionLocal)
+    if settings.SESSION_PERSIST:
+        conversations.configure(AsyncSessionLocal)
+    # 租户配额：各 worker 通过数据库领取额度、定期写回用量
+    quota_sync = None
+    if settings.TENANT_AUTH_ENABLED:
+        quota_ledger.configure(AsyncSessionLocal)
+        await quota_ledger.load_tenants(settings.TENANTS)
+        quota_sync = asyncio.create_task(quota_ledger.sync_forever(settings.QUOTA_SYNC_S))
+    # 多 worker：定期把本进程指标快照写到共享目录，任一 worker 的 /metrics 都能汇总全部进程
+    flusher = None
+    if settings.METRICS_MULTIPROC_DIR:
+        flusher = asyncio.create_task(flush_forever(settings.METRICS_MULTIPROC_DIR, settings.METRICS_FLUSH_S))
+    yield
+    if flusher is not None:
+        flusher.cancel()
+        metrics.write_snapshot(settings.METRICS_MULTIPROC_DIR)
+    if quota_sync is not None:
+        quota_sync.cancel()
+        await quota_ledger.aclose()
+    await resumable_streams.aclose()
+    await request_log.aclose()
+    await response_cache.drain()
+    await conversations.drain()
+    await registry.aclose()
+
+
 app = FastAPI(
     title = settings.PROJECT_NAME,
-    version= settings.VERSION
+    version= settings.VERSION,
+    lifespan=lifespan,
 )
 
 app.include_router(model_router)
+# 记下请求到达时刻，分阶段计时据此算出请求解析耗时（见 app/core/timing.py）
+app.add_middleware(ArrivalStamp)
+
+@app.exception_handler(ContextWindowExceeded)
+async def context_window_exceeded_handler(request: Request, exc: ContextWindowExceeded):
+    return JSONResponse(
+        status_code=400,
+        content={"detail": str(exc), "type": "context_window_exceeded",
+                 "prompt_tokens": exc.prompt_tokens, "limit": exc.limit},
+    )
+
+# 请求本身不合法（未知模型 / 别名 / provider、没有输入等）：按 400 返回，而不是 500
+@app.exception_handler(ValueError)
+async def invalid_request_handler(request: Request, exc: ValueError):
+    return JSONResponse(status_code=400, content={"detail": str(exc), "type": "invalid_request"})
+
+@app.exception_handler(SessionNotFound)
+async def session_not_found_handler(request: Request, exc: SessionNotFound):
+    return JSONResponse(status_code=404, content={"detail": str(exc), "type": "session_not_found"})
+
+@app.exception_handler(StreamNotFound)
+async def stream_not_found_handler(request: Request, exc: StreamNotFound):
+    return JSONResponse(status_code=404, content={"detail": str(exc), "type": "stream_not_found"})
+
+@app.exception_handler(RequestTerminated)
+async def request_terminated_handler(request: Request, exc: RequestTerminated):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc), **exc.body})
+
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "type": "quota_exceeded", "tenant": exc.tenant.id, "quota": exc.kind},
+        headers={**exc.headers, "Retry-After": str(int(exc.retry_after_s) + 1)},
+    )
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc), **exc.body},
+                        headers={"Retry-After": str(exc.body["retry_after_s"])})
+
+def _component_counters() -> None:
+    for result, value in response_cache.stats.items():
+        CACHE_LOOKUPS.set((result,), value)
+    for mode, flights in (("unary", singleflight), ("stream", stream_flights)):
+        for role, value in flights.stats.items():
+            COALESCED.set((mode, role), value)
+    for result in ("written", "dropped", "spilled"):
+        REQUEST_LOG_ROWS.set((result,), request_log.stats[result])
+    for priority, state in admission.describe()["classes"].items():
+        ADMISSION_QUEUE.set((priority,), state["queue_depth"])
+        ADMISSION_IN_FLIGHT.set((priority,), state["in_flight"])
+        for reason in (QUEUE_FULL, OVERLOADED, QUEUE_TIMEOUT):
+            ADMISSION_SHED.set((priority, reason), state[reason])
+
+metrics.register_collector(_component_counters)
 
 @app.get("/")
 async def root():
     return {"name": settings.PROJECT_NAME, "version": settings.VERSION}
 
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy", "version": settings.VERSION}
+async def health_check(ready: bool = False):
+    # ?ready=true：就绪探针，按各 provider 最近错误率与连接池饱和度判定，未就绪返回 503；排空中的 worker 也返回 503
+    if not ready:
+        return {"status": "healthy", "version": settings.VERSION}
+    if drain.draining:
+        return JSONResponse(status_code=503, content={"status": "draining", "version": settings.VERSION})
+    report = readiness()
+    status = "ready" if report["ready"] else "degraded"
+    return JSONResponse(status_code=200 if report["ready"] else 503,
+                        content={"status": status, "version": settings.VERSION, **report})
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    text = metrics.render(metrics.collect(settings.METRICS_MULTIPROC_DIR))
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
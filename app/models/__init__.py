@@ -0,0 +1,6 @@
+from app.models.conversation import Conversation, ConversationTurn
+from app.models.request_log import RequestLog
+from app.models.response_cache import ResponseCacheEntry
+from app.models.tenant import Tenant, TenantUsage
+
+__all__ = ["Conversation", "ConversationTurn", "RequestLog", "ResponseCacheEntry", "Tenant", "TenantUsage"]
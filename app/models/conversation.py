@@ -0,0 +1,25 @@
+# app/models/conversation.py
+from sqlalchemy import Float, Integer, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)                      # sess_xxx
+    tenant_id: Mapped[str | None] = mapped_column(String(64), nullable=True, index=True)  # 未开启租户鉴权时为 NULL
+    created_at: Mapped[float] = mapped_column(Float)
+    updated_at: Mapped[float] = mapped_column(Float, index=True)
+
+
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+
+    # 只追加：每轮按 seq 插入新行，不改写历史
+    conversation_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+    role: Mapped[str] = mapped_column(String(16))
+    content: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[float] = mapped_column(Float)
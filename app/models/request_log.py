@@ -0,0 +1,23 @@
+# app/models/request_log.py
+from sqlalchemy import Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class RequestLog(Base):
+    __tablename__ = "request_log"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)         # 响应中的 req_xxx
+    created_at: Mapped[float] = mapped_column(Float, index=True)
+    alias: Mapped[str] = mapped_column(String(128))                       # 请求里的 model_name
+    provider: Mapped[str] = mapped_column(String(32))
+    model: Mapped[str] = mapped_column(String(128), index=True)           # 实际服务的模型
+    mode: Mapped[str] = mapped_column(String(16))                         # unary | stream
+    status: Mapped[str] = mapped_column(String(16))                       # ok | error | cancelled
+    error_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    total_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    latency_ms: Mapped[int] = mapped_column(Integer)
+    prompt_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
@@ -0,0 +1,13 @@
+# app/models/response_cache.py
+from sqlalchemy import Float, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)  # sha256 hex
+    payload: Mapped[str] = mapped_column(Text)                      # 统一字段的 JSON
+    created_at: Mapped[float] = mapped_column(Float, index=True)
@@ -0,0 +1,27 @@
+# app/models/tenant.py
+from sqlalchemy import Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class Tenant(Base):
+    __tablename__ = "tenants"
+
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    api_key_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True)  # sha256 hex，不存明文 key
+    token_quota: Mapped[int | None] = mapped_column(Integer, nullable=True)         # 每个配额窗口；NULL 为不限
+    request_quota: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+
+class TenantUsage(Base):
+    __tablename__ = "tenant_usage"
+
+    tenant_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    window_start: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # claimed：各 worker 已领取的额度（含未用完的部分）；used：已实际消耗
+    tokens_claimed: Mapped[int] = mapped_column(Integer, default=0)
+    requests_claimed: Mapped[int] = mapped_column(Integer, default=0)
+    tokens_used: Mapped[int] = mapped_column(Integer, default=0)
+    requests_used: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[float] = mapped_column(Float, default=0.0)
@@ -0,0 +1,71 @@
+# app/providers/__init__.py
+# 供应商注册表：每个供应商是一个插件模块，首次使用（或启动预热时已配置）才导入。
+# 只用 OpenAI 的部署不会加载 langchain_google_genai / gRPC，冷启动明显更快（见 benchmarks/bench_startup.py）。
+# 新增供应商无需改动派发代码：在 settings.LLM_PROVIDERS 中登记 {"name": "pkg.module"}（模块内提供
+# 名为 provider 的实例，或写成 "pkg.module:attr"），或在运行时调用 providers.register()。
+import importlib
+import threading
+from typing import Dict, List
+
+from app.core.balancer import balancer
+from app.core.config import settings
+from app.providers.base import Provider, to_lc_messages
+
+_BUILTIN: Dict[str, str] = {
+    "openai": "app.providers.openai",
+    "google": "app.providers.google",
+}
+
+
+def _load(path: str) -> Provider:
+    module, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module), attr or "provider")
+
+
+class ProviderRegistry:
+    def __init__(self) -> None:
+        self._providers: Dict[str, Provider] = {}
+        self._lock = threading.Lock()
+
+    def modules(self) -> Dict[str, str]:
+        return {**_BUILTIN, **settings.LLM_PROVIDERS}
+
+    def supports(self, name: str) -> bool:
+        # 只查登记表，不触发导入
+        return name in self._providers or name in self.modules()
+
+    def register(self, provider: Provider, name: str | None = None) -> None:
+        with self._lock:
+            self._providers[name or provider.name] = provider
+
+    def get(self, name: str) -> Provider:
+        provider = self._providers.get(name)
+        if provider is None:
+            with self._lock:
+                provider = self._providers.get(name)
+                if provider is None:
+                    path = self.modules().get(name)
+                    if path is None:
+                        raise ValueError(f"暂不支持的 provider: {name}")
+                    provider = self._providers[name] = _load(path)
+        return provider
+
+    # 已配置的供应商：内置供应商要求端点池里有 key 或 base_url；插件一经登记即视为已配置
+    def configured(self) -> List[str]:
+        names = []
+        for name in {**self.modules(), **self._providers}:
+            if name not in _BUILTIN or any(ep.api_key or ep.base_url for ep in balancer.pool(name).endpoints):
+                names.append(name)
+        return names
+
+    def loaded(self) -> List[str]:
+        return sorted(self._providers)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._providers.clear()
+
+
+providers = ProviderRegistry()
+
+__all__ = ["Provider", "ProviderRegistry", "providers", "to_lc_messages"]
@@ -0,0 +1,63 @@
+# app/providers/base.py
+# 供应商插件接口：client() 返回 langchain ChatModel（同一个实例也用于流式），map_result() 把响应映射为统一字段。
+# 同步 / 异步调用的默认实现建立在这两者之上，一般的供应商只需实现它们。
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from app.core.balancer import Endpoint
+from app.core.timing import span
+
+# assistant 轮次（会话里回放的模型回复）必须还原为 AIMessage，否则模型会把自己的回答当成用户发言
+_LC_MESSAGE = {"system": SystemMessage, "assistant": AIMessage, "user": HumanMessage}
+
+
+def to_lc_messages(messages: List[dict]):
+    return [_LC_MESSAGE.get(m["role"], HumanMessage)(content=m["content"]) for m in messages]
+
+
+class Provider:
+    name: str = ""
+    # 一次调用能否返回 n 个候选；不支持时由 app/llm.py 并发扇出 n 次单候选调用
+    native_n: bool = False
+
+    def client(self, real_model: str, temperature: float, endpoint: Endpoint | None = None) -> Any:
+        raise NotImplementedError
+
+    def map_result(self, resp: Any, real_model: str, include_raw: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def invoke(self, real_model: str, messages: List[dict], temperature: float, include_raw: bool,
+               endpoint: Endpoint | None = None) -> Dict[str, Any]:
+        with span("client"):
+            client, lc = self.client(real_model, temperature, endpoint), to_lc_messages(messages)
+        with span("upstream"):
+            resp = client.invoke(lc)
+        with span("map"):
+            return self.map_result(resp, real_model, include_raw)
+
+    # 异步调用（ainvoke）：不占用线程池，并发只受上游容量约束
+    async def ainvoke(self, real_model: str, messages: List[dict], temperature: float, include_raw: bool,
+                      endpoint: Endpoint | None = None) -> Dict[str, Any]:
+        with span("client"):
+            client, lc = self.client(real_model, temperature, endpoint), to_lc_messages(messages)
+        with span("upstream"):
+            resp = await client.ainvoke(lc)
+        with span("map"):
+            return self.map_result(resp, real_model, include_raw)
+
+    # 原生 n 个候选（native_n 为 True 的供应商实现）：返回 map_result 同形的结果，另带 choices 列表，
+    # usage 为整次调用的合计
+    async def asample(self, real_model: str, messages: List[dict], temperature: float, n: int, include_raw: bool,
+                      endpoint: Endpoint | None = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    # 流式默认基于同一客户端的 stream / astream；产出的 chunk 需带 content（及可选的 usage_metadata）
+    def stream(self, real_model: str, messages: List[dict], temperature: float,
+               endpoint: Endpoint | None = None) -> Iterator[Any]:
+        return self.client(real_model, temperature, endpoint).stream(to_lc_messages(messages))
+
+    def astream(self, real_model: str, messages: List[dict], temperature: float,
+                endpoint: Endpoint | None = None) -> AsyncIterator[Any]:
+        with span("client"):
+            return self.client(real_model, temperature, endpoint).astream(to_lc_messages(messages))
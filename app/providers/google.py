@@ -0,0 +1,66 @@
+# app/providers/google.py
+import asyncio
+from typing import Any, Dict
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from app.core.balancer import Endpoint, balancer
+from app.core.clients import gemini_endpoint, gemini_plaintext_client, registry
+from app.providers.base import Provider
+
+
+def _loop_running() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class GeminiProvider(Provider):
+    name = "google"
+
+    def client(self, real_model: str, temperature: float,
+               endpoint: Endpoint | None = None) -> ChatGoogleGenerativeAI:
+        endpoint = endpoint or balancer.pool(self.name).endpoints[0]
+        target, secure = gemini_endpoint(endpoint.base_url) if endpoint.base_url else (None, True)
+
+        def build():
+            kwargs: Dict[str, Any] = {}
+            if endpoint.api_key:
+                kwargs["google_api_key"] = endpoint.api_key
+            if target and secure:
+                kwargs["client_options"] = {"api_endpoint": target}
+            # 如需更严格安全：safety_settings={...}
+            llm = ChatGoogleGenerativeAI(model=real_model, temperature=temperature, max_retries=0, **kwargs)
+            if target and not secure:
+                llm.client = gemini_plaintext_client(target, asynchronous=False)
+            return llm
+        llm = registry.get((self.name, endpoint.id, real_model, temperature), build)
+        if target and not secure and llm.async_client_running is None and _loop_running():
+            llm.async_client_running = gemini_plaintext_client(target, asynchronous=True)
+        return llm
+
+    def map_result(self, resp: Any, real_model: str, include_raw: bool = False) -> Dict[str, Any]:
+        usage = getattr(resp, "usage_metadata", {}) or {}
+        # Gemini 的 usage 字段名与 OpenAI 略有不同，这里做兼容兜底：
+        pt = usage.get("prompt_token_count") or usage.get("input_tokens") or 0
+        ct = usage.get("candidates_token_count") or usage.get("output_tokens") or 0
+        tt = usage.get("total_token_count") or usage.get("total_tokens") or (pt + ct)
+        rt = usage.get("thoughts_token_count") or usage.get("reasoning_tokens")
+        return {
+            "provider": self.name,
+            "model": real_model,
+            "text": getattr(resp, "content", ""),
+            "finish_reason": getattr(resp, "finish_reason", "stop"),
+            "usage": {
+                "prompt_tokens": pt,
+                "completion_tokens": ct,
+                "total_tokens": tt,
+                "reasoning_tokens": rt,
+            },
+            "raw": dict(resp) if include_raw else None
+        }
+
+
+provider = GeminiProvider()
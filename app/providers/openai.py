@@ -0,0 +1,71 @@
+# app/providers/openai.py
+from typing import Any, Dict, List
+
+from langchain_openai import ChatOpenAI
+
+from app.core.balancer import Endpoint, balancer
+from app.core.clients import registry
+from app.core.timing import span
+from app.providers.base import Provider, to_lc_messages
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    native_n = True
+
+    # 从进程级注册表取，按 (端点, model, temperature) 复用；未指定端点时用池中第一个
+    def client(self, real_model: str, temperature: float, endpoint: Endpoint | None = None) -> ChatOpenAI:
+        endpoint = endpoint or balancer.pool(self.name).endpoints[0]
+
+        def build():
+            kwargs: Dict[str, Any] = {}
+            if endpoint.api_key:
+                kwargs["api_key"] = endpoint.api_key
+            if endpoint.base_url:
+                kwargs["base_url"] = endpoint.base_url
+            return ChatOpenAI(
+                model=real_model,
+                temperature=temperature,
+                http_client=registry.http_client(),
+                http_async_client=registry.async_http_client(),
+                stream_usage=True,  # 流式末尾 chunk 携带 usage
+                max_retries=0,      # 429 重试由 app/core/ratelimit.py 负责
+                **kwargs,
+            )
+        return registry.get((self.name, endpoint.id, real_model, temperature), build)
+
+    # 原始载荷只在 include_raw 时生成：dict(resp) 会复制整条消息，绝大多数请求用不到
+    def map_result(self, resp: Any, real_model: str, include_raw: bool = False) -> Dict[str, Any]:
+        usage = getattr(resp, "usage_metadata", {}) or {}
+        return {
+            "provider": self.name,
+            "model": real_model,
+            "text": getattr(resp, "content", ""),
+            "finish_reason": getattr(resp, "finish_reason", "stop"),
+            "usage": {
+                "prompt_tokens": usage.get("input_tokens", 0),
+                "completion_tokens": usage.get("output_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+            },
+            "raw": dict(resp) if include_raw else None
+        }
+
+    # chat-completions 原生支持 n：一次请求返回 n 个候选，prompt 只计费一次
+    async def asample(self, real_model: str, messages: List[dict], temperature: float, n: int, include_raw: bool,
+                      endpoint: Endpoint | None = None) -> Dict[str, Any]:
+        with span("client"):
+            client, lc = self.client(real_model, temperature, endpoint), to_lc_messages(messages)
+        with span("upstream"):
+            result = await client.agenerate([lc], n=n)
+        generations = result.generations[0]
+        out = self.map_result(generations[0].message, real_model)
+        out["choices"] = [{"text": g.message.content,
+                           "finish_reason": (g.generation_info or {}).get("finish_reason") or "stop"}
+                          for g in generations]
+        out["text"], out["finish_reason"] = out["choices"][0]["text"], out["choices"][0]["finish_reason"]
+        if include_raw:
+            out["raw"] = {"choices": [dict(g.message) for g in generations]}
+        return out
+
+
+provider = OpenAIProvider()
@@ -0,0 +1,40 @@
+# app/repositories/conversations.py
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.conversation import Conversation, ConversationTurn
+
+
+async def create(session: AsyncSession, conversation_id: str, tenant_id: Optional[str], created_at: float,
+                 turns: List[Dict[str, Any]]) -> None:
+    session.add(Conversation(id=conversation_id, tenant_id=tenant_id, created_at=created_at, updated_at=created_at))
+    if turns:
+        await session.flush()
+        await session.execute(insert(ConversationTurn), turns)
+    await session.commit()
+
+
+async def get(session: AsyncSession, conversation_id: str) -> Conversation | None:
+    return await session.get(Conversation, conversation_id)
+
+
+async def load_turns(session: AsyncSession, conversation_id: str) -> List[ConversationTurn]:
+    stmt = (select(ConversationTurn).where(ConversationTurn.conversation_id == conversation_id)
+            .order_by(ConversationTurn.seq))
+    return list((await session.execute(stmt)).scalars().all())
+
+
+async def append_turns(session: AsyncSession, conversation_id: str, turns: List[Dict[str, Any]],
+                       updated_at: float) -> None:
+    await session.execute(insert(ConversationTurn), turns)
+    await session.execute(update(Conversation).where(Conversation.id == conversation_id)
+                          .values(updated_at=updated_at))
+    await session.commit()
+
+
+async def remove(session: AsyncSession, conversation_id: str) -> None:
+    await session.execute(delete(ConversationTurn).where(ConversationTurn.conversation_id == conversation_id))
+    await session.execute(delete(Conversation).where(Conversation.id == conversation_id))
+    await session.commit()
@@ -0,0 +1,13 @@
+# app/repositories/request_log.py
+from typing import Any, Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.request_log import RequestLog
+
+
+async def insert_many(session: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+    # 一条 INSERT 配多组参数（executemany），一次提交
+    await session.execute(insert(RequestLog), rows)
+    await session.commit()
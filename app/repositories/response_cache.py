@@ -0,0 +1,29 @@
+# app/repositories/response_cache.py
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.response_cache import ResponseCacheEntry
+
+
+async def get_entry(session: AsyncSession, key: str) -> ResponseCacheEntry | None:
+    return await session.get(ResponseCacheEntry, key)
+
+
+async def upsert_entry(session: AsyncSession, key: str, payload: str, created_at: float) -> None:
+    await session.merge(ResponseCacheEntry(key=key, payload=payload, created_at=created_at))
+    await session.commit()
+
+
+async def prune(session: AsyncSession, expired_before: float | None, max_entries: int) -> int:
+    # 删掉过期行，再按 created_at 只保留最新的 max_entries 行；返回删除的行数
+    deleted = 0
+    if expired_before is not None:
+        result = await session.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at < expired_before))
+        deleted += result.rowcount or 0
+    cutoff = await session.scalar(select(ResponseCacheEntry.created_at)
+                                  .order_by(ResponseCacheEntry.created_at.desc()).offset(max_entries).limit(1))
+    if cutoff is not None:
+        result = await session.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at <= cutoff))
+        deleted += result.rowcount or 0
+    await session.commit()
+    return deleted
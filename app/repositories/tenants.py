@@ -0,0 +1,75 @@
+# app/repositories/tenants.py
+import time
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tenant import Tenant, TenantUsage
+
+_CAS_ATTEMPTS = 8
+
+
+async def list_tenants(session: AsyncSession) -> List[Tenant]:
+    return list((await session.execute(select(Tenant))).scalars().all())
+
+
+async def upsert_tenant(session: AsyncSession, tenant_id: str, api_key_hash: str,
+                        token_quota: Optional[int], request_quota: Optional[int]) -> None:
+    await session.merge(Tenant(id=tenant_id, api_key_hash=api_key_hash,
+                               token_quota=token_quota, request_quota=request_quota))
+    await session.commit()
+
+
+async def get_usage(session: AsyncSession, tenant_id: str, window_start: int) -> TenantUsage:
+    row = await session.get(TenantUsage, (tenant_id, window_start), populate_existing=True)
+    if row is not None:
+        return row
+    session.add(TenantUsage(tenant_id=tenant_id, window_start=window_start, tokens_claimed=0, requests_claimed=0,
+                            tokens_used=0, requests_used=0, updated_at=time.time()))
+    try:
+        await session.commit()
+    except IntegrityError:
+        # 另一个 worker 同时建了这一行
+        await session.rollback()
+    return await session.get(TenantUsage, (tenant_id, window_start), populate_existing=True)
+
+
+async def claim(session: AsyncSession, tenant_id: str, window_start: int, want_tokens: int, want_requests: int,
+                token_quota: Optional[int], request_quota: Optional[int]) -> Tuple[int, int, TenantUsage]:
+    # 从窗口剩余额度中领取（不超过配额）；用比较并交换（CAS）的条件 UPDATE 保证多 worker 并发领取不超发
+    for _ in range(_CAS_ATTEMPTS):
+        row = await get_usage(session, tenant_id, window_start)
+        seen_t, seen_r = row.tokens_claimed, row.requests_claimed
+        grant_t = want_tokens if token_quota is None else max(0, min(want_tokens, token_quota - seen_t))
+        grant_r = want_requests if request_quota is None else max(0, min(want_requests, request_quota - seen_r))
+        if grant_t == 0 and grant_r == 0:
+            return 0, 0, row
+        result = await session.execute(
+            update(TenantUsage)
+            .where(TenantUsage.tenant_id == tenant_id, TenantUsage.window_start == window_start,
+                   TenantUsage.tokens_claimed == seen_t, TenantUsage.requests_claimed == seen_r)
+            .values(tokens_claimed=seen_t + grant_t, requests_claimed=seen_r + grant_r, updated_at=time.time())
+        )
+        await session.commit()
+        if result.rowcount == 1:
+            return grant_t, grant_r, await get_usage(session, tenant_id, window_start)
+    return 0, 0, await get_usage(session, tenant_id, window_start)
+
+
+async def add_usage(session: AsyncSession, tenant_id: str, window_start: int, tokens: int, requests: int,
+                    release_tokens: int = 0, release_requests: int = 0) -> TenantUsage:
+    # 记入实际消耗；release_* 归还未用完的领取额度（worker 退出时）
+    await get_usage(session, tenant_id, window_start)
+    await session.execute(
+        update(TenantUsage)
+        .where(TenantUsage.tenant_id == tenant_id, TenantUsage.window_start == window_start)
+        .values(tokens_used=TenantUsage.tokens_used + tokens,
+                requests_used=TenantUsage.requests_used + requests,
+                tokens_claimed=TenantUsage.tokens_claimed - release_tokens,
+                requests_claimed=TenantUsage.requests_claimed - release_requests,
+                updated_at=time.time())
+    )
+    await session.commit()
+    return await get_usage(session, tenant_id, window_start)
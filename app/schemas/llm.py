@@ -1,6 +1,6 @@
 # app/schemas/llm.py
 from typing import Optional, List, Literal, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 Role = Literal["system", "user", "assistant"]
 
@@ -8,6 +8,15 @@ class Message(BaseModel):
     role: Role
     content: str
 
+class StreamOptions(BaseModel):
+    # delta 合并：首个 delta 总是立即下发；之后满 flush_ms 或累计 flush_bytes 即成帧。
+    # 两者都为 0 表示逐 delta 下发；不传则用服务端默认值
+    flush_ms: Optional[int] = Field(default=None, ge=0)
+    flush_bytes: Optional[int] = Field(default=None, ge=0)
+    # 可续传：事件带 id，断线后带 Last-Event-ID 重连可继续（断开后生成最多再继续 STREAM_RESUME_GRACE_S）；
+    # 不传则用 STREAM_RESUME_ENABLED（默认关闭）
+    resumable: Optional[bool] = None
+
 class GenerateRequest(BaseModel):
     model_name: str
     messages: Optional[List[Message]] = None
@@ -15,6 +24,17 @@ class GenerateRequest(BaseModel):
     temperature: float = 0.0
     stream: bool = False
     include_raw: bool = False          # 由你控制是否透传供应商原始响应
+    cache: bool = False                # temperature=0 时可选用响应缓存
+    # 候选数：n>1 时并发生成（供应商支持时用原生 n，否则并发扇出），流式按 index 复用同一条 SSE
+    n: int = Field(default=1, ge=1, le=16)
+    # 截止时间（毫秒，含限流排队）：到期即取消上游调用；不传用服务端默认
+    timeout_ms: Optional[int] = Field(default=None, ge=1)
+    stream_options: Optional[StreamOptions] = None
+    # 超出上下文窗口时：reject 直接拒绝，truncate 从最早的非 system 轮次开始丢弃；不传用服务端默认
+    context_overflow: Optional[Literal["reject", "truncate"]] = None
+    # 服务端会话：只发本轮新消息，历史由网关按 token 预算拼接，回复自动追加；history_tokens 不传用服务端默认
+    session_id: Optional[str] = None
+    history_tokens: Optional[int] = Field(default=None, ge=0)
 
 class Usage(BaseModel):
     prompt_tokens: int = 0
@@ -36,3 +56,11 @@ class UnifiedResponse(BaseModel):
     usage: Usage
     observability: Dict[str, Any] | None = None
     raw: Dict[str, Any] | None = None
+
+class CreateSessionRequest(BaseModel):
+    system: Optional[str] = None
+
+class BatchGenerateRequest(BaseModel):
+    items: List[GenerateRequest] = Field(min_length=1)
+    # 按 provider 调低并发上限，例如 {"openai": 4}；不能超过服务端配置（超出按服务端上限），未给出的沿用服务端默认
+    concurrency: Optional[Dict[str, int]] = None
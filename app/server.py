@@ -0,0 +1,227 @@
+# app/server.py
+# 生产启动器：master 预加载 app.main:app（只导入一次，fork 后各 worker 共享已导入模块的内存页），
+# 创建监听 socket 后 fork N 个 uvicorn worker（默认按 CPU 核数），各 worker 在同一个 socket 上 accept。
+# 跨 worker 的共享状态（缓存共享层、限流令牌桶）放在 master 创建的 SQLite WAL 文件里（见 app/core/shared.py），
+# 指标快照目录也由 master 准备（见 app/core/metrics.py）。
+# 信号：
+# - SIGTERM / SIGINT：各 worker 停止 accept 并排空在途流（最长 SHUTDOWN_DRAIN_S），然后 master 退出
+# - SIGHUP：滚动替换 worker——逐个先起新 worker、等它就绪，再让旧 worker 排空退出，期间不丢连接。
+#   新 worker 同样从 master fork，代码与配置沿用预加载的版本；发布新代码需起新的 master，旧 master 收到 SIGTERM 后同样排空
+# 意外退出的 worker 会被自动补齐；master 被直接杀掉（SIGKILL）时，worker 发现父进程换了就自行排空退出，不留孤儿进程占着端口。
+# 用法：python -m app.server --workers 4 --host 0.0.0.0 --port 8000
+import argparse
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from typing import Optional, Set
+
+_READY_TIMEOUT_S = 60.0
+
+
+def _log(message: str) -> None:
+    print(f"[server {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def _listen(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, ready_fd: int, args: argparse.Namespace, master_pid: int) -> None:
+    import uvicorn
+
+    from app.core.config import settings
+    from app.core.lifecycle import drain
+
+    class WorkerServer(uvicorn.Server):
+        async def startup(self, sockets=None) -> None:
+            await super().startup(sockets)
+            if self.started:
+                os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        # 每个 tick（0.1 秒）检查 master 是否还在：父进程变了说明 master 已死，按 SIGTERM 排空退出
+        async def on_tick(self, counter: int) -> bool:
+            if not self.should_exit and os.getppid() != master_pid:
+                _log(f"master {master_pid} is gone, shutting down")
+                self.handle_exit(signal.SIGTERM, None)
+            return await super().on_tick(counter)
+
+        # 第一次 SIGTERM：开始排空（流在 SHUTDOWN_DRAIN_S 内收尾），uvicorn 停止 accept 并等待连接结束
+        def handle_exit(self, sig, frame) -> None:
+            drain.begin(settings.SHUTDOWN_DRAIN_S)
+            super().handle_exit(sig, frame)
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        access_log=args.access_log,
+        # 比排空时长多留一点：到期的请求先由 Supervisor 终止（流补发收尾帧后正常结束），uvicorn 不必强行取消
+        timeout_graceful_shutdown=int(settings.SHUTDOWN_DRAIN_S) + 2,
+        timeout_keep_alive=args.keep_alive,
+    )
+    WorkerServer(config).run(sockets=[sock])
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int, args: argparse.Namespace) -> None:
+        self.app = app
+        self.sock = sock
+        self.size = workers
+        self.args = args
+        self.workers: Set[int] = set()
+        self.retiring: Set[int] = set()   # 已发 SIGTERM、正在排空的旧 worker
+        self.stopping = False
+        self.reload = False
+
+    def spawn(self) -> tuple[int, int]:
+        read_fd, write_fd = os.pipe()
+        master_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                _run_worker(self.app, self.sock, write_fd, self.args, master_pid)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.workers.add(pid)
+        return pid, read_fd
+
+    @staticmethod
+    def wait_ready(read_fd: int, timeout_s: float) -> bool:
+        try:
+            readable, _, _ = select.select([read_fd], [], [], timeout_s)
+            return bool(readable) and os.read(read_fd, 1) == b"1"
+        finally:
+            os.close(read_fd)
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif not self.stopping:
+                _log(f"worker {pid} exited unexpectedly (status {status}), respawning")
+                self.spawn_ready()
+
+    def spawn_ready(self) -> Optional[int]:
+        pid, read_fd = self.spawn()
+        if self.wait_ready(read_fd, _READY_TIMEOUT_S):
+            return pid
+        _log(f"worker {pid} did not become ready")
+        return None
+
+    def rolling_restart(self) -> None:
+        self.reload = False
+        for old in sorted(self.workers - self.retiring):
+            if self.stopping:
+                return
+            if self.spawn_ready() is None:
+                _log("rolling restart aborted: keeping the remaining old workers")
+                return
+            self.retiring.add(old)
+            os.kill(old, signal.SIGTERM)
+        _log("rolling restart complete")
+
+    def run(self) -> None:
+        def stop(sig, frame) -> None:
+            self.stopping = True
+
+        def hup(sig, frame) -> None:
+            self.reload = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, hup)
+        pending = [self.spawn() for _ in range(self.size)]
+        ready = sum(self.wait_ready(read_fd, _READY_TIMEOUT_S) for _, read_fd in pending)
+        host, port = self.sock.getsockname()[:2]
+        _log(f"{ready}/{self.size} workers serving on http://{host}:{port}")
+        while not self.stopping:
+            self.reap()
+            if self.reload:
+                self.rolling_restart()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        from app.core.config import settings
+
+        _log("draining workers")
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + settings.SHUTDOWN_DRAIN_S + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Multi-process production server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="default: SERVER_WORKERS, or the CPU count")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    # 共享状态文件与指标目录要在导入 app（读取 settings）之前放进环境变量；未指定时用本次运行的临时目录
+    run_dir = None
+    if not os.environ.get("SHARED_STATE_PATH") or not os.environ.get("METRICS_MULTIPROC_DIR"):
+        run_dir = tempfile.mkdtemp(prefix="llm-gateway-")
+        os.environ.setdefault("SHARED_STATE_PATH", os.path.join(run_dir, "shared.sqlite"))
+        os.environ.setdefault("METRICS_MULTIPROC_DIR", os.path.join(run_dir, "metrics"))
+    os.makedirs(os.environ["METRICS_MULTIPROC_DIR"], exist_ok=True)
+
+    from app.core.config import settings
+    from app.core.shared import shared_state
+    from app.main import app  # 预加载：各 worker fork 后不再重复导入
+    from app.providers import providers
+
+    # 已配置的供应商 SDK 也在 fork 前导入（只导入模块；客户端与连接池在各 worker 里创建）
+    for name in providers.configured():
+        providers.get(name)
+
+    # 建表后关闭 master 的连接：SQLite 连接不能带进 fork 出的子进程
+    shared_state.configure(settings.SHARED_STATE_PATH)
+    shared_state.close()
+    workers = args.workers or settings.SERVER_WORKERS or os.cpu_count() or 1
+    sock = _listen(args.host, args.port, args.backlog)
+    try:
+        Master(app, sock, workers, args).run()
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
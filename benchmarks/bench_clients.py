@@ -0,0 +1,72 @@
+# benchmarks/bench_clients.py
+# 对比每请求新建 ChatOpenAI（旧路径）与进程级客户端注册表（新路径）的单请求开销。
+# 用法：python -m benchmarks.bench_clients --requests 200
+import argparse
+import statistics
+import time
+
+from langchain_openai import ChatOpenAI
+
+from app.core.clients import registry
+from app.core.config import settings
+from app.providers import providers, to_lc_messages
+from benchmarks.stub_server import StubServer
+
+MODEL = "gpt-4o-mini"
+MESSAGES = to_lc_messages([{"role": "user", "content": "ping"}])
+
+
+def _summary(label: str, samples: list[float], connections: int) -> dict:
+    samples = sorted(samples)
+    return {
+        "mode": label,
+        "requests": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(samples[len(samples) // 2], 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "tcp_connections": connections,
+    }
+
+
+def bench_fresh(stub: StubServer, n: int) -> dict:
+    stub.reset_counters()
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        llm = ChatOpenAI(model=MODEL, temperature=0.0, base_url=stub.base_url + "/v1", api_key="sk-stub")
+        llm.invoke(MESSAGES)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return _summary("fresh-client", samples, stub.connections)
+
+
+def bench_registry(stub: StubServer, n: int) -> dict:
+    stub.reset_counters()
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        providers.get("openai").client(MODEL, 0.0).invoke(MESSAGES)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return _summary("registry", samples, stub.connections)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Provider client overhead benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with StubServer() as stub:
+        settings.OPENAI_BASE_URL = stub.base_url + "/v1"
+        settings.OPENAI_API_KEY = "sk-stub"
+        registry.clear()
+        results = [
+            bench_fresh(stub, args.requests),
+            bench_registry(stub, args.requests),
+        ]
+        registry.clear()
+    for row in results:
+        print("{mode:<24} n={requests:<5} mean={mean_ms:>8.3f}ms p50={p50_ms:>8.3f}ms "
+              "p95={p95_ms:>8.3f}ms conns={tcp_connections}".format(**row))
+
+
+if __name__ == "__main__":
+    main()
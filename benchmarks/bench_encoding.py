@@ -0,0 +1,80 @@
+# benchmarks/bench_encoding.py
+# 响应编码开销：不同响应大小下，JSONResponse 原来的 json.dumps(model_dump())、pydantic 的 model_dump_json
+# 与 app.core.encoding.dumps（orjson）的耗时，
+# 以及 gzip / zstd 压缩的耗时与压缩率；另测 include_raw 关闭时省掉的 dict(resp) 复制。
+# 用法：python -m benchmarks.bench_encoding --sizes 1000 10000 100000 1000000
+import argparse
+import json
+import statistics
+import time
+import zlib
+
+import zstandard
+from langchain_core.messages import AIMessage
+
+from app.core.config import settings
+from app.core.encoding import compress, dumps
+from app.providers import providers
+from app.schemas.llm import Choice, UnifiedResponse, Usage
+
+SAMPLE = "The quick brown fox jumps over the lazy dog. 敏捷的棕色狐狸跳过了懒狗。 "
+
+
+def _response(size: int, with_raw: bool) -> UnifiedResponse:
+    text = (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+    raw = {"content": text, "response_metadata": {"model_name": "gpt-4o-mini", "finish_reason": "stop",
+                                                  "logprobs": [{"token": w, "logprob": -0.1} for w in text.split()[:500]]}}
+    return UnifiedResponse(
+        id="req_0123456789abcdef", created=1700000000, provider="openai", model="gpt-4o-mini",
+        choices=[Choice(index=0, content=text)],
+        usage=Usage(prompt_tokens=12, completion_tokens=size // 4, total_tokens=12 + size // 4),
+        observability={"latency_ms": 812, "cost_usd": 0.0001, "estimated": False,
+                       "route": {"backend": "openai/gpt-4o-mini", "hedged": False, "attempts": 1}},
+        raw=raw if with_raw else None,
+    )
+
+
+def _time_us(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Response encoding and compression benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--raw", action="store_true", help="include a raw provider payload in each response")
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'body':>9} {'stdlib':>9} {'pydantic':>9} {'orjson':>9} "
+          f"{'gzip':>9} {'zstd':>9} {'gzip%':>6} {'zstd%':>6}  (median µs)")
+    for size in args.sizes:
+        out = _response(size, args.raw)
+        body = dumps(out)
+        stdlib = _time_us(lambda out=out: json.dumps(out.model_dump(), ensure_ascii=False).encode(), args.repeat)
+        pydantic = _time_us(lambda out=out: out.model_dump_json().encode(), args.repeat)
+        fast = _time_us(lambda out=out: dumps(out), args.repeat)
+        gz = _time_us(lambda body=body: compress(body, "gzip"), args.repeat)
+        zs = _time_us(lambda body=body: compress(body, "zstd"), args.repeat)
+        gz_ratio = len(zlib.compress(body, settings.COMPRESS_GZIP_LEVEL, wbits=31)) / len(body) * 100
+        zs_ratio = len(zstandard.ZstdCompressor(level=settings.COMPRESS_ZSTD_LEVEL).compress(body)) / len(body) * 100
+        print(f"{size:>8} {len(body):>9} {stdlib:>9.1f} {pydantic:>9.1f} {fast:>9.1f} "
+              f"{gz:>9.1f} {zs:>9.1f} {gz_ratio:>5.1f}% {zs_ratio:>5.1f}%")
+
+    # 供应商结果映射：include_raw 关闭时不再复制整条消息
+    msg = AIMessage(content=SAMPLE * 200, usage_metadata={"input_tokens": 1, "output_tokens": 2, "total_tokens": 3},
+                    response_metadata={"logprobs": [{"token": str(i), "logprob": -0.1} for i in range(2000)]})
+    map_result = providers.get("openai").map_result
+    lazy = _time_us(lambda: map_result(msg, "gpt-4o-mini"), args.repeat * 10)
+    eager = _time_us(lambda: map_result(msg, "gpt-4o-mini", include_raw=True), args.repeat * 10)
+    eager_encoded = _time_us(lambda: dumps(map_result(msg, "gpt-4o-mini", include_raw=True)), args.repeat)
+    print(f"map result: raw skipped={lazy:.1f}µs raw materialized={eager:.1f}µs "
+          f"raw materialized+encoded={eager_encoded:.1f}µs")
+
+
+if __name__ == "__main__":
+    main()
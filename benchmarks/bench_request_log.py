@@ -0,0 +1,86 @@
+# benchmarks/bench_request_log.py
+# 请求日志写入吞吐（SQLite 文件库）：逐行 INSERT + 提交（朴素做法） vs write-behind 队列的批量写入。
+# 同时给出响应路径上 record() 的单次开销——这是请求真正要付出的代价。
+# 用法：python -m benchmarks.bench_request_log --rows 20000 --batch-sizes 50 500 2000
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.core.request_log import RequestLogWriter, log_row
+from app.db.base import Base
+from app.models import RequestLog  # noqa: F401  注册表结构
+from app.repositories import request_log as repo
+
+MESSAGES = [{"role": "user", "content": "benchmark prompt " * 20}]
+
+
+def _rows(n: int, prefix: str) -> list[dict]:
+    usage = {"prompt_tokens": 40, "completion_tokens": 80, "total_tokens": 120}
+    return [log_row(f"{prefix}_{i}", "gpt-4o-mini", "openai", "gpt-4o-mini", "unary", "ok", None, usage, 250, MESSAGES)
+            for i in range(n)]
+
+
+async def _factory(path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+async def _naive(path: str, rows: list[dict]) -> float:
+    engine, factory = await _factory(path)
+    t0 = time.perf_counter()
+    for row in rows:
+        async with factory() as session:
+            await repo.insert_many(session, [row])
+    elapsed = time.perf_counter() - t0
+    await engine.dispose()
+    return elapsed
+
+
+async def _write_behind(path: str, rows: list[dict], batch_size: int) -> tuple[float, float]:
+    engine, factory = await _factory(path)
+    writer = RequestLogWriter(max_queue=len(rows), batch_size=batch_size, flush_s=0.05)
+    writer.start(factory)
+    t0 = time.perf_counter()
+    for i, row in enumerate(rows):
+        writer.record(row)
+        if i % batch_size == 0:
+            await asyncio.sleep(0)  # 模拟请求之间让出事件循环
+    enqueue = time.perf_counter() - t0
+    await writer.aclose()
+    elapsed = time.perf_counter() - t0
+    assert writer.stats["written"] == len(rows), writer.stats
+    await engine.dispose()
+    return enqueue, elapsed
+
+
+async def main_async(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        naive_rows = min(args.rows, args.naive_rows)
+        naive = await _naive(path, _rows(naive_rows, "naive"))
+        print(f"{'per-row commit':<22} rows={naive_rows:>7} {naive_rows / naive:>10.0f} rows/s "
+              f"{naive / naive_rows * 1e6:>8.1f}us/row on the request path")
+        for batch_size in args.batch_sizes:
+            rows = _rows(args.rows, f"b{batch_size}")
+            enqueue, elapsed = await _write_behind(path, rows, batch_size)
+            print(f"{'write-behind b=' + str(batch_size):<22} rows={args.rows:>7} {args.rows / elapsed:>10.0f} rows/s "
+                  f"{enqueue / args.rows * 1e6:>8.2f}us/row on the request path")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Request log write throughput against SQLite")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--naive-rows", type=int, default=2_000, help="per-row commits are slow; cap their count")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 500, 2000])
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_scaling.py
+# 多进程扩展性：对同一个本地桩上游，分别以 1 / 2 / 4 … 个 worker 启动 python -m app.server，
+# 在固定并发下驱动 /v1/generate，报告吞吐、p50/p99 延迟与全部 worker 合计的 CPU 时间。
+# 单个 worker 受 GIL 限制只能用满一个核，吞吐应随 worker 数近似线性增长，直到用满机器的核数；
+# 核数少于 worker 数时（例如单核机器）多出来的 worker 只增加调度与共享状态开销，吞吐不会再涨。
+# 用法：python -m benchmarks.bench_scaling --workers 1 2 4 --concurrency 64 --requests 1000 --reply-words 50
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.load_test import ProcessProbe, _free_port, run_scenario, wait_ready
+from benchmarks.stub_server import StubServer, add_config_args, config_from_args
+
+
+# master 与全部 worker 的 CPU / 内存合计（worker 会被补齐或替换，每次读取时重新列出子进程）
+class TreeProbe:
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+
+    def _pids(self) -> List[int]:
+        children: List[int] = []
+        try:
+            for task in Path(f"/proc/{self.pid}/task").iterdir():
+                children += [int(p) for p in (task / "children").read_text().split()]
+        except OSError:
+            pass
+        return [self.pid] + children
+
+    def cpu_s(self) -> Optional[float]:
+        values = [ProcessProbe(pid).cpu_s() for pid in self._pids()]
+        return sum(v for v in values if v is not None) if values[0] is not None else None
+
+    def memory_kb(self) -> Dict[str, Optional[int]]:
+        rows = [ProcessProbe(pid).memory_kb() for pid in self._pids()]
+        return {key: sum(r[key] for r in rows if r[key]) or None for key in ("rss", "peak")}
+
+
+def start_server(stub: StubServer, port: int, workers: int) -> subprocess.Popen:
+    env = {**os.environ, "OPENAI_BASE_URL": stub.base_url + "/v1", "OPENAI_API_KEY": "sk-stub",
+           "GOOGLE_BASE_URL": stub.gemini_url, "GOOGLE_API_KEY": "stub-key"}
+    env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    cmd = [sys.executable, "-m", "app.server", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def _run(args: argparse.Namespace) -> None:
+    stub = StubServer(config_from_args(args)).start()
+    print(f"host CPUs: {os.cpu_count()}; model {args.model}, mode {args.mode}, concurrency {args.concurrency}")
+    print(f"{'workers':>7} {'rps':>9} {'p50 ms':>8} {'p99 ms':>8} {'cpu ms/req':>11} {'rss MB':>8}  statuses")
+    try:
+        for workers in args.workers:
+            port = _free_port()
+            proc = start_server(stub, port, workers)
+            base = f"http://127.0.0.1:{port}"
+            try:
+                await wait_ready(base, proc, timeout_s=60.0 + 10 * workers)
+                row = await run_scenario(base, args.model, args.mode, args.concurrency, args.requests,
+                                         args.warmup, TreeProbe(proc.pid), stub)
+            finally:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+            gateway = row["gateway"]
+            print(f"{workers:>7} {row['throughput_rps']:>9.1f} {row['latency_ms']['p50']:>8.1f} "
+                  f"{row['latency_ms']['p99']:>8.1f} {gateway['cpu_ms_per_request'] or 0:>11.2f} "
+                  f"{gateway['rss_mb'] or 0:>8.1f}  {row['statuses']}")
+    finally:
+        stub.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput vs. worker count for the multi-process server")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--mode", choices=["unary", "stream"], default="unary")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per worker count")
+    parser.add_argument("--warmup", type=int, default=20)
+    add_config_args(parser)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/bench_startup.py
+# 冷启动开销：每个场景在全新子进程里执行，记录导入 / 预热耗时（中位数）与进程总耗时，并列出加载了哪些重型模块。
+# eager 场景模拟改为插件前 app.llm 在导入时就加载两个供应商 SDK 的行为，作为对照。
+# 用法：python -m benchmarks.bench_startup --runs 7
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ("langchain_openai", "langchain_google_genai", "grpc")
+
+SCENARIOS = {
+    "import app.main (lazy)": ("import app.main", {}),
+    "warm openai only": ("import app.main\nfrom app.llm import warm_clients\nwarm_clients()",
+                         {"OPENAI_API_KEY": "sk-bench", "GOOGLE_API_KEY": ""}),
+    "warm openai + google": ("import app.main\nfrom app.llm import warm_clients\nwarm_clients()",
+                             {"OPENAI_API_KEY": "sk-bench", "GOOGLE_API_KEY": "g-bench"}),
+    "import app.main (eager)": ("import app.main\nimport langchain_openai, langchain_google_genai", {}),
+}
+
+_PROBE = """
+import time
+t0 = time.perf_counter()
+{code}
+elapsed = (time.perf_counter() - t0) * 1000
+import json, sys
+print(json.dumps({{"ms": elapsed, "modules": len(sys.modules), "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _run(code: str, env: dict) -> dict:
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(code=code, heavy=HEAVY)], capture_output=True,
+                         text=True, check=True, env={**os.environ, **env})
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - t0) * 1000
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold start / import time benchmark")
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    base_env = {"OPENAI_API_KEY": "sk-bench", "GOOGLE_API_KEY": "g-bench"}
+    print(f"{'scenario':<26} {'import ms':>10} {'process ms':>11} {'modules':>8}  heavy modules loaded")
+    for label, (code, env) in SCENARIOS.items():
+        _run(code, {**base_env, **env})  # 先跑一次，让 .pyc 与页缓存就绪
+        runs = [_run(code, {**base_env, **env}) for _ in range(args.runs)]
+        print(f"{label:<26} {statistics.median(r['ms'] for r in runs):>10.0f} "
+              f"{statistics.median(r['process_ms'] for r in runs):>11.0f} {runs[-1]['modules']:>8}  "
+              f"{', '.join(runs[-1]['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/bench_tokens.py
+# 发请求前 token 统计的开销：不同 prompt 大小下的编码耗时（冷 / 热编码器、单条 / 多条消息）。
+# 用法：python -m benchmarks.bench_tokens --sizes 10000 100000 500000
+# 若 tiktoken 编码表无法下载，会退回按字节估算，并在输出中注明。
+import argparse
+import statistics
+import time
+
+from app.core.accounting import (
+    _load_encoding,
+    count_message_tokens,
+    encoding_name,
+    fit_context,
+)
+from app.llm import MODEL_SPECS
+
+SAMPLE = "The quick brown fox jumps over the lazy dog. 敏捷的棕色狐狸跳过了懒狗。 "
+
+
+def _prompt(size: int) -> str:
+    return (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-flight token counting benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    args = parser.parse_args()
+
+    name = encoding_name("openai", args.model)
+    t0 = time.perf_counter()
+    enc = _load_encoding(name)
+    cold_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    _load_encoding(name)
+    warm_ms = (time.perf_counter() - t0) * 1000
+    mode = name if enc is not None else "byte-estimate (encoding unavailable)"
+    print(f"encoder={mode} cold_load={cold_ms:.1f}ms cached_lookup={warm_ms * 1000:.1f}us")
+
+    spec = MODEL_SPECS.get(args.model)
+    for size in args.sizes:
+        text = _prompt(size)
+        single = [{"role": "user", "content": text}]
+        turns = [{"role": "user" if i % 2 else "assistant", "content": text[i::50]} for i in range(50)]
+        one = _time(lambda single=single: count_message_tokens(single, "openai", args.model), args.repeat)
+        many = _time(lambda turns=turns: count_message_tokens(turns, "openai", args.model), args.repeat)
+        fit = _time(lambda turns=turns: fit_context(turns, "openai", args.model, spec, "truncate"), args.repeat)
+        tokens = sum(count_message_tokens(single, "openai", args.model)[0])
+        print(f"{size / 1000:>7.0f}KB tokens={tokens:>8} single={one:>8.2f}ms "
+              f"50-turn-batch={many:>8.2f}ms fit_context={fit:>8.2f}ms "
+              f"throughput={size / one / 1000:>6.1f}MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# benchmarks/load_test.py
+# 网关负载测试：启动本地桩上游（OpenAI HTTP + Gemini gRPC），以子进程方式启动网关并把两家供应商都指向桩服务，
+# 按给定并发驱动 /v1/generate 的非流式与流式请求，报告吞吐、p50/p95/p99 延迟、TTFT，
+# 以及网关进程每请求的 CPU 时间与内存变化。结果写成 JSON，可用 --compare 与另一次提交的结果对比。
+# 用法：python -m benchmarks.load_test --concurrency 1 16 64 --requests 500 --latency-ms 50 --token-rate 200
+#       python -m benchmarks.load_test ... --compare benchmarks/results/loadtest-<commit>.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.stub_server import StubServer, add_config_args, config_from_args
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))]
+    return {"mean": round(sum(ordered) / len(ordered), 2), "p50": round(rank(0.50), 2),
+            "p95": round(rank(0.95), 2), "p99": round(rank(0.99), 2), "max": round(ordered[-1], 2)}
+
+
+# —— 网关进程的 CPU / 内存（Linux /proc；其他平台返回 None）——
+class ProcessProbe:
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def cpu_s(self) -> Optional[float]:
+        try:
+            fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        return (int(fields[11]) + int(fields[12])) / self.tick  # utime + stime
+
+    def memory_kb(self) -> Dict[str, Optional[int]]:
+        out: Dict[str, Optional[int]] = {"rss": None, "peak": None}
+        try:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    out["rss"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    out["peak"] = int(line.split()[1])
+        except OSError:
+            pass
+        return out
+
+
+# —— 网关子进程 ——
+def start_gateway(stub: StubServer, port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = {**os.environ, **extra_env}
+    env.update(OPENAI_BASE_URL=stub.base_url + "/v1", OPENAI_API_KEY="sk-stub",
+               GOOGLE_BASE_URL=stub.gemini_url, GOOGLE_API_KEY="stub-key")
+    env.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def wait_ready(base: str, proc: subprocess.Popen, timeout_s: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"gateway exited with code {proc.returncode}")
+            try:
+                if (await client.get(base + "/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("gateway did not become healthy")
+
+
+# —— 单个请求 ——
+async def _one(client: httpx.AsyncClient, model: str, mode: str, i: int) -> Tuple[str, float, float]:
+    # 每个请求的 prompt 不同，避免被缓存 / 在途合并，测的是完整上游路径
+    body = {"model_name": model, "input": f"load test request {i}", "stream": mode == "stream"}
+    t0 = time.perf_counter()
+    try:
+        if mode == "unary":
+            r = await client.post("/v1/generate", json=body)
+            elapsed = (time.perf_counter() - t0) * 1000
+            return str(r.status_code), elapsed, elapsed
+        ttft = None
+        status = "200"
+        async with client.stream("POST", "/v1/generate", json=body) as r:
+            if r.status_code != 200:
+                await r.aread()
+                return str(r.status_code), (time.perf_counter() - t0) * 1000, 0.0
+            async for chunk in r.aiter_bytes():
+                if ttft is None and b"event: delta" in chunk:
+                    ttft = (time.perf_counter() - t0) * 1000
+                if b"event: error" in chunk:
+                    status = "stream_error"
+        elapsed = (time.perf_counter() - t0) * 1000
+        return status, elapsed, ttft if ttft is not None else elapsed
+    except httpx.HTTPError as e:
+        return type(e).__name__, (time.perf_counter() - t0) * 1000, 0.0
+
+
+async def run_scenario(base: str, model: str, mode: str, concurrency: int, requests: int, warmup: int,
+                       probe: ProcessProbe, stub: StubServer) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120.0) as client:
+        for i in range(warmup):
+            await _one(client, model, mode, -1 - i)
+        stub.reset_counters()
+        next_index = 0
+        results: List[Tuple[str, float, float]] = []
+
+        async def worker() -> None:
+            nonlocal next_index
+            while next_index < requests:
+                i = next_index
+                next_index += 1
+                results.append(await _one(client, model, mode, i))
+
+        mem_before = probe.memory_kb()
+        cpu_before = probe.cpu_s()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+        cpu_after = probe.cpu_s()
+        mem_after = probe.memory_kb()
+
+    statuses = Counter(status for status, _, _ in results)
+    ok = [(lat, ttft) for status, lat, ttft in results if status == "200"]
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    rss_delta = mem_after["rss"] - mem_before["rss"] if mem_before["rss"] and mem_after["rss"] else None
+    return {
+        "model": model,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": dict(statuses),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2) if wall > 0 else 0.0,
+        "latency_ms": _percentiles([lat for lat, _ in ok]),
+        "ttft_ms": _percentiles([ttft for _, ttft in ok]),
+        "gateway": {
+            "cpu_ms_per_request": round(cpu * 1000 / len(results), 3) if cpu is not None and results else None,
+            "cpu_utilization": round(cpu / wall, 3) if cpu is not None and wall > 0 else None,
+            "rss_mb": round(mem_after["rss"] / 1024, 1) if mem_after["rss"] else None,
+            "peak_rss_mb": round(mem_after["peak"] / 1024, 1) if mem_after["peak"] else None,
+            "rss_kb_per_request": round(rss_delta / len(results), 3) if rss_delta is not None and results else None,
+        },
+        "upstream": stub.counters(),
+    }
+
+
+# —— 与历史结果对比 ——
+_COMPARED = (("throughput_rps", ("throughput_rps",), True), ("p50", ("latency_ms", "p50"), False),
+             ("p95", ("latency_ms", "p95"), False), ("p99", ("latency_ms", "p99"), False),
+             ("ttft_p50", ("ttft_ms", "p50"), False), ("cpu_ms/req", ("gateway", "cpu_ms_per_request"), False))
+
+
+def _dig(row: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        row = row.get(key) if isinstance(row, dict) else None
+    return row
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    before = {(r["model"], r["mode"], r["concurrency"]): r for r in baseline["scenarios"]}
+    print(f"\ncompared with {baseline['meta'].get('commit', '?')[:12]} (positive = better)")
+    for row in current["scenarios"]:
+        old = before.get((row["model"], row["mode"], row["concurrency"]))
+        if old is None:
+            continue
+        parts = []
+        for label, path, higher_is_better in _COMPARED:
+            new_v, old_v = _dig(row, path), _dig(old, path)
+            if not new_v or not old_v:
+                continue
+            change = (new_v - old_v) / old_v * 100
+            parts.append(f"{label} {change if higher_is_better else -change:+.1f}%")
+        print(f"{row['model']:<14} {row['mode']:<6} c={row['concurrency']:<4} " + "  ".join(parts))
+
+
+def _print_row(row: Dict[str, Any]) -> None:
+    lat, ttft, gw = row["latency_ms"], row["ttft_ms"], row["gateway"]
+    errors = {k: v for k, v in row["statuses"].items() if k != "200"}
+    print(f"{row['model']:<14} {row['mode']:<6} c={row['concurrency']:<4} n={row['requests']:<6} "
+          f"rps={row['throughput_rps']:>8.1f} p50={lat['p50']:>7.1f} p95={lat['p95']:>7.1f} p99={lat['p99']:>7.1f}ms "
+          f"ttft50={ttft['p50']:>7.1f}ms cpu/req={gw['cpu_ms_per_request']}ms rss={gw['rss_mb']}MB"
+          + (f" errors={errors}" if errors else ""))
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = StubServer(config_from_args(args)).start()
+    port = args.port or _free_port()
+    base = f"http://127.0.0.1:{port}"
+    proc = start_gateway(stub, port, dict(kv.split("=", 1) for kv in args.env))
+    try:
+        await wait_ready(base, proc)
+        probe = ProcessProbe(proc.pid)
+        scenarios = []
+        for model in args.models:
+            for mode in args.modes:
+                for concurrency in args.concurrency:
+                    row = await run_scenario(base, model, mode, concurrency, args.requests, args.warmup, probe, stub)
+                    _print_row(row)
+                    scenarios.append(row)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        stub.stop()
+    return {
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stub": asdict(stub.config),
+            "requests": args.requests,
+            "env": args.env,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gateway load test against a local stub upstream")
+    parser.add_argument("--models", nargs="+", default=["gpt-4o-mini", "gemini-flash"])
+    parser.add_argument("--modes", nargs="+", choices=["unary", "stream"], default=["unary", "stream"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--port", type=int, default=0, help="gateway port (default: a free port)")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="extra gateway settings, e.g. RATE_LIMIT_MAX_RETRIES=0")
+    parser.add_argument("--out", type=Path, default=None, help="result file (default: benchmarks/results/)")
+    parser.add_argument("--compare", type=Path, default=None, help="earlier result file to diff against")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(_run(args))
+    out = args.out
+    if out is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        out = RESULTS_DIR / f"loadtest-{(result['meta']['commit'] or 'nogit')[:12]}.json"
+    out.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"results written to {out}")
+    if args.compare is not None:
+        compare(result, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# benchmarks/stub_server.py
+# 本地上游桩服务，供基准测试把供应商指向本机，不产生任何付费调用：
+# - OpenAI chat-completions（HTTP，含 SSE 流式）
+# - Gemini GenerativeService（gRPC 明文，GenerateContent / StreamGenerateContent）——
+#   langchain 的 Gemini 异步客户端只走 gRPC，桩服务按同一协议应答
+# 可配置首包延迟、逐 token 输出速率、错误率与 429 注入；统计接受的 TCP 连接数以观察连接复用。
+import json
+import random
+import threading
+import time
+from concurrent import futures
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import google.ai.generativelanguage_v1beta as glm
+import grpc
+
+_GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0.0            # 首包前的固定延迟
+    token_rate: float = 0.0            # 每秒输出的 token（词）数；0 表示一次性返回
+    error_rate: float = 0.0            # 以该概率返回 500
+    rate_limit_rate: float = 0.0       # 以该概率返回 429
+    retry_after_s: float = 0.05        # 429 携带的 retry-after
+    reply: str = "Hello from the stub upstream."
+    seed: Optional[int] = None
+
+
+class StubServer:
+    def __init__(self, config: StubConfig | None = None, host: str = "127.0.0.1", port: int = 0,
+                 grpc_port: int = 0, grpc_workers: int = 64):
+        self.config = config or StubConfig()
+        self.connections = 0
+        self.requests = 0
+        self.injected_errors = 0
+        self.injected_429s = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+        self._grpc = grpc.server(futures.ThreadPoolExecutor(max_workers=grpc_workers))
+        self._grpc.add_generic_rpc_handlers((_gemini_handler(self),))
+        self._grpc_host = host
+        self._grpc_port = self._grpc.add_insecure_port(f"{host}:{grpc_port}")
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def gemini_url(self) -> str:
+        # http:// 表示明文 gRPC（见 app/core/clients.py 的 Gemini 端点处理）
+        return f"http://{self._grpc_host}:{self._grpc_port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        self._grpc.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._grpc.stop(grace=None)
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.injected_errors = 0
+            self.injected_429s = 0
+
+    def counters(self) -> dict:
+        with self._lock:
+            return {"connections": self.connections, "requests": self.requests,
+                    "injected_errors": self.injected_errors, "injected_429s": self.injected_429s}
+
+    # 每个请求抽一次签：None 正常，"429" 限流，"500" 出错
+    def _fault(self) -> Optional[str]:
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            if roll < self.config.rate_limit_rate:
+                self.injected_429s += 1
+                return "429"
+            if roll < self.config.rate_limit_rate + self.config.error_rate:
+                self.injected_errors += 1
+                return "500"
+        return None
+
+    def _pace(self) -> None:
+        if self.config.token_rate > 0:
+            time.sleep(1 / self.config.token_rate)
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _make_handler(server: StubServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with server._lock:
+                server.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            payload = json.loads(body or b"{}")
+            config = server.config
+            fault = server._fault()
+            if config.latency_ms:
+                time.sleep(config.latency_ms / 1000)
+            if fault == "429":
+                self._send_json({"error": {"message": "Rate limit reached (stub)", "type": "requests",
+                                           "code": "rate_limit_exceeded"}},
+                                status=429, headers={"retry-after-ms": str(int(config.retry_after_s * 1000))})
+                return
+            if fault == "500":
+                self._send_json({"error": {"message": "injected failure (stub)", "type": "server_error"}}, status=500)
+                return
+            if self.path.endswith("/chat/completions"):
+                if payload.get("stream"):
+                    self._openai_stream(payload)
+                else:
+                    for _ in config.reply.split(" "):
+                        server._pace()
+                    self._send_json(_openai_completion(payload, config.reply))
+                return
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+
+        def _send_json(self, data: dict, status: int = 200, headers: Optional[dict] = None):
+            out = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(out)
+
+        def _openai_stream(self, payload: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            model = payload.get("model", "stub")
+            for word in server.config.reply.split(" "):
+                server._pace()
+                self._write_chunk(_openai_chunk(model, {"content": word + " "}))
+            self._write_chunk(_openai_chunk(model, {}, finish_reason="stop", usage=_usage(payload, server.config.reply)))
+            self._write_raw(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, data: dict):
+            self._write_raw(b"data: " + json.dumps(data).encode() + b"\n\n")
+
+        def _write_raw(self, frame: bytes):
+            self.wfile.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def _gemini_handler(server: StubServer) -> grpc.GenericRpcHandler:
+    def begin(context) -> None:
+        config = server.config
+        fault = server._fault()
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000)
+        if fault == "429":
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Resource has been exhausted (stub)")
+        if fault == "500":
+            context.abort(grpc.StatusCode.INTERNAL, "injected failure (stub)")
+
+    def generate(request, context):
+        begin(context)
+        for _ in server.config.reply.split(" "):
+            server._pace()
+        return _gemini_response(server.config.reply, _gemini_usage(request, server.config.reply))
+
+    def stream(request, context):
+        begin(context)
+        words = server.config.reply.split(" ")
+        for i, word in enumerate(words):
+            server._pace()
+            last = i == len(words) - 1
+            yield _gemini_response(word if last else word + " ",
+                                   _gemini_usage(request, server.config.reply) if last else None, final=last)
+
+    serialize = glm.GenerateContentResponse.serialize
+    deserialize = glm.GenerateContentRequest.deserialize
+    return grpc.method_handlers_generic_handler(_GEMINI_SERVICE, {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            generate, request_deserializer=deserialize, response_serializer=serialize),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            stream, request_deserializer=deserialize, response_serializer=serialize),
+    })
+
+
+def _usage(payload: dict, reply: str) -> dict:
+    prompt = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+    completion = len(reply.split())
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def _gemini_usage(request, reply: str) -> dict:
+    prompt = sum(len(part.text.split()) for content in request.contents for part in content.parts)
+    completion = len(reply.split())
+    return {"prompt_token_count": prompt, "candidates_token_count": completion,
+            "total_token_count": prompt + completion}
+
+
+def _gemini_response(text: str, usage: Optional[dict], final: bool = True):
+    candidate = glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)], role="model"), index=0,
+                              finish_reason=glm.Candidate.FinishReason.STOP if final else 0)
+    response = glm.GenerateContentResponse(candidates=[candidate])
+    if usage is not None:
+        response.usage_metadata = glm.GenerateContentResponse.UsageMetadata(**usage)
+    return response
+
+
+def _openai_completion(payload: dict, reply: str) -> dict:
+    # 支持 n：返回 n 个相同的候选，completion token 按 n 份计
+    n = int(payload.get("n") or 1)
+    usage = _usage(payload, reply)
+    usage["completion_tokens"] *= n
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "stub"),
+        "choices": [{"index": i, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}
+                    for i in range(n)],
+        "usage": usage,
+    }
+
+
+def _openai_chunk(model: str, delta: dict, finish_reason: str | None = None, usage: dict | None = None) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+
+def add_config_args(parser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=0.0, help="stub output tokens per second (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of upstream calls answered 429")
+    parser.add_argument("--reply-words", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> StubConfig:
+    words = StubConfig.reply.split(" ")
+    reply = " ".join(words[i % len(words)] for i in range(args.reply_words))
+    return StubConfig(latency_ms=args.latency_ms, token_rate=args.token_rate, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, reply=reply, seed=args.seed)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the local LLM stub upstream")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--grpc-port", type=int, default=9101)
+    add_config_args(parser)
+    args = parser.parse_args()
+    stub = StubServer(config_from_args(args), port=args.port, grpc_port=args.grpc_port).start()
+    print(f"stub upstream listening on {stub.base_url} (OpenAI) and {stub.gemini_url} (Gemini gRPC)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
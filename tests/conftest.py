@@ -9,6 +9,22 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_asyn
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
+from app.core.admission import admission
+from app.core.balancer import balancer
+from app.core.cache import response_cache
+from app.core.clients import registry
+from app.core.coalesce import singleflight, stream_flights
+from app.core.lifecycle import drain
+from app.core.config import settings
+from app.core.conversations import conversations
+from app.core.metrics import metrics, recent
+from app.providers import providers
+from app.core.quota import quota_ledger
+from app.core.ratelimit import rate_limiter
+from app.core.request_log import request_log
+from app.core.resume import resumable_streams
+from app.core.routing import latency_stats
+from app.core.shared import shared_state
 from app.db.base import Base
 from app.db.session import get_session
 
@@ -41,14 +57,44 @@ async def db():
 
 
 @pytest.fixture(scope="function")
-def client(db) -> Generator:
+def client(db, monkeypatch) -> Generator:
     """Create test client with overridden dependencies"""
+    # Warm-up would cache real provider clients ahead of the tests' mocks
+    monkeypatch.setattr(settings, "LLM_WARM_CLIENTS", False)
     app.dependency_overrides[get_session] = override_get_session
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(autouse=True)
+def reset_client_registry():
+    """Drop cached provider clients and responses so each test's mocks are honoured"""
+    registry.clear()
+    response_cache.clear()
+    singleflight.clear()
+    stream_flights.clear()
+    metrics.reset()
+    recent.clear()
+    latency_stats.clear()
+    rate_limiter.clear()
+    balancer.clear()
+    request_log.clear()
+    quota_ledger.clear()
+    conversations.clear()
+    admission.reset()
+    resumable_streams.clear()
+    yield
+    registry.clear()
+    providers.clear()
+    response_cache.clear()
+    response_cache.configure(None)
+    quota_ledger.configure(None)
+    conversations.configure(None)
+    shared_state.configure(None)
+    drain.reset()
+
+
 @pytest.fixture(scope="session")
 def event_loop():
     """Create event loop for async tests"""
@@ -0,0 +1,164 @@
+"""
+Test pre-flight token accounting, context-window enforcement and cost
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app.core.accounting import (
+    ContextWindowExceeded,
+    ModelSpec,
+    cost_usd,
+    count_message_tokens,
+    encoding_name,
+    fit_context,
+)
+from app.llm import generate_async, generate_stream_async
+from app.schemas.llm import GenerateRequest
+
+SMALL = ModelSpec(context_window=40, max_output_tokens=10, input_usd_per_1m=1.0, output_usd_per_1m=2.0)
+
+
+class WordEncoding:
+    """Deterministic stand-in for a tiktoken encoding: one token per word"""
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts):
+        return [t.split() for t in texts]
+
+
+@pytest.fixture
+def word_encoding():
+    with patch("app.core.accounting._load_encoding", return_value=WordEncoding()):
+        yield
+
+
+@pytest.fixture
+def no_reserve():
+    with patch("app.core.accounting.settings") as mock_settings:
+        mock_settings.CONTEXT_RESERVE_TOKENS = 0
+        mock_settings.TOKENIZE_OFFLOAD_CHARS = 10**9
+        yield
+
+
+def _msgs(*pairs):
+    return [{"role": role, "content": content} for role, content in pairs]
+
+
+class TestCounting:
+    """Test token counting"""
+
+    def test_encoding_per_family(self):
+        """Test model families map to tiktoken encodings"""
+        assert encoding_name("openai", "gpt-4o-mini") == "o200k_base"
+        assert encoding_name("openai", "gpt-3.5-turbo") == "cl100k_base"
+        assert encoding_name("google", "gemini-1.5-pro") == "cl100k_base"
+
+    def test_exact_count_with_overhead(self, word_encoding):
+        """Test each message adds its tokens plus fixed overhead"""
+        counts, exact = count_message_tokens(_msgs(("system", "be brief"), ("user", "one two three")), "openai", "gpt-4o")
+        assert counts == [5, 6]
+        assert exact is True
+
+    def test_google_counts_are_estimates(self, word_encoding):
+        """Test non-OpenAI counts are flagged as approximate"""
+        _, exact = count_message_tokens(_msgs(("user", "hi")), "google", "gemini-1.5-flash")
+        assert exact is False
+
+    def test_fallback_when_encoding_unavailable(self):
+        """Test byte-length estimate is used when tiktoken cannot load"""
+        with patch("app.core.accounting._load_encoding", return_value=None):
+            counts, exact = count_message_tokens(_msgs(("user", "x" * 40)), "openai", "gpt-4o")
+        assert counts == [13]
+        assert exact is False
+
+
+class TestFitContext:
+    """Test context-window enforcement"""
+
+    def test_under_limit_passes_through(self, word_encoding, no_reserve):
+        """Test small prompts are untouched"""
+        messages = _msgs(("user", "hello there"))
+        pre = fit_context(messages, "openai", "m", SMALL, "reject")
+        assert pre.messages == messages
+        assert pre.prompt_tokens == 2 + 3 + 3
+
+    def test_reject_strategy(self, word_encoding, no_reserve):
+        """Test oversized prompts raise before dispatch"""
+        with pytest.raises(ContextWindowExceeded) as exc:
+            fit_context(_msgs(("user", "w " * 50)), "openai", "m", SMALL, "reject")
+        assert exc.value.limit == 40
+        assert exc.value.prompt_tokens == 56
+
+    def test_truncate_drops_oldest_non_system(self, word_encoding, no_reserve):
+        """Test truncation keeps system prompts and the newest turn"""
+        messages = _msgs(
+            ("system", "rules"),
+            ("user", "w " * 10),
+            ("assistant", "w " * 10),
+            ("user", "w " * 10),
+        )
+        pre = fit_context(messages, "openai", "m", SMALL, "truncate")
+        assert pre.messages == [messages[0], messages[2], messages[3]]
+        assert pre.dropped == 1
+        assert pre.prompt_tokens == 33
+
+    def test_truncate_cannot_shrink_last_message(self, word_encoding, no_reserve):
+        """Test a single oversized turn is still rejected"""
+        with pytest.raises(ContextWindowExceeded):
+            fit_context(_msgs(("user", "w " * 100)), "openai", "m", SMALL, "truncate")
+
+    def test_unknown_model_not_enforced(self, word_encoding):
+        """Test models without a spec are counted but never rejected"""
+        pre = fit_context(_msgs(("user", "w " * 1000)), "openai", "custom", None, "reject")
+        assert pre.prompt_tokens == 1006
+
+
+class TestCost:
+    """Test cost estimation"""
+
+    def test_cost_from_price_table(self):
+        """Test cost uses input and output prices per million tokens"""
+        assert cost_usd(SMALL, {"prompt_tokens": 1_000_000, "completion_tokens": 500_000}) == 2.0
+
+    def test_unknown_model_has_no_cost(self):
+        """Test unknown models report no cost"""
+        assert cost_usd(None, {"prompt_tokens": 10}) is None
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_response_reports_real_cost(self, mock_openai, word_encoding):
+        """Test observability carries computed cost and preflight count"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="ok", usage_metadata={"input_tokens": 1000, "output_tokens": 2000, "total_tokens": 3000},
+        ))
+        out = asyncio.run(generate_async(GenerateRequest(model_name="gpt-4o-mini", input="hello world")))
+        assert out.observability["cost_usd"] == pytest.approx(0.00135)
+        assert out.observability["estimated"] is False
+        assert out.observability["preflight"] == {"prompt_tokens": 8, "exact": True}
+
+
+class TestEnforcementInRoutes:
+    """Test rejection surfaces to clients"""
+
+    def test_stream_emits_error_event(self, word_encoding):
+        """Test an oversized streaming request gets an error event"""
+        async def collect():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="w " * 10, stream=True)
+            return [e async for e in generate_stream_async(req)]
+
+        with patch.dict("app.llm.MODEL_SPECS", {"gpt-4o-mini": ModelSpec(1030, 10, 0.1, 0.1)}):
+            events = asyncio.run(collect())
+        assert events[-1].startswith(b"event: error\n")
+        assert json.loads(events[-1].split(b"data: ", 1)[1])["type"] == "context_window_exceeded"
+
+    def test_unary_endpoint_returns_400(self, client, word_encoding):
+        """Test the HTTP endpoint maps the rejection to 400"""
+        with patch.dict("app.llm.MODEL_SPECS", {"gpt-4o-mini": ModelSpec(1030, 10, 0.1, 0.1)}):
+            response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "w " * 10})
+        assert response.status_code == 400
+        assert response.json()["type"] == "context_window_exceeded"
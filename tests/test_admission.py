@@ -0,0 +1,148 @@
+"""
+Test admission control: priority classes, fair scheduling and load shedding
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.admission import Overloaded, admission
+from app.core.metrics import ADMISSION_SHED, metrics
+
+USAGE = {"input_tokens": 3, "output_tokens": 2, "total_tokens": 5}
+CLASSES = {
+    "interactive": {"weight": 4, "max_queue": 8, "max_wait_ms": 2000},
+    "default": {"weight": 2, "max_queue": 8, "max_wait_ms": 2000},
+    "batch": {"weight": 1, "max_queue": 8, "max_wait_ms": 2000},
+}
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    """A controller with a single slot and small queues"""
+    monkeypatch.setattr("app.core.config.settings.ADMISSION_MAX_CONCURRENCY", 1)
+    monkeypatch.setattr("app.core.config.settings.ADMISSION_CLASSES", CLASSES)
+    admission.reset()
+    return admission
+
+
+class TestClassify:
+    """Test how a request's priority class is chosen"""
+
+    def test_header_tenant_and_default(self, monkeypatch):
+        """Test the header picks a class but cannot rise above the tenant's class"""
+        monkeypatch.setattr("app.core.config.settings.ADMISSION_TENANT_PRIORITY", {"bulk": "batch"})
+        admission.reset()
+        assert admission.classify(None) == "default"
+        assert admission.classify("interactive") == "interactive"
+        assert admission.classify("nonsense") == "default"
+        assert admission.classify(None, "bulk") == "batch"
+        assert admission.classify("interactive", "bulk") == "batch"
+        assert admission.classify(None, None, "batch") == "batch"
+
+
+class TestScheduling:
+    """Test queued requests are admitted by weighted fair share"""
+
+    def test_weighted_order_without_starvation(self, one_slot):
+        """Test interactive gets most slots while batch still makes progress"""
+        async def scenario():
+            holder = await one_slot.acquire("default")
+            order = []
+
+            async def request(priority):
+                ticket = await one_slot.acquire(priority)
+                order.append(priority)
+                await asyncio.sleep(0)
+                ticket.release()
+
+            tasks = [asyncio.ensure_future(request(p)) for p in ["batch"] * 4 + ["interactive"] * 6]
+            await asyncio.sleep(0)
+            holder.release()
+            await asyncio.gather(*tasks)
+            return order
+
+        order = asyncio.run(scenario())
+        assert order[:4].count("interactive") >= 3
+        assert "batch" in order[:6]
+        assert one_slot.in_flight == 0
+
+    def test_shedding(self, one_slot, monkeypatch):
+        """Test full queues get 429, long estimated or actual waits get 503"""
+        async def scenario():
+            holder = await one_slot.acquire("default")
+            waiters = [asyncio.ensure_future(one_slot.acquire("batch")) for _ in range(8)]
+            await asyncio.sleep(0)
+            with pytest.raises(Overloaded) as full:
+                await one_slot.acquire("batch")
+            for task in waiters:
+                task.cancel()
+            await asyncio.gather(*waiters, return_exceptions=True)
+
+            # 之前的名额平均占用 10 秒：预计等待超过 2 秒上限，不入队直接拒绝
+            holder.started -= 10
+            holder.release()
+            holder = await one_slot.acquire("default")
+            with pytest.raises(Overloaded) as early:
+                await one_slot.acquire("interactive")
+
+            monkeypatch.setattr(one_slot, "_service_s", None)
+            one_slot._classes["interactive"].max_wait_s = 0.05
+            with pytest.raises(Overloaded) as timeout:
+                await one_slot.acquire("interactive")
+            holder.release()
+            return full.value, early.value, timeout.value
+
+        full, early, timeout = asyncio.run(scenario())
+        assert (full.status_code, full.reason) == (429, "queue_full")
+        assert (early.status_code, early.reason) == (503, "overloaded") and early.retry_after_s >= 5
+        assert (timeout.status_code, timeout.reason) == (503, "queue_timeout")
+        assert admission.in_flight == 0 and admission.describe()["classes"]["batch"]["queue_depth"] == 0
+
+
+class TestAdmissionEndpoints:
+    """Test admission on the HTTP routes"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_shed_request_gets_retry_after(self, mock_openai, client, monkeypatch):
+        """Test a rejected request gets 429 with Retry-After and is counted"""
+        monkeypatch.setattr("app.core.config.settings.ADMISSION_MAX_CONCURRENCY", 1)
+        monkeypatch.setattr("app.core.config.settings.ADMISSION_CLASSES",
+                            {**CLASSES, "interactive": {"weight": 4, "max_queue": 0, "max_wait_ms": 2000}})
+        admission.reset()
+        holder = asyncio.run(admission.acquire("default"))
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi"},
+                               headers={"X-Priority": "interactive"})
+        assert response.status_code == 429
+        assert response.json()["type"] == "queue_full" and response.json()["priority"] == "interactive"
+        assert int(response.headers["retry-after"]) >= 1
+        holder.release()
+        metrics.collect(None)
+        assert ADMISSION_SHED.values[("interactive", "queue_full")] == 1
+        assert client.get("/v1/stats").json()["admission"]["classes"]["interactive"]["queue_full"] == 1
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_slots_are_returned(self, mock_openai, client):
+        """Test unary and streamed requests give their slot back when they finish"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="hi", usage_metadata=USAGE))
+
+        async def astream(messages):
+            yield AIMessageChunk(content="a", usage_metadata=USAGE)
+        mock_openai.return_value.astream = astream
+        assert client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi"}).status_code == 200
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "stream": True})
+        assert "event: done" in response.text
+        state = admission.describe()
+        assert state["in_flight"] == 0 and state["classes"]["default"]["admitted"] == 2
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_batch_items_use_batch_class(self, mock_openai, client):
+        """Test batch items are admitted one by one under the batch class"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="hi", usage_metadata=USAGE))
+        items = [{"model_name": "gpt-4o-mini", "input": f"q{i}"} for i in range(3)]
+        response = client.post("/v1/generate/batch", json={"items": items})
+        lines = [json.loads(line) for line in response.text.strip().splitlines()]
+        assert lines[-1]["summary"]["succeeded"] == 3
+        assert admission.describe()["classes"]["batch"]["admitted"] == 3
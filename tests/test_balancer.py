@@ -0,0 +1,208 @@
+"""
+Test multi-endpoint load balancing and circuit breaking
+"""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.balancer import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Endpoint,
+    EndpointPool,
+    balancer,
+    is_endpoint_failure,
+)
+from app.core.ratelimit import rate_limiter
+from app.llm import generate_async
+from app.schemas.llm import GenerateRequest
+
+
+def _response(status):
+    return httpx.Response(status, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+def _pool(n=2):
+    return EndpointPool("openai", [Endpoint("openai", i, api_key=f"sk-{i}") for i in range(n)])
+
+
+class TestSelection:
+    """Test least-outstanding, latency-weighted selection"""
+
+    def test_spreads_by_outstanding(self):
+        """Test concurrent leases go to different endpoints"""
+        pool = _pool()
+        first, second = pool.checkout(), pool.checkout()
+        assert first.endpoint is not second.endpoint
+        first.release()
+        assert pool.checkout().endpoint is first.endpoint
+
+    def test_prefers_faster_endpoint(self):
+        """Test the endpoint with the lower latency EWMA absorbs more load"""
+        pool = _pool()
+        pool.endpoints[0].ewma_s = 1.0
+        pool.endpoints[1].ewma_s = 0.1
+        picks = [pool.checkout().endpoint.index for _ in range(5)]
+        assert picks == [1, 1, 1, 1, 1]
+
+    def test_ewma_updates_on_success(self, monkeypatch):
+        """Test successful leases fold their latency into the EWMA"""
+        monkeypatch.setattr("app.core.config.settings.LB_EWMA_ALPHA", 0.5)
+        pool = _pool(1)
+        ep = pool.endpoints[0]
+        pool._record(ep, 1.0, failed=False)
+        pool._record(ep, 0.0, failed=False)
+        assert ep.ewma_s == pytest.approx(0.5)
+
+    def test_key_is_not_exposed(self):
+        """Test endpoint ids and state do not contain the API key"""
+        ep = Endpoint("openai", 0, api_key="sk-secret")
+        assert "sk-secret" not in ep.id
+        assert "sk-secret" not in str(ep.describe())
+
+
+class TestCircuitBreaker:
+    """Test ejection, half-open probing and re-admission"""
+
+    def test_ejects_after_repeated_failures(self, monkeypatch):
+        """Test an endpoint failing repeatedly stops receiving traffic"""
+        monkeypatch.setattr("app.core.config.settings.LB_EJECT_AFTER_FAILURES", 2)
+        pool = _pool()
+        bad = pool.endpoints[0]
+        pool._record(bad, None, failed=True)
+        assert bad.state == CLOSED
+        pool._record(bad, None, failed=True)
+        assert bad.state == OPEN
+        assert {pool.checkout().endpoint.index for _ in range(3)} == {1}
+
+    def test_half_open_probe_readmits(self, monkeypatch):
+        """Test one probe is let through after the cooldown and success closes the breaker"""
+        monkeypatch.setattr("app.core.config.settings.LB_BREAKER_COOLDOWN_S", 0.0)
+        pool = _pool()
+        bad = pool.endpoints[0]
+        bad.state, bad.opened_at = OPEN, 0.0
+        pool.endpoints[1].ewma_s = bad.ewma_s = 1.0
+        pool.endpoints[1].outstanding = 5
+
+        probe = pool.checkout()
+        assert probe.endpoint is bad and bad.state == HALF_OPEN
+        assert pool.checkout().endpoint.index == 1  # 探测进行中，不再放行第二个
+        probe.ok()
+        probe.release()
+        assert bad.state == CLOSED
+
+    def test_failed_probe_reopens(self, monkeypatch):
+        """Test a failing half-open probe ejects the endpoint again"""
+        monkeypatch.setattr("app.core.config.settings.LB_BREAKER_COOLDOWN_S", 0.0)
+        pool = _pool(1)
+        ep = pool.endpoints[0]
+        ep.state = OPEN
+        lease = pool.checkout()
+        lease.fail()
+        lease.release()
+        assert ep.state == OPEN
+
+    def test_only_endpoint_errors_count(self):
+        """Test client errors and rate limits never trip the breaker, server and transport errors do"""
+        bad_request = openai.BadRequestError("bad model", response=_response(400), body=None)
+        rate_limited = openai.RateLimitError("slow down", response=_response(429), body=None)
+        assert not is_endpoint_failure(bad_request) and not is_endpoint_failure(rate_limited)
+        assert not is_endpoint_failure(ValueError("unknown alias"))
+        assert is_endpoint_failure(openai.InternalServerError("boom", response=_response(503), body=None))
+        assert is_endpoint_failure(openai.APIConnectionError(request=_response(500).request))
+        assert is_endpoint_failure(TimeoutError())
+
+        pool = _pool(1)
+        for _ in range(10):
+            with pytest.raises(openai.BadRequestError):
+                with pool.lease():
+                    raise bad_request
+        assert pool.endpoints[0].state == CLOSED and pool.endpoints[0].failures == 0
+
+    def test_panic_mode_when_all_ejected(self):
+        """Test an all-ejected pool still serves from the endpoint ejected first"""
+        pool = _pool()
+        pool.endpoints[0].state, pool.endpoints[0].opened_at = OPEN, 2e12
+        pool.endpoints[1].state, pool.endpoints[1].opened_at = OPEN, 1e12
+        assert pool.checkout().endpoint.index == 1
+
+
+class TestPooledGeneration:
+    """Test endpoint pools in generate_async"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_failing_key_is_routed_around(self, mock_openai, monkeypatch):
+        """Test traffic moves to the healthy key once the failing one is ejected"""
+        monkeypatch.setattr("app.core.config.settings.LLM_ENDPOINTS",
+                            {"openai": [{"api_key": "sk-bad"}, {"api_key": "sk-good"}]})
+        monkeypatch.setattr("app.core.config.settings.LB_EJECT_AFTER_FAILURES", 1)
+
+        def build(**kwargs):
+            client = MagicMock()
+            if kwargs["api_key"] == "sk-bad":
+                client.ainvoke = AsyncMock(side_effect=openai.InternalServerError(
+                    "boom", response=_response(500), body=None))
+            else:
+                client.ainvoke = AsyncMock(return_value=AIMessage(
+                    content="ok", usage_metadata={"input_tokens": 1, "output_tokens": 1, "total_tokens": 2}))
+            return client
+        mock_openai.side_effect = build
+
+        req = GenerateRequest(model_name="gpt-4o-mini", input="hi")
+        with pytest.raises(openai.InternalServerError):
+            asyncio.run(generate_async(req))
+        outs = [asyncio.run(generate_async(req)) for _ in range(3)]
+
+        assert all(o.choices[0].content == "ok" for o in outs)
+        states = {e["id"].split(":")[0]: e["state"] for e in balancer.state()["openai"]}
+        assert states == {"openai#0": "open", "openai#1": "closed"}
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_rate_limited_retry_moves_to_another_key(self, mock_openai, monkeypatch):
+        """Test a retry after 429 takes a fresh lease instead of hammering the same key"""
+        monkeypatch.setattr("app.core.config.settings.LLM_ENDPOINTS",
+                            {"openai": [{"api_key": "sk-a"}, {"api_key": "sk-b"}]})
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMIT_BACKOFF_S", 0.0)
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMIT_DEFAULT_RETRY_S", 0.0)
+        used = []
+
+        def build(**kwargs):
+            async def ainvoke(messages):
+                used.append(kwargs["api_key"])
+                if len(used) == 1:
+                    raise openai.RateLimitError("slow down", response=_response(429), body=None)
+                return AIMessage(content="ok", usage_metadata={"input_tokens": 1, "output_tokens": 1,
+                                                               "total_tokens": 2})
+            client = MagicMock()
+            client.ainvoke = ainvoke
+            return client
+        mock_openai.side_effect = build
+
+        out = asyncio.run(generate_async(GenerateRequest(model_name="gpt-4o-mini", input="hi")))
+        assert out.choices[0].content == "ok"
+        assert len(used) == 2 and used[0] != used[1]
+        assert all(e["state"] == "closed" for e in balancer.state()["openai"])
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_settles_on_the_endpoint_limiter(self, mock_openai, client, monkeypatch):
+        """Test a pooled stream corrects the reservation on the endpoint it was taken from"""
+        monkeypatch.setattr("app.core.config.settings.LLM_ENDPOINTS",
+                            {"openai": [{"api_key": "sk-a"}, {"api_key": "sk-b"}]})
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMITS", {"openai": {"tpm": 10_000}})
+
+        async def astream(messages):
+            yield AIMessageChunk(content="hi", usage_metadata={"input_tokens": 3, "output_tokens": 2,
+                                                               "total_tokens": 5})
+        mock_openai.return_value.astream = astream
+
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "hi", "stream": True})
+        assert "event: done" in response.text
+        limits = rate_limiter.state()
+        assert "openai" not in limits
+        (endpoint,) = [v for k, v in limits.items() if k.startswith("openai:")]
+        assert 10_000 - 50 < endpoint["tpm"]["available"] <= 10_000
@@ -0,0 +1,112 @@
+"""
+Test batch generation endpoint
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+from langchain_core.messages import AIMessage
+
+from app.batch import ProviderLimits, batch_summary, run_batch
+from app.schemas.llm import GenerateRequest
+
+
+def _collect(items, concurrency=None):
+    async def scenario():
+        return [json.loads(line) async for line in run_batch(items, concurrency)]
+    return asyncio.run(scenario())
+
+
+class TestRunBatch:
+    """Test batch fan-out and NDJSON output"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_every_item_reported_with_summary(self, mock_openai):
+        """Test each item yields one line with its index, then a summary"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="ok", usage_metadata={"input_tokens": 1, "output_tokens": 2, "total_tokens": 3},
+        ))
+        items = [GenerateRequest(model_name="gpt-4o-mini", input=f"q{i}", temperature=0.5) for i in range(5)]
+
+        lines = _collect(items)
+
+        assert len(lines) == 6
+        assert sorted(line["index"] for line in lines[:-1]) == list(range(5))
+        summary = lines[-1]["summary"]
+        assert summary["succeeded"] == 5
+        assert summary["failed"] == 0
+        assert summary["total_tokens"] == 15
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_item_failure_does_not_fail_batch(self, mock_openai):
+        """Test a bad item is reported as an error line"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+        items = [
+            GenerateRequest(model_name="gpt-4o-mini", input="fine"),
+            GenerateRequest(model_name="unknown-model", input="bad"),
+        ]
+
+        lines = _collect(items)
+
+        errors = [line for line in lines if "error" in line]
+        assert len(errors) == 1
+        assert errors[0]["index"] == 1
+        assert errors[0]["error"]["type"] == "ValueError"
+        assert lines[-1]["summary"]["failed"] == 1
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_per_provider_concurrency_cap(self, mock_openai):
+        """Test no more than the configured number of calls run at once"""
+        running = peak = 0
+
+        async def slow_invoke(_messages):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return AIMessage(content="ok")
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=slow_invoke)
+        items = [GenerateRequest(model_name="gpt-4o-mini", input=f"q{i}", temperature=0.5) for i in range(6)]
+
+        _collect(items, {"openai": 2})
+
+        assert peak == 2
+
+    def test_provider_limits_defaults(self):
+        """Test unknown providers fall back to the default cap"""
+        async def scenario():
+            limits = ProviderLimits({"openai": 3})
+            return limits.for_provider("openai"), limits.for_provider("other")
+        openai_sem, other_sem = asyncio.run(scenario())
+        assert openai_sem._value == 3
+        assert other_sem._value == 4
+
+    def test_overrides_cannot_raise_server_caps(self):
+        """Test a request may lower a provider cap but never exceed the configured one"""
+        limits = ProviderLimits({"openai": 1000, "google": 2, "other": 50})
+        assert limits.cap("openai") == 8
+        assert limits.cap("google") == 2
+        assert limits.cap("other") == 4
+
+    def test_batch_summary(self):
+        """Test aggregate latency statistics"""
+        summary = batch_summary([10.0, 20.0, 30.0, 40.0], succeeded=3, failed=1, total_tokens=9, wall_s=0.5)
+        assert summary["items"] == 4
+        assert summary["throughput_rps"] == 8.0
+        assert summary["latency_ms"]["max"] == 40.0
+        assert summary["latency_ms"]["mean"] == 25.0
+
+
+def test_batch_endpoint_streams_ndjson(client):
+    """Test the HTTP endpoint returns NDJSON lines"""
+    with patch('app.providers.openai.ChatOpenAI') as mock_openai:
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+        response = client.post("/v1/generate/batch", json={
+            "items": [{"model_name": "gpt-4o-mini", "input": "a"}, {"model_name": "gpt-4o-mini", "input": "b", "temperature": 0.3}],
+        })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert "summary" in lines[-1]
+    assert lines[-1]["summary"]["succeeded"] == 2
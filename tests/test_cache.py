@@ -0,0 +1,199 @@
+"""
+Test deterministic response cache
+"""
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, patch
+
+from langchain_core.messages import AIMessage
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.cache import ResponseCache, cache_key, response_cache
+from app.db.base import Base
+from app.llm import generate_async, generate_stream_async
+from app.models.response_cache import ResponseCacheEntry
+from app.repositories import response_cache as repo
+from app.schemas.llm import GenerateRequest
+
+RESULT = {
+    "provider": "openai",
+    "model": "gpt-4o-mini",
+    "text": "cached answer",
+    "finish_reason": "stop",
+    "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+}
+
+
+class TestCacheKey:
+    """Test canonical cache key hashing"""
+
+    def test_key_is_order_independent(self):
+        """Test dict key order does not change the hash"""
+        messages = [{"role": "user", "content": "hi"}]
+        a = cache_key("openai", "gpt-4o", messages, {"temperature": 0.0})
+        b = cache_key("openai", "gpt-4o", [{"content": "hi", "role": "user"}], {"temperature": 0.0})
+        assert a == b
+        assert len(a) == 64
+
+    def test_key_depends_on_model_and_params(self):
+        """Test different model or params produce different keys"""
+        messages = [{"role": "user", "content": "hi"}]
+        base = cache_key("openai", "gpt-4o", messages, {"temperature": 0.0})
+        assert base != cache_key("openai", "gpt-4o-mini", messages, {"temperature": 0.0})
+        assert base != cache_key("openai", "gpt-4o", messages, {"temperature": 0.5})
+
+    def test_cacheable_requires_opt_in_and_temperature_zero(self):
+        """Test only opted-in deterministic requests are cacheable"""
+        assert not ResponseCache.cacheable(GenerateRequest(model_name="gpt-4o", input="x"))
+        assert ResponseCache.cacheable(GenerateRequest(model_name="gpt-4o", input="x", cache=True))
+        assert not ResponseCache.cacheable(GenerateRequest(model_name="gpt-4o", input="x", cache=True, temperature=0.7))
+        assert not ResponseCache.cacheable(GenerateRequest(model_name="gpt-4o", input="x", cache=True, include_raw=True))
+
+
+class TestMemoryTier:
+    """Test in-process LRU tier"""
+
+    def test_lru_eviction(self):
+        """Test least recently used entry is evicted at capacity"""
+        cache = ResponseCache(max_entries=2, ttl_s=60)
+        cache.put("a", RESULT)
+        cache.put("b", RESULT)
+        assert cache.get_memory("a") is not None
+        cache.put("c", RESULT)
+        assert cache.get_memory("b") is None
+        assert cache.get_memory("a") is not None
+        assert len(cache) == 2
+
+    def test_ttl_expiry(self):
+        """Test entries older than the TTL are dropped"""
+        cache = ResponseCache(max_entries=10, ttl_s=1)
+        cache.put("a", RESULT)
+        with patch("app.core.cache.time.time", return_value=time.time() + 5):
+            assert cache.get_memory("a") is None
+        assert len(cache) == 0
+
+    def test_raw_is_not_stored(self):
+        """Test provider raw payloads are stripped before caching"""
+        cache = ResponseCache(max_entries=10, ttl_s=60)
+        cache.put("a", {**RESULT, "raw": {"big": "payload"}})
+        assert "raw" not in cache.get_memory("a").result
+
+
+class TestPersistentTier:
+    """Test SQLAlchemy-backed tier"""
+
+    def test_roundtrip_through_database(self):
+        """Test a persisted entry is served after the memory tier is cleared"""
+        async def scenario():
+            engine = create_async_engine(
+                "sqlite+aiosqlite:///:memory:",
+                connect_args={"check_same_thread": False},
+                poolclass=StaticPool,
+            )
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            cache = ResponseCache(max_entries=10, ttl_s=60)
+            cache.configure(async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+            cache.put("k", RESULT)
+            await cache.drain()
+            cache._entries.clear()
+            hit = await cache.get("k")
+            again = await cache.get("k")
+            await engine.dispose()
+            return hit, again, cache.stats
+
+        hit, again, stats = asyncio.run(scenario())
+        assert hit.tier == "persistent"
+        assert hit.result == RESULT
+        assert again.tier == "memory"
+        assert stats == {"hits_memory": 1, "hits_shared": 0, "hits_persistent": 1, "misses": 0}
+
+    def test_database_errors_are_misses(self):
+        """Test a failing database turns reads into misses and write errors are caught in the background task"""
+        async def scenario():
+            engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)  # 没有建表
+            cache = ResponseCache(max_entries=10, ttl_s=60)
+            cache.configure(async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+            hit = await cache.get("k")
+            cache.put("k", RESULT)
+            tasks = list(cache._pending)
+            await cache.drain()
+            await engine.dispose()
+            return hit, tasks, cache
+
+        hit, tasks, cache = asyncio.run(scenario())
+        assert hit is None
+        assert all(t.exception() is None for t in tasks)
+        assert cache.stats["misses"] == 1
+        assert cache.persistent_stats["errors"] == 2
+
+    def test_table_is_pruned_on_write(self, monkeypatch):
+        """Test the first write sweeps expired rows and rows beyond the row cap"""
+        monkeypatch.setattr("app.core.config.settings.RESPONSE_CACHE_PERSIST_MAX_ENTRIES", 3)
+
+        async def scenario():
+            engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            factory = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+            now = time.time()
+            async with factory() as session:
+                await repo.upsert_entry(session, "stale", "{}", now - 120)
+                for i in range(4):
+                    await repo.upsert_entry(session, f"old{i}", "{}", now - 10 + i)
+            cache = ResponseCache(max_entries=10, ttl_s=60)
+            cache.configure(factory)
+            cache.put("new", RESULT)
+            await cache.drain()
+            async with factory() as session:
+                keys = set(await session.scalars(select(ResponseCacheEntry.key)))
+                count = await session.scalar(select(func.count()).select_from(ResponseCacheEntry))
+            await engine.dispose()
+            return keys, count, cache.persistent_stats
+
+        keys, count, stats = asyncio.run(scenario())
+        assert count == 3
+        assert keys == {"old2", "old3", "new"}
+        assert stats == {"errors": 0, "pruned": 3}
+
+
+class TestCachedGeneration:
+    """Test cache integration in generate_async / generate_stream_async"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_second_call_served_from_cache(self, mock_openai):
+        """Test identical deterministic requests only go upstream once"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="fresh", usage_metadata={"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+        ))
+        req = GenerateRequest(model_name="gpt-4o-mini", input="Hello", cache=True)
+
+        first = asyncio.run(generate_async(req))
+        second = asyncio.run(generate_async(req))
+
+        assert mock_openai.return_value.ainvoke.await_count == 1
+        assert first.observability["cache"] == {"hit": False}
+        assert second.observability["cache"]["hit"] is True
+        assert second.observability["cache"]["tier"] == "memory"
+        assert second.choices[0].content == "fresh"
+        assert second.id != first.id
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_replays_cached_answer(self, mock_openai):
+        """Test a cache hit is replayed as SSE deltas without an upstream call"""
+        mock_openai.return_value.astream = AsyncMock(side_effect=AssertionError("upstream called"))
+        req = GenerateRequest(model_name="gpt-4o-mini", input="Hello", cache=True, stream=True)
+        key = cache_key("openai", "gpt-4o-mini", [{"role": "user", "content": "Hello"}], {"temperature": 0.0})
+        response_cache.put(key, {**RESULT, "text": "x" * 100})
+
+        async def collect():
+            return [e async for e in generate_stream_async(req)]
+
+        events = asyncio.run(collect())
+        deltas = [e for e in events if e.startswith(b"event: delta")]
+        assert len(deltas) == 2
+        done = json.loads(events[-1].split(b"data: ", 1)[1])
+        assert done["cache"]["tier"] == "memory"
@@ -0,0 +1,138 @@
+"""
+Test provider client registry
+"""
+import asyncio
+from unittest.mock import Mock, patch
+
+import httpx
+
+from app.core.balancer import balancer
+from app.core.clients import ClientRegistry, gemini_endpoint, registry
+from app.llm import to_lc_messages, warm_clients
+from app.providers import providers
+from benchmarks.stub_server import StubConfig, StubServer
+
+
+class TestClientRegistry:
+    """Test ClientRegistry caching and lifecycle"""
+
+    def test_get_builds_once_per_key(self):
+        """Test factory runs once and the instance is reused"""
+        reg = ClientRegistry()
+        factory = Mock(side_effect=lambda: object())
+        first = reg.get(("openai", "gpt-4o-mini", 0.0), factory)
+        second = reg.get(("openai", "gpt-4o-mini", 0.0), factory)
+        assert first is second
+        assert factory.call_count == 1
+
+    def test_get_distinct_keys(self):
+        """Test different settings produce different clients"""
+        reg = ClientRegistry()
+        a = reg.get(("openai", "gpt-4o", 0.0), object)
+        b = reg.get(("openai", "gpt-4o", 0.7), object)
+        assert a is not b
+        assert len(reg) == 2
+
+    def test_lru_bound_closes_evicted_clients(self, monkeypatch):
+        """Test the cache keeps the most recently used clients and closes evicted ones after the grace period"""
+        monkeypatch.setattr("app.core.config.settings.LLM_CLIENT_CACHE_MAX", 2)
+        monkeypatch.setattr("app.core.config.settings.LLM_CLIENT_CLOSE_GRACE_S", 0.01)
+        reg = ClientRegistry()
+
+        def model():
+            m = Mock()
+            m.client.transport.close = Mock()
+            m.async_client_running = None
+            return m
+
+        async def scenario():
+            a = reg.get(("openai", "m", 0.1), model)
+            b = reg.get(("openai", "m", 0.2), model)
+            assert reg.get(("openai", "m", 0.1), model) is a  # a 最近用过，淘汰 b
+            reg.get(("openai", "m", 0.3), model)
+            still_open = not b.client.transport.close.called
+            await asyncio.sleep(0.05)
+            return a, b, still_open
+
+        a, b, still_open = asyncio.run(scenario())
+        assert len(reg) == 2 and reg.evicted == 1
+        assert still_open and b.client.transport.close.called
+        assert not a.client.transport.close.called
+
+    def test_shared_http_clients(self):
+        """Test the pooled httpx clients are process-wide singletons"""
+        reg = ClientRegistry()
+        assert reg.http_client() is reg.http_client()
+        assert isinstance(reg.async_http_client(), httpx.AsyncClient)
+        asyncio.run(reg.aclose())
+
+    def test_aclose_releases_everything(self):
+        """Test aclose drops models and closes pools"""
+        reg = ClientRegistry()
+        http = reg.http_client()
+        reg.get("k", object)
+        asyncio.run(reg.aclose())
+        assert len(reg) == 0
+        assert http.is_closed
+        assert reg.http_client() is not http
+        asyncio.run(reg.aclose())
+
+
+class TestProviderClients:
+    """Test llm.py uses the registry for provider clients"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_openai_client_reused(self, mock_openai):
+        """Test ChatOpenAI is constructed once with the shared pools"""
+        first = providers.get("openai").client("gpt-4o-mini", 0.0)
+        second = providers.get("openai").client("gpt-4o-mini", 0.0)
+        assert first is second
+        mock_openai.assert_called_once()
+        kwargs = mock_openai.call_args.kwargs
+        assert kwargs["http_client"] is registry.http_client()
+        assert kwargs["http_async_client"] is registry.async_http_client()
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    def test_gemini_client_reused(self, mock_gemini):
+        """Test ChatGoogleGenerativeAI is constructed once per key"""
+        providers.get("google").client("gemini-1.5-flash", 0.0)
+        providers.get("google").client("gemini-1.5-flash", 0.0)
+        providers.get("google").client("gemini-1.5-flash", 0.5)
+        assert mock_gemini.call_count == 2
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_warm_clients(self, mock_openai, mock_gemini, monkeypatch):
+        """Test warm-up builds one client per alias target"""
+        monkeypatch.setattr("app.core.config.settings.OPENAI_API_KEY", "sk-test")
+        monkeypatch.setattr("app.core.config.settings.GOOGLE_API_KEY", "")
+        warmed = warm_clients()
+        assert warmed == 2
+        assert mock_openai.call_count == 2
+        mock_gemini.assert_not_called()
+
+
+class TestGeminiEndpoint:
+    """Test Gemini base URLs (TLS proxy vs. plaintext gRPC)"""
+
+    def test_endpoint_parsing(self):
+        """Test the scheme selects TLS or plaintext"""
+        assert gemini_endpoint("https://proxy.example.com/") == ("proxy.example.com", True)
+        assert gemini_endpoint("http://127.0.0.1:9101") == ("127.0.0.1:9101", False)
+        assert gemini_endpoint("proxy.example.com:443") == ("proxy.example.com:443", True)
+
+    def test_plaintext_endpoint_round_trip(self, monkeypatch):
+        """Test sync and async calls reach a local plaintext gRPC upstream"""
+        with StubServer(StubConfig(reply="hi there")) as stub:
+            monkeypatch.setattr("app.core.config.settings.GOOGLE_BASE_URL", stub.gemini_url)
+            balancer.clear()
+            messages = to_lc_messages([{"role": "user", "content": "ping"}])
+            sync_reply = providers.get("google").client("gemini-1.5-flash", 0.0).invoke(messages)
+
+            async def scenario():
+                return await providers.get("google").client("gemini-1.5-flash", 0.0).ainvoke(messages)
+            async_reply = asyncio.run(scenario())
+
+        assert sync_reply.content == async_reply.content == "hi there"
+        assert async_reply.usage_metadata["output_tokens"] == 2
+        assert stub.requests == 2
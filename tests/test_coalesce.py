@@ -0,0 +1,197 @@
+"""
+Test single-flight coalescing of identical in-flight requests
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.coalesce import SingleFlight, StreamFlights, coalescing_stats
+from app.llm import generate_async, generate_stream_async
+from app.schemas.llm import GenerateRequest
+
+
+class TestSingleFlight:
+    """Test unary request coalescing"""
+
+    def test_followers_share_leader_result(self):
+        """Test concurrent identical calls run the function once"""
+        async def scenario():
+            flight = SingleFlight()
+            calls = 0
+
+            async def work():
+                nonlocal calls
+                calls += 1
+                await asyncio.sleep(0.01)
+                return "result"
+
+            outcomes = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+            return calls, outcomes, flight
+
+        calls, outcomes, flight = asyncio.run(scenario())
+        assert calls == 1
+        assert [r for r, _ in outcomes] == ["result"] * 5
+        assert sorted(shared for _, shared in outcomes) == [False, True, True, True, True]
+        assert flight.stats == {"leaders": 1, "coalesced": 4}
+        assert flight.in_flight() == 0
+
+    def test_errors_propagate_to_followers(self):
+        """Test a failing leader fails every waiter"""
+        async def scenario():
+            flight = SingleFlight()
+
+            async def boom():
+                await asyncio.sleep(0.01)
+                raise RuntimeError("upstream down")
+
+            return await asyncio.gather(*(flight.do("k", boom) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    def test_cancelled_waiter_does_not_cancel_others(self):
+        """Test one client dropping out leaves the shared call running"""
+        async def scenario():
+            flight = SingleFlight()
+
+            async def work():
+                await asyncio.sleep(0.02)
+                return "ok"
+
+            first = asyncio.ensure_future(flight.do("k", work))
+            second = asyncio.ensure_future(flight.do("k", work))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(scenario()) == ("ok", True)
+
+
+class TestStreamFlights:
+    """Test streaming coalescing with replay"""
+
+    def test_late_joiner_replays_then_follows(self):
+        """Test a late subscriber receives earlier deltas and the live tail"""
+        async def scenario():
+            flights = StreamFlights()
+            gate = asyncio.Event()
+
+            async def source():
+                yield "a"
+                yield "b"
+                await gate.wait()
+                yield "c"
+
+            first, shared_first = flights.join("k", source)
+            sub = first.subscribe()
+            seen_first = [await sub.__anext__(), await sub.__anext__()]
+            second, shared_second = flights.join("k", source)
+            gate.set()
+            seen_first += [x async for x in sub]
+            seen_second = [x async for x in second.subscribe()]
+            return first is second, shared_first, shared_second, seen_first, seen_second, flights.stats
+
+        same, shared_first, shared_second, seen_first, seen_second, stats = asyncio.run(scenario())
+        assert same
+        assert (shared_first, shared_second) == (False, True)
+        assert seen_first == seen_second == ["a", "b", "c"]
+        assert stats == {"leaders": 1, "coalesced": 1}
+
+    def test_last_subscriber_leaving_cancels_upstream(self):
+        """Test the upstream is cancelled once nobody is listening"""
+        async def scenario():
+            flights = StreamFlights()
+
+            async def source():
+                yield "a"
+                await asyncio.sleep(10)
+                yield "never"
+
+            flight, _ = flights.join("k", source)
+            sub = flight.subscribe()
+            await sub.__anext__()
+            await sub.aclose()
+            await asyncio.sleep(0)
+            return flight
+
+        flight = asyncio.run(scenario())
+        assert flight.task.cancelled() or flight.done
+
+    def test_upstream_error_reaches_subscribers(self):
+        """Test an upstream failure is raised to each subscriber"""
+        async def scenario():
+            flights = StreamFlights()
+
+            async def source():
+                yield "a"
+                raise RuntimeError("broken stream")
+
+            flight, _ = flights.join("k", source)
+            return [x async for x in flight.subscribe()]
+
+        with pytest.raises(RuntimeError, match="broken stream"):
+            asyncio.run(scenario())
+
+
+class TestCoalescedGeneration:
+    """Test coalescing inside generate_async / generate_stream_async"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_concurrent_identical_requests_go_upstream_once(self, mock_openai):
+        """Test identical deterministic requests share one upstream call"""
+        async def slow_invoke(_messages):
+            await asyncio.sleep(0.01)
+            return AIMessage(content="shared", usage_metadata={"input_tokens": 1, "output_tokens": 1, "total_tokens": 2})
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=slow_invoke)
+
+        async def scenario():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hello")
+            return await asyncio.gather(*(generate_async(req) for _ in range(4)))
+
+        outs = asyncio.run(scenario())
+        assert mock_openai.return_value.ainvoke.await_count == 1
+        assert sorted(o.observability["coalesced"] for o in outs) == [False, True, True, True]
+        assert len({o.id for o in outs}) == 4
+        assert coalescing_stats()["unary"]["coalesced"] == 3
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_non_deterministic_requests_are_not_coalesced(self, mock_openai):
+        """Test temperature > 0 requests each go upstream"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="x"))
+
+        async def scenario():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hello", temperature=0.7)
+            return await asyncio.gather(*(generate_async(req) for _ in range(3)))
+
+        outs = asyncio.run(scenario())
+        assert mock_openai.return_value.ainvoke.await_count == 3
+        assert "coalesced" not in outs[0].observability
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_concurrent_streams_share_upstream(self, mock_openai):
+        """Test identical streams are fed from a single astream call"""
+        calls = 0
+
+        async def fake_astream(_messages):
+            nonlocal calls
+            calls += 1
+            for part in ["Hel", "lo"]:
+                await asyncio.sleep(0.005)
+                yield AIMessageChunk(content=part)
+        mock_openai.return_value.astream = fake_astream
+
+        async def collect():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", stream=True)
+            return [e async for e in generate_stream_async(req)]
+
+        async def scenario():
+            return await asyncio.gather(collect(), collect())
+
+        first, second = asyncio.run(scenario())
+        assert calls == 1
+        assert b"".join(e for e in first if b"delta" in e) == b"".join(e for e in second if b"delta" in e)
+        flags = [json.loads(events[-1].split(b"data: ", 1)[1])["coalesced"] for events in (first, second)]
+        assert sorted(flags) == [False, True]
@@ -0,0 +1,123 @@
+"""
+Test response encoding, lazy raw payloads and compression
+"""
+import asyncio
+import gzip
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import zstandard
+from langchain_core.messages import AIMessage
+
+from app.core.encoding import compress, compress_stream, dumps, negotiate
+from app.llm import _coalescible
+from app.providers import providers
+from app.schemas.llm import GenerateRequest
+
+
+class TestNegotiation:
+    """Test Accept-Encoding parsing"""
+
+    def test_prefers_zstd_then_gzip(self):
+        """Test zstd wins when both are accepted"""
+        assert negotiate("gzip, deflate, br, zstd") == "zstd"
+        assert negotiate("gzip, deflate") == "gzip"
+        assert negotiate("br") is None
+        assert negotiate(None) is None
+
+    def test_q_values(self):
+        """Test q=0 refuses an encoding and higher q wins"""
+        assert negotiate("zstd;q=0, gzip") == "gzip"
+        assert negotiate("zstd;q=0.2, gzip;q=0.8") == "gzip"
+        assert negotiate("*") == "zstd"
+        assert negotiate("*, zstd;q=0") == "gzip"
+
+    def test_disabled(self, monkeypatch):
+        """Test compression can be switched off"""
+        monkeypatch.setattr("app.core.config.settings.RESPONSE_COMPRESSION", False)
+        assert negotiate("zstd, gzip") is None
+
+
+class TestEncoding:
+    """Test serialization and compression round-trips"""
+
+    def test_dumps_falls_back_to_str(self):
+        """Test non-JSON objects in raw payloads do not break encoding"""
+        body = json.loads(dumps({"raw": {"obj": object()}, "text": "你好"}))
+        assert body["text"] == "你好"
+        assert body["raw"]["obj"].startswith("<object")
+
+    def test_compress_round_trip(self):
+        """Test both encodings decode back to the original body"""
+        body = b'{"text":"' + b"x" * 10_000 + b'"}'
+        assert gzip.decompress(compress(body, "gzip")) == body
+        assert zstandard.ZstdDecompressor().decompress(compress(body, "zstd")) == body
+
+    def test_stream_is_decodable_incrementally(self):
+        """Test each compressed chunk can be decoded as soon as it arrives"""
+        lines = [b'{"index":%d}\n' % i for i in range(3)]
+
+        async def source():
+            for line in lines:
+                yield line
+
+        async def scenario(encoding):
+            return [chunk async for chunk in compress_stream(source(), encoding)]
+
+        dobj = zstandard.ZstdDecompressor().decompressobj()
+        chunks = asyncio.run(scenario("zstd"))
+        assert [dobj.decompress(c) for c in chunks[:3]] == lines
+        assert gzip.decompress(b"".join(asyncio.run(scenario("gzip")))) == b"".join(lines)
+
+
+class TestLazyRaw:
+    """Test provider payloads are only copied when requested"""
+
+    def test_raw_only_when_requested(self):
+        """Test mapping skips dict(resp) unless include_raw is set"""
+        resp = MagicMock(content="hi", usage_metadata={}, finish_reason="stop")
+        resp.__iter__.side_effect = AssertionError("raw payload materialized")
+        assert providers.get("openai").map_result(resp, "gpt-4o-mini")["raw"] is None
+        assert providers.get("google").map_result(resp, "gemini-1.5-flash")["raw"] is None
+
+        msg = AIMessage(content="hi")
+        assert providers.get("openai").map_result(msg, "gpt-4o-mini", include_raw=True)["raw"]["content"] == "hi"
+
+    def test_include_raw_is_not_coalesced(self):
+        """Test followers never share a leader's response when raw output is requested"""
+        assert _coalescible(GenerateRequest(model_name="gpt-4o-mini", input="x"))
+        assert not _coalescible(GenerateRequest(model_name="gpt-4o-mini", input="x", include_raw=True))
+
+
+class TestCompressedEndpoints:
+    """Test negotiated compression on the HTTP endpoints"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_large_unary_response_is_compressed(self, mock_openai, client):
+        """Test a large include_raw response is zstd-encoded when accepted"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="y" * 20_000))
+        body = {"model_name": "gpt-4o-mini", "input": "Hello", "include_raw": True}
+        response = client.post("/v1/generate", json=body, headers={"Accept-Encoding": "zstd"})
+        assert response.headers["content-encoding"] == "zstd"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.json()["raw"]["content"] == "y" * 20_000
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_small_unary_response_is_plain(self, mock_openai, client):
+        """Test small bodies skip compression"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hello"},
+                               headers={"Accept-Encoding": "gzip, zstd"})
+        assert "content-encoding" not in response.headers
+        assert response.json()["choices"][0]["content"] == "ok"
+        assert response.json()["raw"] is None
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_batch_stream_is_gzip_encoded(self, mock_openai, client):
+        """Test the NDJSON batch stream honours gzip"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="ok"))
+        items = [{"model_name": "gpt-4o-mini", "input": f"q{i}", "temperature": 0.5} for i in range(3)]
+        response = client.post("/v1/generate/batch", json={"items": items}, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert lines[-1]["summary"]["succeeded"] == 3
@@ -0,0 +1,153 @@
+"""
+Test request deadlines, client-disconnect cancellation and termination accounting
+"""
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app.core.lifecycle import (
+    RequestTerminated,
+    Supervisor,
+    supervise,
+    termination_reason,
+)
+from app.core.metrics import TERMINATED, TERMINATED_CHUNKS
+from app.llm import generate_stream_async
+from app.schemas.llm import GenerateRequest
+
+
+def _disconnect_after(event: asyncio.Event):
+    async def receive():
+        await event.wait()
+        return {"type": "http.disconnect"}
+    return receive
+
+
+class TestSupervisor:
+    """Test the per-request supervisor"""
+
+    def test_disconnect_cancels_work_immediately(self):
+        """Test a client disconnect cancels the awaited upstream call and reports 499"""
+        async def scenario():
+            gone = asyncio.Event()
+            seen = []
+
+            async def upstream():
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    seen.append(termination_reason())
+                    raise
+
+            asyncio.get_running_loop().call_later(0.02, gone.set)
+            t0 = asyncio.get_running_loop().time()
+            with pytest.raises(RequestTerminated) as info:
+                with Supervisor(_disconnect_after(gone)):
+                    await upstream()
+            return info.value, seen, asyncio.get_running_loop().time() - t0
+
+        error, seen, elapsed = asyncio.run(scenario())
+        assert error.status_code == 499 and error.reason == "client_disconnect"
+        assert seen == ["client_disconnect"]
+        assert elapsed < 1
+
+    def test_foreign_cancellation_propagates(self):
+        """Test cancellations not issued by the supervisor are not swallowed"""
+        async def scenario():
+            async def frames():
+                yield b"a"
+                await asyncio.sleep(10)
+
+            async def consume():
+                return [f async for f in supervise(frames(), Supervisor(timeout_s=5), lambda body: b"final")]
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+
+
+class TestDeadlines:
+    """Test timeout_ms on unary and streamed requests"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_unary_deadline_returns_504(self, mock_openai, client):
+        """Test a slow upstream call is cancelled at the deadline"""
+        cancelled = []
+
+        async def slow(messages):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        mock_openai.return_value.ainvoke = slow
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "temperature": 0.5,
+                                                     "timeout_ms": 50})
+        assert response.status_code == 504
+        assert response.json()["type"] == "deadline_exceeded" and response.json()["timeout_ms"] == 50
+        assert cancelled == [True]
+        assert TERMINATED.values[("openai", "gpt-4o-mini", "unary", "deadline_exceeded")] == 1
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_deadline_ends_with_error_event(self, mock_openai, client):
+        """Test a stream past its deadline ends with a deadline_exceeded error event instead of done"""
+        closed = []
+
+        async def astream(messages):
+            try:
+                yield AIMessageChunk(content="partial")
+                await asyncio.sleep(5)
+                yield AIMessageChunk(content="never")
+            finally:
+                closed.append(True)
+        mock_openai.return_value.astream = astream
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "stream": True,
+                                                     "temperature": 0.5, "timeout_ms": 1000,
+                                                     "stream_options": {"flush_ms": 0, "flush_bytes": 0}})
+        events = [block.split("\n", 1) for block in response.text.strip().split("\n\n")]
+        assert [e[0] for e in events] == ["event: meta", "event: delta", "event: error"]
+        assert json.loads(events[-1][1][len("data: "):])["type"] == "deadline_exceeded"
+        assert closed == [True]
+        assert TERMINATED_CHUNKS.values[("openai", "gpt-4o-mini")] == 1
+
+
+class TestDisconnect:
+    """Test a client disconnect mid-stream stops the upstream stream"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_disconnect_closes_upstream(self, mock_openai):
+        """Test the upstream generator is closed and no final frame is produced"""
+        closed = []
+
+        async def astream(messages):
+            try:
+                while True:
+                    yield AIMessageChunk(content="x")
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(True)
+        mock_openai.return_value.astream = astream
+
+        async def scenario():
+            gone = asyncio.Event()
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", stream=True, temperature=0.5,
+                                  stream_options={"flush_ms": 0, "flush_bytes": 0})
+            frames = []
+            stream = supervise(generate_stream_async(req), Supervisor(_disconnect_after(gone)), lambda b: b"final")
+            async for frame in stream:
+                frames.append(frame)
+                if len(frames) == 3:
+                    gone.set()
+            return frames
+
+        frames = asyncio.run(scenario())
+        assert closed == [True]
+        assert not any(f.startswith(b"event: done") or f == b"final" for f in frames)
+        assert TERMINATED.values[("openai", "gpt-4o-mini", "stream", "client_disconnect")] == 1
@@ -1,15 +1,20 @@
 """
 Test LLM module functionality
 """
+import asyncio
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
+from langchain_core.messages import AIMessage, AIMessageChunk
 from app.llm import (
     resolve_model, 
     normalize_messages, 
     to_lc_messages,
     generate_sync,
+    generate_async,
+    generate_stream_async,
     sse_event
 )
+from app.core.sse import delta_frame
 from app.schemas.llm import GenerateRequest, Message
 
 
@@ -102,7 +107,7 @@ class TestLangchainConversion:
 class TestGenerateSync:
     """Test synchronous generation"""
     
-    @patch('app.llm.ChatOpenAI')
+    @patch('app.providers.openai.ChatOpenAI')
     def test_generate_sync_openai(self, mock_openai):
         """Test synchronous generation with OpenAI"""
         # Setup mock
@@ -136,7 +141,7 @@ class TestGenerateSync:
         assert response.usage.completion_tokens == 20
         assert response.usage.total_tokens == 30
     
-    @patch('app.llm.ChatGoogleGenerativeAI')
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
     def test_generate_sync_gemini(self, mock_gemini):
         """Test synchronous generation with Gemini"""
         # Setup mock
@@ -181,6 +186,69 @@ class TestGenerateSync:
             generate_sync(req)
 
 
+class TestGenerateAsync:
+    """Test async generation path (ainvoke / astream)"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_generate_async_openai(self, mock_openai):
+        """Test async generation with OpenAI uses ainvoke"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="Async response",
+            usage_metadata={"input_tokens": 3, "output_tokens": 4, "total_tokens": 7},
+        ))
+
+        req = GenerateRequest(model_name="gpt-4o-mini", input="Hello")
+        response = asyncio.run(generate_async(req))
+
+        assert response.provider == "openai"
+        assert response.choices[0].content == "Async response"
+        assert response.usage.total_tokens == 7
+        mock_openai.return_value.ainvoke.assert_awaited_once()
+        mock_openai.return_value.invoke.assert_not_called()
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    def test_generate_async_gemini(self, mock_gemini):
+        """Test async generation with Gemini uses ainvoke"""
+        mock_gemini.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="Gemini async",
+            usage_metadata={"input_tokens": 5, "output_tokens": 6, "total_tokens": 11},
+        ))
+
+        req = GenerateRequest(model_name="gemini-flash", input="Hello")
+        response = asyncio.run(generate_async(req))
+
+        assert response.provider == "google"
+        assert response.model == "gemini-1.5-flash"
+        assert response.usage.prompt_tokens == 5
+        assert response.usage.completion_tokens == 6
+
+    def test_generate_async_unsupported_provider(self):
+        """Test that unsupported provider raises error"""
+        req = GenerateRequest(model_name="anthropic/claude-3", input="Hello")
+        with pytest.raises(ValueError, match="暂不支持的 provider"):
+            asyncio.run(generate_async(req))
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_generate_stream_async(self, mock_openai):
+        """Test async SSE generator yields meta, deltas and done"""
+        async def fake_astream(_messages):
+            for part in ["Hel", "", "lo"]:
+                yield AIMessageChunk(content=part)
+        mock_openai.return_value.astream = fake_astream
+
+        async def collect():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", stream=True)
+            return [e async for e in generate_stream_async(req)]
+
+        events = asyncio.run(collect())
+        assert events[0].startswith(b"event: meta\n")
+        assert [e for e in events if e.startswith(b"event: delta")] == [
+            delta_frame("Hel"),
+            delta_frame("lo"),
+        ]
+        assert events[-1].startswith(b"event: done\n")
+
+
 class TestSSEEvent:
     """Test SSE event formatting"""
     
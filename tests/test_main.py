@@ -31,4 +31,22 @@ def test_llm_generate_sync(client, sample_llm_request):
     assert "id" in data
     assert "model" in data
     assert "choices" in data
-    assert len(data["choices"]) > 0
\ No newline at end of file
+    assert len(data["choices"]) > 0
+
+def test_stats_endpoint(client):
+    """Test gateway stats expose cache and coalescing counters"""
+    response = client.get("/v1/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert "cache" in data
+    assert data["coalescing"]["unary"]["coalesced"] == 0
+    assert "stream" in data["coalescing"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_invalid_request_is_400(client, stream):
+    """Test unknown models and empty input are client errors, for unary and streaming requests"""
+    for body in ({"model_name": "no-such-model", "input": "hi"}, {"model_name": "gpt-4o-mini"}):
+        response = client.post("/v1/generate", json={**body, "stream": stream})
+        assert response.status_code == 400
+        assert response.json()["type"] == "invalid_request"
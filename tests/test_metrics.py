@@ -0,0 +1,161 @@
+"""
+Test Prometheus metrics and readiness reporting
+"""
+import asyncio
+import json
+import os
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.metrics import (
+    ERRORS,
+    IN_FLIGHT,
+    LATENCY,
+    REQUESTS,
+    TOKENS,
+    TTFT,
+    MetricsRegistry,
+    RecentWindow,
+    readiness,
+    recent,
+    track_request,
+)
+from app.llm import generate_async, generate_stream_async
+from app.schemas.llm import GenerateRequest
+
+
+class TestRegistry:
+    """Test counters, histograms and text exposition"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test rendered buckets accumulate and end with +Inf"""
+        reg = MetricsRegistry()
+        hist = reg.histogram("h_seconds", "help", ["provider"], (0.1, 1.0))
+        for v in (0.05, 0.5, 5.0):
+            hist.observe(("openai",), v)
+        text = reg.render(reg.collect())
+        assert '# TYPE h_seconds histogram' in text
+        assert 'h_seconds_bucket{provider="openai",le="0.1"} 1' in text
+        assert 'h_seconds_bucket{provider="openai",le="1"} 2' in text
+        assert 'h_seconds_bucket{provider="openai",le="+Inf"} 3' in text
+        assert 'h_seconds_count{provider="openai"} 3' in text
+
+    def test_label_values_are_escaped(self):
+        """Test quotes and backslashes in label values are escaped"""
+        reg = MetricsRegistry()
+        reg.counter("c_total", "help", ["model"]).inc(('a"b\\c',))
+        assert 'c_total{model="a\\"b\\\\c"} 1' in reg.render(reg.collect())
+
+    def test_multiprocess_snapshots_are_merged(self, tmp_path):
+        """Test counters sum across workers and gauges of dead workers are dropped"""
+        reg = MetricsRegistry()
+        counter = reg.counter("c_total", "help", ["provider"])
+        gauge = reg.gauge("g", "help", ["provider"])
+        counter.inc(("openai",), 2)
+        gauge.inc(("openai",))
+        dead = {"pid": 2 ** 22 + 12345, "metrics": {"c_total": [[["openai"], 3]], "g": [[["openai"], 7]]}}
+        (tmp_path / "dead.json").write_text(json.dumps(dead))
+
+        merged = reg.collect(str(tmp_path))
+
+        assert merged["c_total"][("openai",)] == 5
+        assert merged["g"][("openai",)] == 1
+        assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+class TestTracking:
+    """Test request instrumentation"""
+
+    def test_track_request_records_errors_by_type(self):
+        """Test a raised exception counts as an error with its type"""
+        with pytest.raises(TimeoutError):
+            with track_request("openai", "gpt-4o", "unary"):
+                assert IN_FLIGHT.values[("openai", "gpt-4o")] == 1
+                raise TimeoutError
+        assert IN_FLIGHT.values[("openai", "gpt-4o")] == 0
+        assert REQUESTS.values[("openai", "gpt-4o", "unary", "error")] == 1
+        assert ERRORS.values[("openai", "gpt-4o", "TimeoutError")] == 1
+        assert recent.totals("openai") == (1, 1)
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_generate_async_is_instrumented(self, mock_openai):
+        """Test unary generation records latency and token histograms"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="hi", usage_metadata={"input_tokens": 5, "output_tokens": 7, "total_tokens": 12},
+        ))
+        asyncio.run(generate_async(GenerateRequest(model_name="gpt-4o-mini", input="Hello")))
+
+        assert REQUESTS.values[("openai", "gpt-4o-mini", "unary", "ok")] == 1
+        assert LATENCY.values[("openai", "gpt-4o-mini", "unary")][2] == 1
+        assert TOKENS.values[("openai", "gpt-4o-mini", "completion")][1] == 7
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_unknown_models_share_one_label(self, mock_openai):
+        """Test arbitrary model and provider names from clients are recorded under the "other" label"""
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=ValueError("bad model"))
+        for name in ("openai/bogus-1", "openai/bogus-2", "anthropic/x"):
+            with pytest.raises(ValueError):
+                asyncio.run(generate_async(GenerateRequest(model_name=name, input="Hello", temperature=0.5)))
+
+        assert REQUESTS.values[("openai", "other", "unary", "error")] == 2
+        assert REQUESTS.values[("other", "other", "unary", "error")] == 1
+        assert not any("bogus" in label or "anthropic" in label for key in REQUESTS.values for label in key)
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_records_ttft(self, mock_openai):
+        """Test streamed generation records time to first token"""
+        async def astream(_messages):
+            yield AIMessageChunk(content="a")
+            yield AIMessageChunk(content="b", usage_metadata={"input_tokens": 1, "output_tokens": 2, "total_tokens": 3})
+        mock_openai.return_value.astream = astream
+
+        async def collect():
+            return [f async for f in generate_stream_async(GenerateRequest(model_name="gpt-4o-mini", input="x", stream=True))]
+
+        asyncio.run(collect())
+        assert REQUESTS.values[("openai", "gpt-4o-mini", "stream", "ok")] == 1
+        assert TTFT.values[("openai", "gpt-4o-mini")][2] == 1
+
+
+class TestReadiness:
+    """Test readiness reporting"""
+
+    def test_recent_window_expires_old_samples(self):
+        """Test samples older than the window no longer count"""
+        window = RecentWindow(window_s=60)
+        window.record("openai", True, now=1000)
+        window.record("openai", False, now=1050)
+        assert window.totals("openai", now=1055) == (2, 1)
+        assert window.totals("openai", now=1100) == (1, 0)
+
+    def test_high_error_rate_is_degraded(self, monkeypatch):
+        """Test a provider above the error-rate threshold fails readiness"""
+        monkeypatch.setattr("app.core.metrics.settings.READINESS_MIN_SAMPLES", 4)
+        for error in (True, True, True, False):
+            recent.record("google", error)
+        recent.record("openai", False)
+        report = readiness()
+        assert report["ready"] is False
+        assert report["providers"]["google"]["status"] == "degraded"
+        assert report["providers"]["openai"]["status"] == "ok"
+
+
+def test_metrics_endpoint(client):
+    """Test /metrics serves the Prometheus text format"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE llm_requests_total counter" in response.text
+    assert 'llm_cache_lookups_total{result="misses"} 0' in response.text
+
+
+def test_health_readiness(client):
+    """Test /health?ready=true reports per-provider state"""
+    recent.record("openai", False)
+    response = client.get("/health", params={"ready": "true"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "ready"
+    assert data["providers"]["openai"]["error_rate"] == 0.0
@@ -0,0 +1,96 @@
+"""
+Test the lazy provider registry and provider plugins
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app.llm import generate_async, generate_stream_async
+from app.providers import Provider, providers
+from app.schemas.llm import GenerateRequest
+
+
+class EchoProvider(Provider):
+    """A provider plugin that answers without any SDK"""
+    name = "echo"
+
+    def map_result(self, resp, real_model, include_raw=False):
+        return {"provider": self.name, "model": real_model, "text": resp, "finish_reason": "stop",
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}, "raw": None}
+
+    async def ainvoke(self, real_model, messages, temperature, include_raw, endpoint=None):
+        return self.map_result(messages[-1]["content"].upper(), real_model)
+
+    async def astream(self, real_model, messages, temperature, endpoint=None):
+        for word in messages[-1]["content"].split():
+            yield AIMessageChunk(content=word.upper() + " ")
+
+
+echo = EchoProvider()
+
+
+def _loaded_modules(code: str, **env) -> dict:
+    out = subprocess.run([sys.executable, "-c", code + "\nimport json, sys\nprint(json.dumps({m: m in sys.modules "
+                          "for m in ('langchain_openai', 'langchain_google_genai', 'grpc')}))"],
+                         capture_output=True, text=True, check=True, env={**os.environ, **env},
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+class TestLazyImports:
+    """Test provider SDKs are imported only when needed"""
+
+    def test_importing_the_app_loads_no_provider_sdk(self):
+        """Test importing app.main does not pull in langchain_openai, langchain_google_genai or gRPC"""
+        loaded = _loaded_modules("import app.main")
+        assert loaded == {"langchain_openai": False, "langchain_google_genai": False, "grpc": False}
+
+    def test_openai_only_deployment_never_loads_grpc(self):
+        """Test warm-up with only an OpenAI key leaves the Gemini SDK unloaded"""
+        loaded = _loaded_modules("import app.main\nfrom app.llm import warm_clients\nwarm_clients()",
+                                 OPENAI_API_KEY="sk-test", GOOGLE_API_KEY="")
+        assert loaded == {"langchain_openai": True, "langchain_google_genai": False, "grpc": False}
+
+    def test_supports_does_not_import(self):
+        """Test capability checks consult the registry table only"""
+        assert providers.supports("google")
+        assert not providers.supports("nope")
+        assert providers.loaded() == []
+        providers.get("openai")
+        assert providers.loaded() == ["openai"]
+
+
+class TestPlugins:
+    """Test adding providers without touching the dispatcher"""
+
+    def test_unknown_provider(self):
+        """Test unknown providers keep the existing error"""
+        with pytest.raises(ValueError, match="暂不支持的 provider: nope"):
+            providers.get("nope")
+
+    def test_plugin_from_settings(self, monkeypatch):
+        """Test a provider module listed in settings serves unary and streaming requests"""
+        monkeypatch.setattr("app.core.config.settings.LLM_PROVIDERS", {"echo": "tests.test_providers:echo"})
+        req = GenerateRequest(model_name="echo/echo-1", input="hello there")
+        out = asyncio.run(generate_async(req))
+        assert (out.provider, out.model, out.choices[0].content) == ("echo", "echo-1", "HELLO THERE")
+
+        async def scenario():
+            return [frame async for frame in generate_stream_async(req)]
+        body = b"".join(asyncio.run(scenario())).decode()
+        deltas = [json.loads(line[6:])["delta"] for line in body.splitlines()
+                  if line.startswith("data: ") and '"delta"' in line]
+        assert "".join(deltas) == "HELLO THERE "
+        assert "echo" in providers.configured()
+
+    def test_register_at_runtime(self):
+        """Test providers.register makes a provider available immediately"""
+        providers.register(EchoProvider(), "shout")
+        assert providers.supports("shout")
+        out = asyncio.run(generate_async(GenerateRequest(model_name="shout/any", input="hi")))
+        assert out.choices[0].content == "HI"
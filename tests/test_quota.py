@@ -0,0 +1,280 @@
+"""
+Test per-tenant quotas
+"""
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import settings
+from app.core.quota import (
+    QuotaExceeded,
+    QuotaLedger,
+    TenantInfo,
+    key_hash,
+    quota_ledger,
+)
+from app.db.base import Base
+from app.models import TenantUsage
+
+
+async def _session_factory():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+class TestLedger:
+    """Test in-memory reservation and settlement"""
+
+    def test_reserve_settle_and_reject(self):
+        """Test usage is debited after settlement and the quota is enforced"""
+        async def scenario():
+            ledger = QuotaLedger(window_s=3600, claim_tokens=100, claim_requests=10)
+            tenant = TenantInfo("acme", token_quota=1000, request_quota=None)
+            res = await ledger.reserve(tenant, 300)
+            after_reserve = ledger.remaining(tenant)
+            ledger.settle(res, 120)
+            ledger.settle(res, 120)  # 重复结算无效
+            after_settle = ledger.remaining(tenant)
+            with pytest.raises(QuotaExceeded) as exc:
+                await ledger.reserve(tenant, 900)
+            return after_reserve, after_settle, exc.value
+
+        after_reserve, after_settle, exc = asyncio.run(scenario())
+        assert after_reserve == (700, None)
+        assert after_settle == (880, None)
+        assert exc.kind == "token"
+        assert exc.headers["X-Quota-Remaining-Tokens"] == "880"
+        assert 0 < exc.retry_after_s <= 3600
+
+    def test_request_quota(self):
+        """Test the request count is limited independently of tokens"""
+        async def scenario():
+            ledger = QuotaLedger(window_s=3600, claim_tokens=100, claim_requests=1)
+            tenant = TenantInfo("acme", request_quota=2)
+            for _ in range(2):
+                ledger.settle(await ledger.reserve(tenant, 10_000), 10_000)
+            with pytest.raises(QuotaExceeded) as exc:
+                await ledger.reserve(tenant, 1)
+            return exc.value
+
+        assert asyncio.run(scenario()).kind == "request"
+
+    def test_window_rollover_resets_quota(self, monkeypatch):
+        """Test a new window starts with the full quota"""
+        now = [7200.0]
+        monkeypatch.setattr("app.core.quota.time.time", lambda: now[0])
+
+        async def scenario():
+            ledger = QuotaLedger(window_s=3600, claim_tokens=100, claim_requests=10)
+            tenant = TenantInfo("acme", token_quota=500)
+            ledger.settle(await ledger.reserve(tenant, 500), 500)
+            with pytest.raises(QuotaExceeded):
+                await ledger.reserve(tenant, 1)
+            now[0] += 3600
+            await ledger.reserve(tenant, 500)
+
+        asyncio.run(scenario())
+
+    def test_authenticate_by_key_hash(self):
+        """Test tenants are looked up by API key and unknown keys are rejected"""
+        async def scenario():
+            ledger = QuotaLedger(window_s=3600, claim_tokens=100, claim_requests=10)
+            await ledger.load_tenants({"acme": {"api_key": "sk-acme", "token_quota": 10}})
+            return ledger.authenticate("sk-acme"), ledger.authenticate("sk-other"), ledger.authenticate("")
+
+        tenant, other, empty = asyncio.run(scenario())
+        assert tenant == TenantInfo("acme", token_quota=10)
+        assert other is None and empty is None
+
+
+class TestDurableSync:
+    """Test claims and usage shared through the database"""
+
+    def test_workers_cannot_exceed_quota_together(self):
+        """Test two ledgers on one database never claim more than the quota"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            workers = [QuotaLedger(window_s=3600, claim_tokens=300, claim_requests=10) for _ in range(2)]
+            tenant = TenantInfo("acme", token_quota=1000)
+            granted = 0
+            for _ in range(10):
+                for ledger in workers:
+                    ledger.configure(factory)
+                    try:
+                        await ledger.reserve(tenant, 100)
+                        granted += 100
+                    except QuotaExceeded:
+                        pass
+            async with factory() as session:
+                row = await session.get(TenantUsage, ("acme", workers[0]._window(time.time())))
+            await engine.dispose()
+            return granted, row.tokens_claimed
+
+        granted, claimed = asyncio.run(scenario())
+        assert granted == 1000
+        assert claimed == 1000
+
+    def test_sync_writes_usage_and_close_releases_allowance(self):
+        """Test settled usage reaches the table and unspent claims are returned on close"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            ledger = QuotaLedger(window_s=3600, claim_tokens=500, claim_requests=10)
+            ledger.configure(factory)
+            await ledger.load_tenants({"acme": {"api_key": "sk-acme", "token_quota": 10_000, "request_quota": 100}})
+            tenant = ledger.authenticate("sk-acme")
+            ledger.settle(await ledger.reserve(tenant, 200), 150)
+            await ledger.sync()
+            window = ledger._window(time.time())
+            async with factory() as session:
+                synced = await session.get(TenantUsage, ("acme", window))
+                synced = (synced.tokens_used, synced.requests_used, synced.tokens_claimed)
+            await ledger.aclose()
+            async with factory() as session:
+                closed = await session.get(TenantUsage, ("acme", window))
+            await engine.dispose()
+            return synced, closed
+
+        synced, closed = asyncio.run(scenario())
+        assert synced == (150, 1, 500)
+        assert (closed.tokens_used, closed.tokens_claimed) == (150, 150)
+        assert (closed.requests_used, closed.requests_claimed) == (1, 1)
+
+
+    def test_reload_rotates_keys_and_revokes_tenants(self):
+        """Test a rotated key stops working and a tenant dropped from the config is revoked"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            ledger = QuotaLedger(window_s=3600, claim_tokens=500, claim_requests=10)
+            ledger.configure(factory)
+            await ledger.load_tenants({"acme": {"api_key": "sk-old"}, "gone": {"api_key": "sk-gone"}})
+            before = ledger.authenticate("sk-old"), ledger.authenticate("sk-gone")
+            await ledger.load_tenants({"acme": {"api_key": "sk-new"}})
+            await ledger.reload_tenants()
+            after = ledger.authenticate("sk-old"), ledger.authenticate("sk-new"), ledger.authenticate("sk-gone")
+            await engine.dispose()
+            return before, after
+
+        (old, gone), (stale, new, revoked) = asyncio.run(scenario())
+        assert old.id == "acme" and gone.id == "gone"
+        assert stale is None and new.id == "acme" and revoked is None
+
+    def test_sync_loop_survives_database_errors(self, monkeypatch):
+        """Test a failing tenant reload is counted and the sync loop keeps running"""
+        async def scenario():
+            ledger = QuotaLedger(window_s=3600, claim_tokens=500, claim_requests=10)
+            ledger.add_tenant(TenantInfo("acme"), key_hash("sk-acme"))
+            calls = []
+
+            async def flaky():
+                calls.append(True)
+                raise RuntimeError("database is locked")
+            monkeypatch.setattr(ledger, "reload_tenants", flaky)
+            task = asyncio.ensure_future(ledger.sync_forever(0.01))
+            await asyncio.sleep(0.1)
+            alive = not task.done()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return ledger, len(calls), alive
+
+        ledger, calls, alive = asyncio.run(scenario())
+        assert alive and calls >= 2
+        assert ledger.stats["failed_syncs"] == calls
+        assert ledger.authenticate("sk-acme").id == "acme"
+
+
+@pytest.fixture
+def tenant_client(client, monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.TENANT_AUTH_ENABLED", True)
+    quota_ledger.add_tenant(TenantInfo("acme", token_quota=1000, request_quota=3), key_hash("sk-acme"))
+    return client
+
+
+class TestQuotaEndpoints:
+    """Test authentication, headers and 429s on the generate endpoints"""
+
+    def test_missing_or_unknown_key_is_401(self, tenant_client):
+        """Test requests without a valid tenant key are rejected"""
+        body = {"model_name": "gpt-4o-mini", "input": "Hello"}
+        assert tenant_client.post("/v1/generate", json=body).status_code == 401
+        assert tenant_client.post("/v1/generate", json=body, headers={"X-API-Key": "nope"}).status_code == 401
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_headers_and_exhaustion(self, mock_openai, tenant_client):
+        """Test remaining-quota headers shrink and the tenant gets 429 once exhausted"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="hi", usage_metadata={"input_tokens": 5, "output_tokens": 5, "total_tokens": 10}))
+        body = {"model_name": "gpt-4o-mini", "input": "Hello"}
+        auth = {"Authorization": "Bearer sk-acme"}
+
+        first = tenant_client.post("/v1/generate", json=body, headers=auth)
+        second = tenant_client.post("/v1/generate", json=body, headers={"X-API-Key": "sk-acme"})
+        assert first.status_code == second.status_code == 200
+        assert first.headers["X-Quota-Remaining-Requests"] == "2"
+        assert second.headers["X-Quota-Remaining-Requests"] == "1"
+        assert int(first.headers["X-Quota-Reset"]) > 0
+        # 第一次按实际用量 10 结算，第二次仍是预扣中的估算值
+        assert int(second.headers["X-Quota-Remaining-Tokens"]) > 1000 - 10 - 2 * 300
+
+        tenant_client.post("/v1/generate", json=body, headers=auth)
+        limited = tenant_client.post("/v1/generate", json=body, headers=auth)
+        assert limited.status_code == 429
+        assert limited.json()["type"] == "quota_exceeded"
+        assert int(limited.headers["Retry-After"]) > 0
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_settles_from_done_event(self, mock_openai, tenant_client):
+        """Test a streamed response is debited by the usage in its done event"""
+        async def fake_astream(*args, **kwargs):
+            yield AIMessageChunk(content="hi")
+            yield AIMessageChunk(content="", usage_metadata={"input_tokens": 4, "output_tokens": 3, "total_tokens": 7})
+
+        mock_openai.return_value.astream = fake_astream
+        body = {"model_name": "gpt-4o-mini", "input": "Hello", "stream": True}
+        response = tenant_client.post("/v1/generate", json=body, headers={"X-API-Key": "sk-acme"})
+        assert response.status_code == 200
+        assert "event: done" in response.text
+        assert quota_ledger.remaining(TenantInfo("acme", token_quota=1000, request_quota=3)) == (993, 2)
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_public_stats_hide_tenant_accounts(self, mock_openai, tenant_client, monkeypatch):
+        """Test per-tenant balances and base URLs are only in the admin stats"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="hi", usage_metadata={"input_tokens": 5, "output_tokens": 5, "total_tokens": 10}))
+        monkeypatch.setattr("app.core.config.settings.OPENAI_BASE_URL", "https://internal.example/v1")
+        tenant_client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hello"},
+                           headers={"X-API-Key": "sk-acme"})
+        public = tenant_client.get("/v1/stats").json()
+        assert "accounts" not in public["quota"] and public["quota"]["tenants"] == 1
+        assert "internal.example" not in str(public)
+        assert tenant_client.get("/v1/admin/stats").status_code == 404
+        monkeypatch.setattr("app.core.config.settings.ADMIN_TOKEN", "secret")
+        detail = tenant_client.get("/v1/admin/stats", headers={"X-Admin-Token": "secret"}).json()
+        assert detail["quota"]["accounts"]["acme"]["remaining_requests"] == 2
+        assert detail["endpoints"]["openai"][0]["base_url"] == "https://internal.example/v1"
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_cut_short_is_still_charged(self, mock_openai, tenant_client):
+        """Test a stream that ends without done is charged at least the reserved estimate"""
+        async def fake_astream(*args, **kwargs):
+            yield AIMessageChunk(content="partial")
+            await asyncio.sleep(5)
+            yield AIMessageChunk(content="never")
+
+        mock_openai.return_value.astream = fake_astream
+        body = {"model_name": "gpt-4o-mini", "input": "Hello", "stream": True, "temperature": 0.5,
+                "timeout_ms": 300, "stream_options": {"flush_ms": 0, "flush_bytes": 0}}
+        response = tenant_client.post("/v1/generate", json=body, headers={"X-API-Key": "sk-acme"})
+        assert "deadline_exceeded" in response.text and "event: done" not in response.text
+        tokens, requests = quota_ledger.remaining(TenantInfo("acme", token_quota=1000, request_quota=3))
+        assert tokens <= 1000 - settings.RATE_LIMIT_EST_OUTPUT_TOKENS and requests == 2
@@ -0,0 +1,134 @@
+"""
+Test client-side token buckets and 429-aware backoff
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage
+
+from app.core.ratelimit import (
+    ProviderLimiter,
+    RateLimiter,
+    TokenBucket,
+    rate_limiter,
+    retry_after,
+)
+from app.llm import generate_async
+from app.schemas.llm import GenerateRequest
+
+
+def _rate_limit_error(headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers or {}, request=request)
+    return openai.RateLimitError("slow down", response=response, body=None)
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.RATE_LIMIT_BACKOFF_S", 0.0)
+    monkeypatch.setattr("app.core.config.settings.RATE_LIMIT_DEFAULT_RETRY_S", 0.01)
+
+
+class TestTokenBucket:
+    """Test bucket refill and wait computation"""
+
+    def test_delay_after_draining(self):
+        """Test an empty bucket waits for the missing share of the per-minute rate"""
+        bucket = TokenBucket(60)
+        bucket.updated = 100.0
+        assert bucket.delay(60, 100.0, 1.0) == 0
+        bucket.take(60)
+        assert bucket.delay(1, 100.0, 1.0) == pytest.approx(1.0)
+        assert bucket.delay(1, 101.0, 1.0) == 0
+
+    def test_oversized_request_only_needs_full_bucket(self):
+        """Test a request larger than capacity is admitted once the bucket is full"""
+        bucket = TokenBucket(100)
+        bucket.updated = 0.0
+        assert bucket.delay(500, 0.0, 1.0) == 0
+        bucket.take(500)
+        assert bucket.level == -400
+
+
+class TestAdaptive:
+    """Test 429-driven rate adjustment"""
+
+    def test_throttle_halves_rate_and_blocks(self):
+        """Test a 429 halves the effective rate and pauses dispatch"""
+        limiter = ProviderLimiter(rpm=100, tpm=None)
+        limiter.throttle(5.0)
+        state = limiter.state()
+        assert state["scale"] == 0.5
+        assert state["rpm"]["effective"] == 50
+        assert 4.0 < state["blocked_for_s"] <= 5.0
+        limiter.relax()
+        assert limiter.scale == pytest.approx(0.55)
+
+    def test_retry_after_header_is_honoured(self):
+        """Test retry-after values are read from the provider error"""
+        assert retry_after(_rate_limit_error({"retry-after": "7"})) == 7.0
+        assert retry_after(_rate_limit_error({"retry-after-ms": "250"})) == 0.25
+        assert retry_after(ValueError("other")) is None
+
+    def test_wrapped_rate_limit_is_detected(self):
+        """Test a rate limit error wrapped by another exception is still recognised"""
+        try:
+            try:
+                raise _rate_limit_error({"retry-after": "3"})
+            except openai.RateLimitError as e:
+                raise RuntimeError("wrapped") from e
+        except RuntimeError as wrapped:
+            assert retry_after(wrapped) == 3.0
+
+
+class TestCall:
+    """Test limited dispatch with retries"""
+
+    def test_retries_rate_limit_then_succeeds(self, fast_backoff):
+        """Test a 429 is retried and throttles the provider limiter"""
+        limiter = RateLimiter()
+        fn = AsyncMock(side_effect=[_rate_limit_error({"retry-after": "0.01"}), "ok"])
+
+        result, waited = asyncio.run(limiter.call("openai", 10, fn))
+
+        assert result == "ok"
+        assert fn.await_count == 2
+        assert waited > 0
+        assert limiter.state()["openai"]["throttled"] == 1
+
+    def test_non_rate_limit_errors_are_not_retried(self, fast_backoff):
+        """Test other errors propagate immediately for routing fallback"""
+        fn = AsyncMock(side_effect=ValueError("bad request"))
+        with pytest.raises(ValueError):
+            asyncio.run(RateLimiter().call("openai", 10, fn))
+        assert fn.await_count == 1
+
+    def test_gives_up_after_max_retries(self, fast_backoff, monkeypatch):
+        """Test persistent 429s surface after the retry budget"""
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMIT_MAX_RETRIES", 1)
+        fn = AsyncMock(side_effect=_rate_limit_error({"retry-after": "0"}))
+        with pytest.raises(openai.RateLimitError):
+            asyncio.run(RateLimiter().call("openai", 10, fn))
+        assert fn.await_count == 2
+
+
+class TestLimitedGeneration:
+    """Test limiter integration in generate_async"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_queue_wait_and_settlement(self, mock_openai, monkeypatch):
+        """Test queue wait is reported and token usage settles the estimate"""
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMITS", {"openai": {"rpm": 600, "tpm": 100_000}})
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="hi", usage_metadata={"input_tokens": 5, "output_tokens": 5, "total_tokens": 10},
+        ))
+        out = asyncio.run(generate_async(GenerateRequest(model_name="gpt-4o-mini", input="Hello")))
+
+        assert out.observability["queue_ms"] >= 0
+        limiter = rate_limiter.limiter("openai")
+        assert limiter.requests.level == 600 - 1
+        assert limiter.tokens.level == 100_000 - 10
+        assert rate_limiter.state()["openai"]["rpm"]["limit"] == 600
@@ -0,0 +1,159 @@
+"""
+Test write-behind request logging
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.request_log import RequestLogWriter, log_row, request_log
+from app.db.base import Base
+from app.llm import generate_async
+from app.models import RequestLog
+from app.schemas.llm import GenerateRequest
+
+
+async def _session_factory():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+async def _rows(factory):
+    async with factory() as session:
+        return (await session.execute(select(RequestLog).order_by(RequestLog.created_at))).scalars().all()
+
+
+def _row(i, **overrides):
+    row = log_row(f"req_{i}", "gpt-4o-mini", "openai", "gpt-4o-mini", "unary", "ok", None,
+                  {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}, 12, [{"role": "user", "content": "x"}])
+    return {**row, **overrides}
+
+
+class TestWriter:
+    """Test queueing, batching and shutdown flush"""
+
+    def test_batches_and_flushes_on_close(self):
+        """Test rows are inserted in batches and the tail is flushed on close"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            writer = RequestLogWriter(max_queue=100, batch_size=4, flush_s=60)
+            writer.start(factory)
+            for i in range(8):
+                writer.record(_row(i))
+            await asyncio.sleep(0.05)
+            writer.record(_row(8))
+            writer.record(_row(9))
+            await asyncio.sleep(0.05)
+            written_before_close = writer.stats["written"]
+            await writer.aclose()
+            rows = await _rows(factory)
+            await engine.dispose()
+            return written_before_close, rows, writer.stats
+
+        before, rows, stats = asyncio.run(scenario())
+        assert before == 8
+        assert len(rows) == 10
+        assert stats["batches"] == 3
+        assert rows[0].total_tokens == 3 and len(rows[0].prompt_hash) == 64
+
+    def test_overflow_drops_with_counter(self):
+        """Test rows beyond the queue bound are dropped and counted"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            writer = RequestLogWriter(max_queue=2, batch_size=100, flush_s=60)
+            writer.start(factory)
+            for i in range(5):
+                writer.record(_row(i))
+            queued = len(writer)
+            await writer.aclose()
+            await engine.dispose()
+            return queued, writer.stats
+
+        queued, stats = asyncio.run(scenario())
+        assert queued == 2
+        assert stats["dropped"] == 3
+        assert stats["written"] == 2
+
+    def test_overflow_spills_to_file(self, tmp_path, monkeypatch):
+        """Test the spill policy appends overflow rows as NDJSON"""
+        spill = tmp_path / "spill.ndjson"
+        monkeypatch.setattr("app.core.config.settings.REQUEST_LOG_OVERFLOW", "spill")
+        monkeypatch.setattr("app.core.config.settings.REQUEST_LOG_SPILL_PATH", str(spill))
+
+        async def scenario():
+            engine, factory = await _session_factory()
+            writer = RequestLogWriter(max_queue=1, batch_size=100, flush_s=60)
+            writer.start(factory)
+            for i in range(3):
+                writer.record(_row(i))
+            await writer.aclose()
+            await engine.dispose()
+            return writer.stats
+
+        stats = asyncio.run(scenario())
+        assert stats["spilled"] == 2
+        lines = spill.read_text().splitlines()
+        assert [json.loads(line)["id"] for line in lines] == ["req_1", "req_2"]
+
+    def test_failed_batch_is_counted(self):
+        """Test a database error does not block the writer and is counted"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            writer = RequestLogWriter(max_queue=10, batch_size=10, flush_s=60)
+            writer.start(factory)
+            writer.record(_row(1))
+            writer.record(_row(1))  # 主键冲突：整批失败
+            await writer.aclose()
+            await engine.dispose()
+            return writer.stats
+
+        stats = asyncio.run(scenario())
+        assert stats["failed_batches"] == 1
+        assert stats["dropped"] == 2
+
+    def test_disabled_writer_ignores_records(self):
+        """Test nothing is queued before the writer is started"""
+        writer = RequestLogWriter(max_queue=10, batch_size=10, flush_s=1)
+        writer.record(_row(1))
+        assert len(writer) == 0
+
+
+class TestGenerationLogging:
+    """Test generate_async feeds the request log"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_success_and_error_are_logged(self, mock_openai):
+        """Test successful and failed generations each produce a row"""
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=[
+            AIMessage(content="hi", usage_metadata={"input_tokens": 2, "output_tokens": 3, "total_tokens": 5}),
+            RuntimeError("upstream down"),
+        ])
+
+        async def scenario():
+            engine, factory = await _session_factory()
+            request_log.start(factory)
+            out = await generate_async(GenerateRequest(model_name="gpt-4o-mini", input="Hello"))
+            with pytest.raises(RuntimeError):
+                await generate_async(GenerateRequest(model_name="gpt-4o-mini", input="Hello again"))
+            await request_log.aclose()
+            rows = await _rows(factory)
+            await engine.dispose()
+            return out, rows
+
+        out, rows = asyncio.run(scenario())
+        assert [r.status for r in rows] == ["ok", "error"]
+        assert rows[0].id == out.id
+        assert rows[0].alias == "gpt-4o-mini" and rows[0].total_tokens == 5
+        assert rows[1].error_type == "RuntimeError"
+        assert rows[0].prompt_hash != rows[1].prompt_hash
@@ -0,0 +1,139 @@
+"""
+Test resumable SSE streams: event ids, Last-Event-ID replay and abandoned streams
+"""
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app.core.resume import StreamNotFound, parse_event_id, resumable_streams
+
+USAGE = {"input_tokens": 3, "output_tokens": 2, "total_tokens": 5}
+STREAM = {"model_name": "gpt-4o-mini", "input": "Hi", "stream": True, "temperature": 0.5,
+          "stream_options": {"flush_ms": 0, "flush_bytes": 0, "resumable": True}}
+
+
+def _events(text):
+    return [block for block in text.strip().split("\n\n") if block]
+
+
+def _ids(text):
+    return [block.split("\n", 1)[0][len("id: "):] for block in _events(text)]
+
+
+async def _frames(n, delay=0.0):
+    for i in range(n):
+        if delay:
+            await asyncio.sleep(delay)
+        yield f"event: delta\ndata: {i}\n\n".encode()
+
+
+class TestEventIds:
+    """Test ids on streamed events"""
+
+    def test_parse_event_id(self):
+        """Test ids split into stream id and sequence, anything else is not found"""
+        assert parse_event_id("rs_abc:12") == ("rs_abc", 12)
+        for bad in ("rs_abc", ":3", "rs_abc:x"):
+            with pytest.raises(StreamNotFound):
+                parse_event_id(bad)
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_ids_and_opt_in(self, mock_openai, client):
+        """Test every event carries <stream id>:<seq>, and streams are plain unless the request opts in"""
+        async def astream(messages):
+            yield AIMessageChunk(content="a")
+            yield AIMessageChunk(content="b", usage_metadata=USAGE)
+        mock_openai.return_value.astream = astream
+        response = client.post("/v1/generate", json=STREAM)
+        stream_id = response.headers["x-stream-id"]
+        assert _ids(response.text) == [f"{stream_id}:{i}" for i in range(len(_events(response.text)))]
+        assert _events(response.text)[-1].split("\n")[1] == "event: done"
+
+        plain = client.post("/v1/generate", json={**STREAM, "stream_options": {}})
+        assert "x-stream-id" not in plain.headers
+        assert all(block.startswith("event: ") for block in _events(plain.text))
+
+
+class TestResume:
+    """Test reconnecting with Last-Event-ID"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_replay_without_new_upstream_call(self, mock_openai, client):
+        """Test POST and GET resumes return only the missed events and never call upstream again"""
+        calls = []
+
+        async def astream(messages):
+            calls.append(True)
+            for token in "abc":
+                yield AIMessageChunk(content=token)
+            yield AIMessageChunk(content="", usage_metadata=USAGE)
+        mock_openai.return_value.astream = astream
+        first = client.post("/v1/generate", json=STREAM)
+        events = _events(first.text)
+        stream_id = first.headers["x-stream-id"]
+
+        resumed = client.post("/v1/generate", json=STREAM, headers={"Last-Event-ID": f"{stream_id}:1"})
+        assert _events(resumed.text) == events[2:]
+        by_get = client.get(f"/v1/streams/{stream_id}", params={"last_event_id": f"{stream_id}:0"})
+        assert _events(by_get.text) == events[1:]
+        assert calls == [True]
+        stats = client.get("/v1/stats").json()["resumable_streams"]
+        assert stats["started"] == 1 and stats["resumed"] == 2 and stats["running"] == 0
+
+    def test_unknown_or_mismatched_stream(self, client):
+        """Test unknown streams are 404 and an id from another stream is 400"""
+        response = client.post("/v1/generate", json=STREAM, headers={"Last-Event-ID": "rs_missing:3"})
+        assert response.status_code == 404 and response.json()["type"] == "stream_not_found"
+        assert client.get("/v1/streams/rs_missing").status_code == 404
+        response = client.get("/v1/streams/rs_a", headers={"Last-Event-ID": "rs_b:1"})
+        assert response.status_code == 400
+
+    def test_follow_live_and_tenant_isolation(self):
+        """Test a reconnect picks up where it left off while generation continues, only for its tenant"""
+        async def scenario():
+            stream = resumable_streams.start(_frames(6, delay=0.01), "acme", lambda: None)
+            got = []
+            async for frame in stream.subscribe():
+                got.append(frame)
+                if len(got) == 2:
+                    break
+            with pytest.raises(StreamNotFound):
+                resumable_streams.resume(stream.id, "other")
+            again = resumable_streams.resume(stream.id, "acme")
+            async for frame in again.subscribe(1):
+                got.append(frame)
+            return stream, got
+
+        stream, got = asyncio.run(scenario())
+        assert [f.split(b"\n", 1)[0].decode() for f in got] == [f"id: {stream.id}:{i}" for i in range(6)]
+
+    def test_evicted_events_are_reported(self, monkeypatch):
+        """Test asking for events pushed out of the ring buffer ends with resume_unavailable"""
+        monkeypatch.setattr("app.core.config.settings.STREAM_RESUME_BUFFER_BYTES", 100)
+
+        async def scenario():
+            stream = resumable_streams.start(_frames(20), None, lambda: None)
+            await stream.task
+            return stream, [f async for f in stream.subscribe(0)]
+
+        stream, frames = asyncio.run(scenario())
+        assert stream.first_seq > 1 and stream.size <= 100
+        assert len(frames) == 1 and b"resume_unavailable" in frames[0]
+
+    def test_abandoned_stream_is_terminated(self, monkeypatch):
+        """Test generation is stopped when nobody reconnects within the grace period"""
+        monkeypatch.setattr("app.core.config.settings.STREAM_RESUME_GRACE_S", 0.05)
+
+        async def scenario():
+            abandoned = []
+            stream = resumable_streams.start(_frames(1000, delay=0.01), None, lambda: abandoned.append(True))
+            async for _ in stream.subscribe():
+                break
+            await asyncio.sleep(0.2)
+            stream.task.cancel()
+            await asyncio.gather(stream.task, return_exceptions=True)
+            return abandoned
+
+        assert asyncio.run(scenario()) == [True]
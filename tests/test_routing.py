@@ -0,0 +1,150 @@
+"""
+Test ordered fallback and latency hedging across alias backends
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.routing import LatencyStats, latency_stats, route_call
+from app.llm import (
+    generate_async,
+    generate_stream_async,
+    resolve_backends,
+    resolve_model,
+)
+from app.schemas.llm import GenerateRequest
+
+PRIMARY = ("openai", "gpt-4o-mini")
+SECONDARY = ("google", "gemini-1.5-flash")
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.MODEL_ROUTES", {"fast": ["gpt-4o-mini", "gemini-flash"]})
+    monkeypatch.setattr("app.core.config.settings.HEDGE_DEFAULT_DELAY_MS", 50)
+
+
+class TestResolve:
+    """Test alias route resolution"""
+
+    def test_routes_resolve_to_ordered_backends(self, routes):
+        """Test a routed alias lists its backends and the primary comes first"""
+        assert resolve_backends("fast") == [PRIMARY, SECONDARY]
+        assert resolve_model("fast") == PRIMARY
+        assert resolve_backends("gpt-4o") == [("openai", "gpt-4o")]
+
+
+class TestRouteCall:
+    """Test the fallback / hedging race"""
+
+    def test_falls_back_on_error(self, routes):
+        """Test a failing primary falls through to the next backend"""
+        async def attempt(backend):
+            if backend == PRIMARY:
+                raise RuntimeError("boom")
+            return backend
+
+        result, route = asyncio.run(route_call([PRIMARY, SECONDARY], attempt, "unary"))
+        assert result == SECONDARY
+        assert route.describe() == {"backend": "google/gemini-1.5-flash", "hedged": False, "attempts": 2,
+                                    "errors": ["openai/gpt-4o-mini: RuntimeError"]}
+
+    def test_falls_back_on_timeout(self, routes, monkeypatch):
+        """Test a backend exceeding the attempt timeout is abandoned"""
+        monkeypatch.setattr("app.core.config.settings.HEDGE_ENABLED", False)
+        monkeypatch.setattr("app.core.config.settings.ROUTE_ATTEMPT_TIMEOUT_S", 0.05)
+
+        async def attempt(backend):
+            if backend == PRIMARY:
+                await asyncio.sleep(10)
+            return backend
+
+        result, route = asyncio.run(route_call([PRIMARY, SECONDARY], attempt, "unary"))
+        assert result == SECONDARY
+        assert route.errors == ["openai/gpt-4o-mini: TimeoutError"]
+
+    def test_hedge_fires_and_cancels_loser(self, routes):
+        """Test a slow primary is hedged and cancelled once the secondary wins"""
+        cancelled = []
+
+        async def attempt(backend):
+            if backend == PRIMARY:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(backend)
+                    raise
+            return backend
+
+        async def scenario():
+            out = await route_call([PRIMARY, SECONDARY], attempt, "unary")
+            await asyncio.sleep(0)
+            return out
+
+        result, route = asyncio.run(scenario())
+        assert result == SECONDARY
+        assert route.hedged is True
+        assert cancelled == [PRIMARY]
+
+    def test_all_backends_failing_raises_last_error(self, routes):
+        """Test the last backend's error surfaces when every backend fails"""
+        async def attempt(backend):
+            raise ValueError(backend[0])
+
+        with pytest.raises(ValueError, match="google"):
+            asyncio.run(route_call([PRIMARY, SECONDARY], attempt, "unary"))
+
+    def test_hedge_delay_follows_latency_percentile(self, monkeypatch):
+        """Test the hedge delay is the configured quantile of recent latencies"""
+        monkeypatch.setattr("app.core.config.settings.HEDGE_MIN_SAMPLES", 10)
+        stats = LatencyStats()
+        assert stats.hedge_delay(PRIMARY, "unary") == 2.0
+        for i in range(1, 101):
+            stats.record(PRIMARY, "unary", i / 100)
+        assert stats.hedge_delay(PRIMARY, "unary") == pytest.approx(0.96)
+
+
+class TestRoutedGeneration:
+    """Test routing inside generate_async / generate_stream_async"""
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_unary_reports_serving_backend(self, mock_openai, mock_gemini, routes):
+        """Test observability names the fallback backend that answered"""
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=RuntimeError("down"))
+        mock_gemini.return_value.ainvoke = AsyncMock(return_value=AIMessage(
+            content="from gemini", usage_metadata={"input_tokens": 1, "output_tokens": 1, "total_tokens": 2},
+        ))
+        out = asyncio.run(generate_async(GenerateRequest(model_name="fast", input="hi")))
+        assert out.provider == "google"
+        assert out.choices[0].content == "from gemini"
+        assert out.observability["route"]["backend"] == "google/gemini-1.5-flash"
+        assert out.observability["route"]["hedged"] is False
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_hedges_on_first_token(self, mock_openai, mock_gemini, routes):
+        """Test a stream without a first token in time is served by the hedge"""
+        async def slow(_messages):
+            await asyncio.sleep(10)
+            yield AIMessageChunk(content="late")
+
+        async def fast(_messages):
+            yield AIMessageChunk(content="quick")
+
+        mock_openai.return_value.astream = slow
+        mock_gemini.return_value.astream = fast
+
+        async def collect():
+            return [f async for f in generate_stream_async(GenerateRequest(model_name="fast", input="hi", stream=True))]
+
+        frames = asyncio.run(collect())
+        meta = json.loads(frames[0].split(b"data: ", 1)[1])
+        done = json.loads(frames[-1].split(b"data: ", 1)[1])
+        assert meta["provider"] == "google"
+        assert b"quick" in b"".join(frames)
+        assert done["observability"]["route"] == {"backend": "google/gemini-1.5-flash", "hedged": True, "attempts": 2}
+        assert latency_stats._samples[(SECONDARY, "ttft")]
@@ -0,0 +1,128 @@
+"""
+Test parallel multi-sample generation (n > 1)
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from app.core.sse import merge_deltas
+from app.core.stream_meter import StreamMeter
+from app.llm import generate_async, generate_stream_async, generate_sync
+from app.schemas.llm import GenerateRequest
+
+
+def _events(frames):
+    out = []
+    for frame in frames:
+        event, data = frame.decode().split("\n", 1)
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+class TestUnarySamples:
+    """Test n candidates on the unary path"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_openai_uses_native_n(self, mock_openai):
+        """Test OpenAI returns all candidates from one upstream call"""
+        usage = {"input_tokens": 5, "output_tokens": 6, "total_tokens": 11}
+        mock_openai.return_value.agenerate = AsyncMock(return_value=LLMResult(generations=[[
+            ChatGeneration(message=AIMessage(content=text, usage_metadata=usage),
+                           generation_info={"finish_reason": reason})
+            for text, reason in [("one", "stop"), ("two", "stop"), ("thr", "length")]
+        ]]))
+        req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", n=3, temperature=0.8)
+        out = asyncio.run(generate_async(req))
+
+        assert [(c.index, c.content, c.finish_reason) for c in out.choices] == \
+            [(0, "one", "stop"), (1, "two", "stop"), (2, "thr", "length")]
+        assert out.usage.total_tokens == 11
+        assert out.observability["samples"] == {"n": 3, "mode": "native"}
+        assert mock_openai.return_value.agenerate.await_count == 1
+        assert mock_openai.return_value.agenerate.call_args.kwargs["n"] == 3
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    def test_gemini_fans_out_and_sums_usage(self, mock_gemini):
+        """Test providers without native n get n concurrent calls with usage summed"""
+        usage = {"input_tokens": 4, "output_tokens": 2, "total_tokens": 6}
+        mock_gemini.return_value.ainvoke = AsyncMock(side_effect=[AIMessage(content=f"s{i}", usage_metadata=usage)
+                                                                  for i in range(3)])
+        req = GenerateRequest(model_name="gemini-flash", input="Hi", n=3, temperature=0.8)
+        out = asyncio.run(generate_async(req))
+
+        assert [c.content for c in out.choices] == ["s0", "s1", "s2"]
+        assert out.usage.model_dump(exclude_none=True) == {"prompt_tokens": 12, "completion_tokens": 6,
+                                                           "total_tokens": 18}
+        assert out.observability["samples"] == {"n": 3, "mode": "fanout"}
+        assert mock_gemini.return_value.ainvoke.await_count == 3
+
+    def test_sync_path_and_bounds_rejected(self, client):
+        """Test n > 1 is async-only and out-of-range n is a validation error"""
+        with pytest.raises(ValueError):
+            generate_sync(GenerateRequest(model_name="gpt-4o-mini", input="Hi", n=2))
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "n": 0})
+        assert response.status_code == 422
+
+
+class TestStreamedSamples:
+    """Test n candidates multiplexed onto one SSE stream"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_deltas_are_tagged_by_index(self, mock_openai):
+        """Test every candidate streams under its own index and usage is aggregated"""
+        calls = []
+
+        async def astream(messages):
+            sample = len(calls)
+            calls.append(sample)
+            for part in [f"s{sample}", "-a", "-b"]:
+                await asyncio.sleep(0)
+                yield AIMessageChunk(content=part)
+            yield AIMessageChunk(content="", usage_metadata={"input_tokens": 3, "output_tokens": 3, "total_tokens": 6},
+                                 response_metadata={"finish_reason": "stop"})
+        mock_openai.return_value.astream = astream
+
+        async def collect():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", stream=True, n=2, temperature=0.8,
+                                  stream_options={"flush_ms": 0, "flush_bytes": 0})
+            return _events([frame async for frame in generate_stream_async(req)])
+
+        events = asyncio.run(collect())
+        assert events[0][0] == "meta" and events[0][1]["n"] == 2
+        texts = {0: "", 1: ""}
+        for event, data in events:
+            if event == "delta":
+                texts[data["index"]] += data["delta"]
+        assert sorted(texts.values()) == ["s0-a-b", "s1-a-b"]
+        done = events[-1][1]
+        assert done["usage"]["total_tokens"] == 12
+        assert done["choices"] == [{"index": 0, "finish_reason": "stop"}, {"index": 1, "finish_reason": "stop"}]
+
+    def test_merge_propagates_failures(self):
+        """Test one failing candidate fails the merged stream"""
+        async def good():
+            for _ in range(100):
+                await asyncio.sleep(0)
+                yield "x"
+
+        async def bad():
+            yield "y"
+            raise RuntimeError("boom")
+
+        async def scenario():
+            return [item async for item in merge_deltas([good(), bad()], 4)]
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(scenario())
+
+    def test_meters_combine(self):
+        """Test combined meters add usage and keep the earliest first token"""
+        first, second = StreamMeter(0.0), StreamMeter(0.0)
+        first.first_at, first.chunks, first.total_tokens = 0.3, 2, 5
+        second.first_at, second.chunks, second.total_tokens = 0.1, 1, 7
+        combined = StreamMeter.combine([first, second])
+        assert combined.first_at == 0.1 and combined.chunks == 3 and combined.usage()["total_tokens"] == 12
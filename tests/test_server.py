@@ -0,0 +1,209 @@
+"""
+Test the multi-process launcher, cross-worker shared state and stream draining
+"""
+import asyncio
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from app.core.cache import ResponseCache
+from app.core.lifecycle import Supervisor, drain, supervise
+from app.core.ratelimit import RateLimiter
+from app.core.shared import SharedState, shared_state
+from benchmarks.stub_server import StubConfig, StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestSharedState:
+    """Test the SQLite WAL store seen by every worker"""
+
+    def test_buckets_are_global_across_connections(self, tmp_path):
+        """Test two processes' views draw from one bucket"""
+        path = str(tmp_path / "shared.sqlite")
+        first, second = SharedState(), SharedState()
+        first.configure(path)
+        second.configure(path)
+        assert first.take([("openai:rpm", 1, 2)]) == 0
+        assert second.take([("openai:rpm", 1, 2)]) == 0
+        assert first.take([("openai:rpm", 1, 2)]) > 0
+        # 多个桶要么全取要么全不取
+        assert second.take([("openai:tpm", 10, 100), ("openai:rpm", 1, 2)]) > 0
+        assert first.take([("openai:tpm", 100, 100)]) == 0
+
+    def test_pause_and_kv_expiry(self, tmp_path):
+        """Test a 429 pause is seen by other workers and kv entries expire"""
+        state = SharedState()
+        state.configure(str(tmp_path / "shared.sqlite"))
+        state.pause("google", time.time() + 5)
+        assert state.take([], pause_key="google") > 4
+        state.set("a", b"1", ttl_s=0.01)
+        state.set("b", b"2")
+        time.sleep(0.02)
+        assert state.get("a") is None and state.get("b") == b"2"
+
+    def test_lock_contention_falls_back_quickly(self, tmp_path, monkeypatch):
+        """Test a worker blocked on the write lock gives up fast and the limiter retries the shared bucket"""
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMITS", {"openai": {"rpm": 3}})
+        path = str(tmp_path / "shared.sqlite")
+        shared_state.configure(path)
+        holder = sqlite3.connect(path, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        try:
+            t0 = time.perf_counter()
+            assert shared_state.take([("openai:rpm", 1, 3)]) is None
+            shared_state.set("k", b"v")
+            assert time.perf_counter() - t0 < 1.0
+            assert shared_state.busy == 2
+            limiter = RateLimiter().limiter("openai")
+            assert 0 < limiter._take_shared(1) < 0.5
+            assert limiter.requests.level == 3   # 进程内的桶没有被拿来顶替
+        finally:
+            holder.execute("ROLLBACK")
+            holder.close()
+        assert limiter._take_shared(1) == 0
+
+    def test_rate_limit_is_shared_between_workers(self, tmp_path, monkeypatch):
+        """Test two limiters (one per worker) together stay within the rpm"""
+        monkeypatch.setattr("app.core.config.settings.RATE_LIMITS", {"openai": {"rpm": 3}})
+        shared_state.configure(str(tmp_path / "shared.sqlite"))
+        workers = [RateLimiter(), RateLimiter()]
+
+        async def scenario():
+            async def call(limiter):
+                return await asyncio.wait_for(limiter.limiter("openai").acquire(1), 0.2)
+            results = await asyncio.gather(*(call(workers[i % 2]) for i in range(4)), return_exceptions=True)
+            return sum(not isinstance(r, BaseException) for r in results)
+
+        assert asyncio.run(scenario()) == 3
+
+    def test_cache_hit_from_another_worker(self, tmp_path):
+        """Test a response cached by one worker is a shared-tier hit in another"""
+        shared_state.configure(str(tmp_path / "shared.sqlite"))
+        writer, reader = ResponseCache(16, 60), ResponseCache(16, 60)
+        writer.put("k", {"text": "hi", "usage": {}})
+        hit = asyncio.run(reader.get("k"))
+        assert hit.tier == "shared" and hit.result["text"] == "hi"
+        assert asyncio.run(reader.get("k")).tier == "memory"
+
+
+class TestDrain:
+    """Test in-flight streams are closed cleanly when a worker drains"""
+
+    def test_guard_passes_through_and_finishes_on_deadline(self):
+        """Test frames flow normally and a stalled stream gets the final frame at the deadline"""
+        async def frames():
+            yield b"a"
+            yield b"b"
+            await asyncio.sleep(10)
+            yield b"never"
+
+        async def scenario():
+            out = []
+            async for frame in supervise(frames(), Supervisor(), lambda body: body["type"].encode()):
+                out.append(frame)
+                if frame == b"b":
+                    drain.begin(0.05)
+            return out
+
+        assert asyncio.run(scenario()) == [b"a", b"b", b"server_shutdown"]
+
+    def test_readiness_reports_draining(self, client):
+        """Test the readiness probe fails while draining"""
+        drain.begin(5)
+        response = client.get("/health?ready=true")
+        assert response.status_code == 503
+        assert response.json()["status"] == "draining"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def launcher(tmp_path):
+    """Start python -m app.server with two workers against a slow stub upstream"""
+    stub = StubServer(StubConfig(token_rate=10, reply=" ".join(["word"] * 40))).start()
+    port = _free_port()
+    env = {**os.environ, "OPENAI_BASE_URL": stub.base_url + "/v1", "OPENAI_API_KEY": "sk-stub",
+           "GOOGLE_API_KEY": "", "SHUTDOWN_DRAIN_S": "1", "DATABASE_URL": "sqlite+aiosqlite:///:memory:",
+           "STREAM_FLUSH_MS": "0"}
+    proc = subprocess.Popen([sys.executable, "-m", "app.server", "--workers", "2", "--host", "127.0.0.1",
+                             "--port", str(port)], env=env, cwd=ROOT, start_new_session=True)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base + "/health?ready=true").status_code == 200:
+                break
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    yield proc, base
+    # master 和它 fork 出的 worker 在同一个进程组里，一起杀掉
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+    stub.stop()
+
+
+class TestLauncher:
+    """Test the pre-forking launcher end to end"""
+
+    def test_sigterm_drains_open_stream(self, launcher):
+        """Test an open SSE stream ends with a server_shutdown event and the server exits"""
+        proc, base = launcher
+        body = {"model_name": "gpt-4o-mini", "input": "hi", "stream": True}
+        received = b""
+        with httpx.stream("POST", base + "/v1/generate", json=body, timeout=30) as r:
+            for chunk in r.iter_bytes():
+                received += chunk
+                if b"event: delta" in received and proc.poll() is None and not received.endswith(b"#"):
+                    proc.send_signal(signal.SIGTERM)
+                    received += b"#"
+        assert b"event: delta" in received
+        assert b'"server_shutdown"' in received
+        assert b"event: done" not in received
+        assert proc.wait(timeout=15) == 0
+
+    def test_rolling_restart_keeps_serving(self, launcher):
+        """Test SIGHUP replaces workers without failed requests"""
+        proc, base = launcher
+        proc.send_signal(signal.SIGHUP)
+        statuses = []
+        deadline = time.monotonic() + 6
+        with httpx.Client(base_url=base, timeout=10) as client:
+            while time.monotonic() < deadline:
+                try:
+                    statuses.append(client.get("/health").status_code)
+                except httpx.HTTPError as e:
+                    statuses.append(type(e).__name__)
+                time.sleep(0.05)
+        assert statuses and set(statuses) == {200}
+
+    def test_workers_exit_when_master_is_killed(self, launcher):
+        """Test killing the master outright does not leave orphaned workers serving on the port"""
+        proc, base = launcher
+        proc.kill()
+        proc.wait()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                os.killpg(proc.pid, 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail("workers outlived the master")
+        with pytest.raises(httpx.HTTPError):
+            httpx.get(base + "/health", timeout=1)
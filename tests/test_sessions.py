@@ -0,0 +1,171 @@
+"""
+Test server-side conversation sessions
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app.core.accounting import estimate_message_tokens
+from app.core.conversations import (
+    ConversationState,
+    ConversationStore,
+    SessionNotFound,
+    conversations,
+)
+from app.core.quota import TenantInfo, key_hash, quota_ledger
+from app.db.base import Base
+
+
+async def _session_factory():
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+
+def _contents(messages):
+    return [m.content for m in messages]
+
+
+class TestWindowing:
+    """Test token-budgeted history windows"""
+
+    def test_window_keeps_system_and_newest_turns(self):
+        """Test older turns are dropped first while system messages always stay"""
+        conv = ConversationState("sess_x", None, 0.0)
+        conv.add("system", "be brief")
+        for i in range(10):
+            conv.add("user" if i % 2 == 0 else "assistant", f"turn {i} " + "x" * 36)
+        per_turn = estimate_message_tokens("turn 0 " + "x" * 36)
+        new = [{"role": "user", "content": "next"}]
+        budget = estimate_message_tokens("be brief") + estimate_message_tokens("next") + 3 * per_turn
+        prompt, info = conv.window(new, budget)
+        assert [m["content"][:6] for m in prompt] == ["be bri", "turn 7", "turn 8", "turn 9", "next"]
+        assert info["history_messages"] == 4
+        assert info["dropped_messages"] == 7
+
+    def test_memory_is_capped(self):
+        """Test long sessions keep only the newest turns in memory"""
+        conv = ConversationState("sess_x", None, 0.0)
+        conv.add("system", "sys")
+        for _ in range(50):
+            conv.add("user", "y" * 400)
+        conv.trim(1000)
+        assert conv.tokens <= 1000
+        assert conv.turns[0][0] == "system"
+        assert conv.next_seq == 51
+
+
+class TestStore:
+    """Test the LRU store and its persistent layer"""
+
+    def test_evicted_session_reloads_from_database(self):
+        """Test an evicted session comes back with all of its turns"""
+        async def scenario():
+            engine, factory = await _session_factory()
+            store = ConversationStore(max_sessions=1, max_tokens=10_000)
+            store.configure(factory)
+            first = await store.create(None, system="be brief")
+            store.append(first, [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+            await store.create(None)  # 淘汰 first
+            reloaded = await store.get(first.id)
+            store.append(reloaded, [{"role": "user", "content": "again"}])
+            await store.drain()
+            store.clear()
+            again = await store.get(first.id)
+            await engine.dispose()
+            return reloaded is not first, again.describe(), store.stats
+
+        replaced, described, stats = asyncio.run(scenario())
+        assert replaced
+        assert [m["content"] for m in described["messages"]] == ["be brief", "hi", "hello", "again"]
+        assert described["turns"] == 4
+        assert stats["loads"] == 1
+
+    def test_memory_only_eviction_and_tenant_isolation(self):
+        """Test unknown, evicted or foreign sessions are not found"""
+        async def scenario():
+            store = ConversationStore(max_sessions=1, max_tokens=10_000)
+            mine = await store.create("acme")
+            with pytest.raises(SessionNotFound):
+                await store.get(mine.id, "other")
+            await store.create("acme")
+            with pytest.raises(SessionNotFound):
+                await store.get(mine.id, "acme")
+
+        asyncio.run(scenario())
+
+
+class TestSessionEndpoints:
+    """Test /v1/sessions and session-aware generation"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_unary_turns_carry_history(self, mock_openai, client):
+        """Test only the new turn is sent by the client and the reply is appended"""
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=[AIMessage(content="Paris"),
+                                                                  AIMessage(content="About 2 million")])
+        session_id = client.post("/v1/sessions", json={"system": "Answer briefly"}).json()["id"]
+        first = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "session_id": session_id,
+                                                  "input": "Capital of France?"})
+        second = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "session_id": session_id,
+                                                   "input": "Population?"})
+        assert first.status_code == second.status_code == 200
+        sent = mock_openai.return_value.ainvoke.call_args_list[1].args[0]
+        assert _contents(sent) == ["Answer briefly", "Capital of France?", "Paris", "Population?"]
+        assert [type(m).__name__ for m in sent] == ["SystemMessage", "HumanMessage", "AIMessage", "HumanMessage"]
+        assert second.json()["observability"]["session"]["history_messages"] == 3
+
+        history = client.get(f"/v1/sessions/{session_id}").json()
+        assert [m["role"] for m in history["messages"]] == ["system", "user", "assistant", "user", "assistant"]
+        assert history["messages"][-1]["content"] == "About 2 million"
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_streamed_reply_is_appended(self, mock_openai, client):
+        """Test a completed stream appends the assembled reply"""
+        async def astream(messages):
+            for part in ["Hel", "lo"]:
+                yield AIMessageChunk(content=part)
+        mock_openai.return_value.astream = astream
+        session_id = client.post("/v1/sessions", json={}).json()["id"]
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "session_id": session_id,
+                                                     "input": "Hi", "stream": True})
+        assert '"session"' in response.text.split("event: delta")[0]
+        messages = client.get(f"/v1/sessions/{session_id}").json()["messages"]
+        assert messages == [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_failed_turn_is_not_recorded(self, mock_openai, client):
+        """Test an upstream failure leaves the history unchanged"""
+        mock_openai.return_value.ainvoke = AsyncMock(side_effect=RuntimeError("boom"))
+        session_id = client.post("/v1/sessions", json={}).json()["id"]
+        with pytest.raises(RuntimeError):
+            client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "session_id": session_id, "input": "Hi"})
+        assert client.get(f"/v1/sessions/{session_id}").json()["messages"] == []
+
+    def test_unknown_and_deleted_sessions_are_404(self, client):
+        """Test missing sessions, deletion and batch rejection"""
+        body = {"model_name": "gpt-4o-mini", "session_id": "sess_missing", "input": "Hi"}
+        assert client.post("/v1/generate", json=body).json()["type"] == "session_not_found"
+        session_id = client.post("/v1/sessions", json={}).json()["id"]
+        assert client.delete(f"/v1/sessions/{session_id}").status_code == 204
+        assert client.get(f"/v1/sessions/{session_id}").status_code == 404
+        batch = {"items": [{"model_name": "gpt-4o-mini", "session_id": session_id, "input": "Hi"}]}
+        assert client.post("/v1/generate/batch", json=batch).status_code == 400
+
+    def test_sessions_belong_to_their_tenant(self, client, monkeypatch):
+        """Test another tenant cannot read or use a session"""
+        monkeypatch.setattr("app.core.config.settings.TENANT_AUTH_ENABLED", True)
+        quota_ledger.add_tenant(TenantInfo("acme"), key_hash("sk-acme"))
+        quota_ledger.add_tenant(TenantInfo("other"), key_hash("sk-other"))
+        session_id = client.post("/v1/sessions", json={}, headers={"X-API-Key": "sk-acme"}).json()["id"]
+        assert client.get(f"/v1/sessions/{session_id}", headers={"X-API-Key": "sk-acme"}).status_code == 200
+        assert client.get(f"/v1/sessions/{session_id}", headers={"X-API-Key": "sk-other"}).status_code == 404
+        assert conversations.describe()["sessions"] == 1
@@ -0,0 +1,108 @@
+"""
+Test SSE frame encoding, delta coalescing and backpressure
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.core.sse import coalesce_deltas, delta_frame, sse_frame
+
+
+def _run(texts, flush_ms, flush_bytes, queue_size=8):
+    async def scenario():
+        return [t async for t in coalesce_deltas(texts, flush_ms, flush_bytes, queue_size)]
+    return asyncio.run(scenario())
+
+
+async def _instant(parts):
+    for part in parts:
+        yield part
+
+
+class TestFrames:
+    """Test pre-encoded SSE frames"""
+
+    def test_delta_frame_matches_generic_frame(self):
+        """Test the fast delta writer produces the same payload as sse_frame"""
+        fast = delta_frame("你好 \"x\"", index=2)
+        generic = sse_frame("delta", {"index": 2, "delta": "你好 \"x\""})
+        assert fast == generic
+        assert json.loads(fast.split(b"data: ", 1)[1]) == {"index": 2, "delta": "你好 \"x\""}
+
+    def test_frame_layout(self):
+        """Test frames are event line, data line, blank line"""
+        frame = sse_frame("done", {"ok": True})
+        assert frame == b'event: done\ndata: {"ok":true}\n\n'
+
+
+class TestCoalesceDeltas:
+    """Test delta coalescing policies"""
+
+    def test_per_delta_mode(self):
+        """Test zero window and budget forward every delta"""
+        assert _run(_instant(["a", "b", "c"]), 0, 0) == ["a", "b", "c"]
+
+    def test_first_token_flushed_then_merged(self):
+        """Test the first delta goes out alone and the rest are merged"""
+        assert _run(_instant(["a", "b", "c", "d"]), 1000, 0) == ["a", "bcd"]
+
+    def test_byte_budget(self):
+        """Test frames are cut when the byte budget is reached"""
+        assert _run(_instant(["a", "bb", "cc", "dd", "e"]), 0, 4) == ["a", "bbcc", "dde"]
+
+    def test_time_window_flushes_without_new_chunks(self):
+        """Test buffered text is flushed when the window expires even if upstream stalls"""
+        async def slow():
+            yield "a"
+            yield "b"
+            await asyncio.sleep(0.1)
+            yield "c"
+
+        async def scenario():
+            seen = []
+            loop = asyncio.get_running_loop()
+            t0 = loop.time()
+            async for text in coalesce_deltas(slow(), 10, 0, 8):
+                seen.append((text, loop.time() - t0))
+            return seen
+
+        seen = asyncio.run(scenario())
+        assert [t for t, _ in seen] == ["a", "b", "c"]
+        assert seen[1][1] < 0.08  # "b" was not held until "c" arrived
+
+    def test_error_propagates_after_flushing_buffer(self):
+        """Test an upstream error surfaces after pending text is delivered"""
+        async def broken():
+            yield "a"
+            yield "b"
+            raise RuntimeError("upstream broke")
+
+        async def scenario():
+            seen = []
+            with pytest.raises(RuntimeError, match="upstream broke"):
+                async for text in coalesce_deltas(broken(), 1000, 0, 8):
+                    seen.append(text)
+            return seen
+
+        assert asyncio.run(scenario()) == ["a", "b"]
+
+    def test_backpressure_bounds_read_ahead(self):
+        """Test a slow consumer stops the producer from reading far ahead"""
+        produced = 0
+
+        async def fast():
+            nonlocal produced
+            for i in range(100):
+                produced += 1
+                yield str(i)
+
+        async def scenario():
+            gen = coalesce_deltas(fast(), 0, 1, 4)
+            await gen.__anext__()
+            await asyncio.sleep(0.01)
+            ahead = produced
+            await gen.aclose()
+            return ahead
+
+        assert asyncio.run(scenario()) <= 4 + 3
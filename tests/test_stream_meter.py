@@ -0,0 +1,99 @@
+"""
+Test stream usage / TTFT / inter-token accounting
+"""
+import asyncio
+import json
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessageChunk
+
+from app.core.stream_meter import StreamMeter
+from app.llm import generate_stream, generate_stream_async
+from app.schemas.llm import GenerateRequest
+
+
+def _done(events):
+    last = events[-1].decode() if isinstance(events[-1], bytes) else events[-1]
+    assert last.startswith("event: done\n")
+    return json.loads(last.split("data: ", 1)[1])
+
+
+class TestStreamMeter:
+    """Test StreamMeter bookkeeping"""
+
+    def test_ttft_and_gaps(self):
+        """Test first-token time and inter-token gaps are recorded"""
+        with patch("app.core.stream_meter.time.perf_counter", side_effect=[0.0, 0.1, 0.15, 0.35, 0.5]):
+            meter = StreamMeter()
+            meter.observe(AIMessageChunk(content="a"), True)
+            meter.observe(AIMessageChunk(content="b"), True)
+            meter.observe(AIMessageChunk(content="c"), True)
+            obs = meter.observability()
+        assert obs["ttft_ms"] == 100.0
+        assert obs["chunks"] == 3
+        assert obs["inter_token_ms"]["max"] == 200.0
+        assert obs["latency_ms"] == 500
+
+    def test_no_text_means_no_ttft(self):
+        """Test empty streams report no TTFT"""
+        meter = StreamMeter()
+        meter.observe(AIMessageChunk(content=""), False)
+        assert meter.observability()["ttft_ms"] is None
+
+    def test_usage_accumulates_incremental_chunks(self):
+        """Test Gemini-style per-chunk usage deltas are summed"""
+        meter = StreamMeter()
+        meter.observe(AIMessageChunk(content="a", usage_metadata={"input_tokens": 5, "output_tokens": 1, "total_tokens": 6}), True)
+        meter.observe(AIMessageChunk(content="b", usage_metadata={"input_tokens": 0, "output_tokens": 2, "total_tokens": 2,
+                                                                  "output_token_details": {"reasoning": 1}}), True)
+        assert meter.usage() == {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8, "reasoning_tokens": 1}
+
+    def test_finish_reason_from_metadata(self):
+        """Test finish reason is taken from the final chunk metadata"""
+        meter = StreamMeter()
+        meter.observe(AIMessageChunk(content="", response_metadata={"finish_reason": "LENGTH"}), False)
+        assert meter.finish_reason == "length"
+
+
+def _openai_style_stream(_messages):
+    yield AIMessageChunk(content="Hel")
+    yield AIMessageChunk(content="lo")
+    yield AIMessageChunk(content="", usage_metadata={"input_tokens": 4, "output_tokens": 2, "total_tokens": 6},
+                         response_metadata={"finish_reason": "stop"})
+
+
+class TestStreamDoneEvent:
+    """Test done events carry real usage and timing"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_async_stream_reports_usage(self, mock_openai):
+        """Test the async stream done event reports usage from the final chunk"""
+        async def fake_astream(messages):
+            for chunk in _openai_style_stream(messages):
+                yield chunk
+        mock_openai.return_value.astream = fake_astream
+
+        async def collect():
+            req = GenerateRequest(model_name="gpt-4o-mini", input="Hi", stream=True, temperature=0.2)
+            return [e async for e in generate_stream_async(req)]
+
+        done = _done(asyncio.run(collect()))
+        assert done["usage"] == {"prompt_tokens": 4, "completion_tokens": 2, "total_tokens": 6}
+        assert done["observability"]["chunks"] == 2
+        assert done["observability"]["ttft_ms"] is not None
+        assert set(done["observability"]["inter_token_ms"]) == {"p50", "p95", "max"}
+
+    @patch('app.providers.google.ChatGoogleGenerativeAI')
+    def test_sync_stream_reports_usage_for_gemini(self, mock_gemini):
+        """Test the sync stream accumulates Gemini usage deltas"""
+        mock_gemini.return_value.stream = lambda _m: iter([
+            AIMessageChunk(content="A", usage_metadata={"input_tokens": 3, "output_tokens": 1, "total_tokens": 4}),
+            AIMessageChunk(content="B", usage_metadata={"input_tokens": 0, "output_tokens": 1, "total_tokens": 1}),
+        ])
+        req = GenerateRequest(model_name="gemini-flash", input="Hi", stream=True)
+
+        done = _done(list(generate_stream(req)))
+
+        assert done["usage"]["total_tokens"] == 5
+        assert done["usage"]["completion_tokens"] == 2
+        assert done["latency_ms"] == done["observability"]["latency_ms"]
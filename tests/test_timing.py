@@ -0,0 +1,89 @@
+"""
+Test per-request stage timings and the admin sampling profiler
+"""
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.core.timing import collect_timings, span
+from app.llm import generate_sync
+from app.schemas.llm import GenerateRequest
+
+USAGE = {"input_tokens": 3, "output_tokens": 2, "total_tokens": 5}
+
+
+class TestStageTimings:
+    """Test the stage breakdown behind the debug header"""
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_unary_breakdown_with_header(self, mock_openai, client):
+        """Test observability.timings and Server-Timing report the gateway stages"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="hi", usage_metadata=USAGE))
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "temperature": 0.5},
+                               headers={"X-Debug-Timing": "1"})
+        timings = response.json()["observability"]["timings"]
+        for stage in ("parse", "normalize", "resolve", "preflight", "cache", "queue", "client", "upstream", "map",
+                      "build", "total"):
+            assert timings[stage] >= 0
+        assert timings["total"] >= timings["upstream"]
+        header = dict(part.split(";dur=") for part in response.headers["server-timing"].split(", "))
+        assert "encode" in header and float(header["total"]) >= timings["total"]
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_no_header_no_timings(self, mock_openai, client):
+        """Test responses are unchanged without the debug header"""
+        mock_openai.return_value.ainvoke = AsyncMock(return_value=AIMessage(content="hi", usage_metadata=USAGE))
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "temperature": 0.5})
+        assert "timings" not in response.json()["observability"]
+        assert "server-timing" not in response.headers
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_stream_done_carries_timings(self, mock_openai, client):
+        """Test the done event reports the stages up to the first token"""
+        async def astream(messages):
+            yield AIMessageChunk(content="a")
+            yield AIMessageChunk(content="b", usage_metadata=USAGE)
+        mock_openai.return_value.astream = astream
+        response = client.post("/v1/generate", json={"model_name": "gpt-4o-mini", "input": "Hi", "stream": True,
+                                                     "temperature": 0.5}, headers={"X-Debug-Timing": "1"})
+        done = response.text.strip().split("\n\n")[-1]
+        timings = json.loads(done.split("data: ", 1)[1])["observability"]["timings"]
+        assert {"parse", "preflight", "client", "first_token", "total"} <= set(timings)
+
+    @patch('app.providers.openai.ChatOpenAI')
+    def test_collect_timings_for_sync_calls(self, mock_openai):
+        """Test scripts can time generate_sync, and spans are no-ops outside a collection"""
+        mock_openai.return_value.invoke = MagicMock(return_value=AIMessage(content="hi", usage_metadata=USAGE))
+        with span("ignored"):
+            pass
+        with collect_timings() as timings:
+            out = generate_sync(GenerateRequest(model_name="gpt-4o-mini", input="Hi", temperature=0.5))
+        assert {"normalize", "preflight", "upstream", "build"} <= set(timings.spans)
+        assert "ignored" not in timings.spans
+        assert out.observability["timings"]["upstream"] >= 0
+
+
+class TestProfiler:
+    """Test the admin-only sampling profiler endpoint"""
+
+    def test_requires_admin_token(self, client, monkeypatch):
+        """Test the endpoint is hidden without a token and rejects a wrong one"""
+        assert client.get("/v1/admin/profile?seconds=0.1").status_code == 404
+        monkeypatch.setattr("app.core.config.settings.ADMIN_TOKEN", "secret")
+        response = client.get("/v1/admin/profile?seconds=0.1", headers={"Authorization": "Bearer wrong"})
+        assert response.status_code == 401
+        response = client.get("/v1/admin/profile?seconds=999", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 400
+
+    def test_returns_collapsed_stacks(self, client, monkeypatch):
+        """Test the output is flamegraph-compatible: frames joined by ';' and a sample count"""
+        monkeypatch.setattr("app.core.config.settings.ADMIN_TOKEN", "secret")
+        response = client.get("/v1/admin/profile?seconds=0.2&interval_ms=2", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        lines = response.text.strip().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0 and ";" in stack
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) >= 10